@@ -0,0 +1,350 @@
+"""
+查询接口的准入控制
+
+同时处理的请求数不超过上限，超出的请求进入有界的等待队列；队列已满或等待超时时立即拒绝，
+由API返回429和Retry-After，避免流量突增时所有请求一起变慢直到客户端超时。
+
+等待队列按租户（user_id，没有时为客户端IP）做加权公平排队（start-time fair queuing）：
+每个请求到达时按租户的权重打上虚拟时间标签，有空位时先放行标签最小的请求。
+某个租户用脚本大量发送请求时只会排在自己之前的请求后面，其他租户的请求仍然按各自的份额很快得到处理。
+直接准入（没有排队）的请求同样推进租户的标签，空闲时占满所有并发的租户在出现竞争时不会继续占优。
+
+开启自适应后按AIMD调整上限：请求耗时接近无负载时的基线时每完成约limit个请求上限加1，
+耗时超过基线的 SCIAGENT_LATENCY_TOLERANCE 倍或请求出错时上限乘以0.9（每个基线耗时内最多减少一次），
+上限在 SCIAGENT_MIN_IN_FLIGHT 和 SCIAGENT_MAX_IN_FLIGHT 之间。基线取观察到的最小耗时，并缓慢上浮以适应模型本身的变化。
+
+只在事件循环中使用，不需要加锁。
+
+配置（环境变量）:
+- SCIAGENT_MAX_IN_FLIGHT: 同时处理的请求数上限，默认32，设为0时不做准入控制
+- SCIAGENT_ADMISSION_QUEUE: 等待队列的长度，默认64
+- SCIAGENT_TENANT_QUEUE: 每个租户最多排队的请求数，默认16
+- SCIAGENT_ADMISSION_QUEUE_TIMEOUT: 在队列中最多等待的秒数，默认10
+- SCIAGENT_TENANT_WEIGHTS: 租户权重，例如 "alice=4,ip:10.0.0.8=0.5"，未列出的租户权重为1
+- SCIAGENT_ADAPTIVE_LIMIT: 设为1时根据请求耗时自适应调整上限
+- SCIAGENT_MIN_IN_FLIGHT: 自适应调整时上限的最小值，默认4
+- SCIAGENT_LATENCY_TOLERANCE: 耗时超过基线多少倍时视为过载，默认2.0
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+MAX_IN_FLIGHT = int(os.getenv("SCIAGENT_MAX_IN_FLIGHT", "32"))
+QUEUE_SIZE = int(os.getenv("SCIAGENT_ADMISSION_QUEUE", "64"))
+TENANT_QUEUE_SIZE = int(os.getenv("SCIAGENT_TENANT_QUEUE", "16"))
+QUEUE_TIMEOUT = float(os.getenv("SCIAGENT_ADMISSION_QUEUE_TIMEOUT", "10"))
+ADAPTIVE = os.getenv("SCIAGENT_ADAPTIVE_LIMIT", "0") == "1"
+MIN_IN_FLIGHT = int(os.getenv("SCIAGENT_MIN_IN_FLIGHT", "4"))
+LATENCY_TOLERANCE = float(os.getenv("SCIAGENT_LATENCY_TOLERANCE", "2.0"))
+
+# 基线每个样本上浮的比例，以及耗时均值的平滑系数
+BASELINE_DRIFT = 0.01
+EWMA_ALPHA = 0.2
+DECREASE_FACTOR = 0.9
+# 最多保留多少个空闲租户的统计
+MAX_TENANTS = 1000
+DEFAULT_TENANT = "anonymous"
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    """解析 "alice=4,bob=0.5" 格式的租户权重"""
+    weights = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        tenant, _, weight = item.strip().rpartition("=")
+        if not tenant or float(weight) <= 0:
+            raise ValueError(f"无效的租户权重: {item!r}")
+        weights[tenant] = float(weight)
+    return weights
+
+
+TENANT_WEIGHTS = parse_weights(os.getenv("SCIAGENT_TENANT_WEIGHTS", ""))
+
+
+class Overloaded(Exception):
+    """请求被拒绝，retry_after为建议的重试等待秒数"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Tenant:
+    """一个租户的调度状态和统计"""
+
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        # 该租户上一个请求的虚拟完成时间
+        self.finish_tag = 0.0
+        self.in_flight = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record_wait(self, wait: float) -> None:
+        self.admitted += 1
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+
+    @property
+    def idle(self) -> bool:
+        return self.in_flight == 0 and self.queued == 0
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "weight": self.weight,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_wait_ms": round(self.wait_total / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 1),
+        }
+
+
+class Permit:
+    """一个已准入的请求，处理结束时调用release()（可以重复调用）"""
+
+    def __init__(self, controller: "AdmissionController", tenant: Tenant):
+        self._controller = controller
+        self.tenant = tenant
+        self._start = time.perf_counter()
+        self._released = False
+
+    def release(self, error: Optional[BaseException] = None) -> None:
+        if self._released:
+            return
+        self._released = True
+        # 客户端断开导致的取消不反映上游的负载，既不计入耗时样本也不算失败
+        cancelled = isinstance(error, asyncio.CancelledError)
+        self.tenant.in_flight -= 1
+        self._controller._release(None if cancelled else time.perf_counter() - self._start,
+                                  error is not None and not cancelled)
+
+
+class AdmissionController:
+    """最大并发数 + 按租户加权公平的有界等待队列，可选AIMD自适应上限"""
+
+    def __init__(
+        self,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        queue_size: int = QUEUE_SIZE,
+        tenant_queue_size: int = TENANT_QUEUE_SIZE,
+        queue_timeout: float = QUEUE_TIMEOUT,
+        weights: Optional[Dict[str, float]] = None,
+        adaptive: bool = ADAPTIVE,
+        min_in_flight: int = MIN_IN_FLIGHT,
+        tolerance: float = LATENCY_TOLERANCE,
+    ):
+        self.enabled = max_in_flight > 0
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min(min_in_flight, max_in_flight)
+        self.queue_size = queue_size
+        self.tenant_queue_size = tenant_queue_size
+        self.queue_timeout = queue_timeout
+        self.weights = TENANT_WEIGHTS if weights is None else weights
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.limit = float(max_in_flight)
+        self.in_flight = 0
+
+        # 等待中的请求: (虚拟完成时间, 到达序号, 虚拟开始时间, future, 租户)，取消的请求在出队时跳过
+        self._queue: List[Tuple[float, int, float, asyncio.Future, Tenant]] = []
+        self._queue_depth = 0
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._tenants: "OrderedDict[str, Tenant]" = OrderedDict()
+
+        self.baseline: Optional[float] = None
+        self.latency_ewma: Optional[float] = None
+        self._last_decrease = 0.0
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.peak_queue_depth = 0
+        self.peak_in_flight = 0
+
+    def _tenant(self, name: str) -> Tenant:
+        tenant = self._tenants.get(name)
+        if tenant is None:
+            tenant = Tenant(name, self.weights.get(name, 1.0))
+            self._tenants[name] = tenant
+            # 淘汰最久未使用的空闲租户，它们的标签落后于虚拟时间，重新创建时没有区别
+            if len(self._tenants) > MAX_TENANTS:
+                for stale in list(self._tenants.values())[: len(self._tenants) - MAX_TENANTS]:
+                    if stale.idle:
+                        del self._tenants[stale.name]
+        self._tenants.move_to_end(name)
+        return tenant
+
+    def _tag(self, tenant: Tenant) -> Tuple[float, float]:
+        """为租户的新请求分配 (虚拟开始时间, 虚拟完成时间)"""
+        start = max(self._virtual_time, tenant.finish_tag)
+        tenant.finish_tag = start + 1 / tenant.weight
+        return start, tenant.finish_tag
+
+    def retry_after(self) -> int:
+        """按当前的排队长度和平均耗时估计多久之后会有空位"""
+        if not self.latency_ewma:
+            return 1
+        wait = (self._queue_depth + 1) * self.latency_ewma / max(self.limit, 1.0)
+        return min(60, max(1, math.ceil(wait)))
+
+    def _admit(self, tenant: Tenant, wait: float) -> Permit:
+        self.admitted += 1
+        tenant.in_flight += 1
+        tenant.record_wait(wait)
+        return Permit(self, tenant)
+
+    def _reject(self, tenant: Tenant, reason: str) -> Overloaded:
+        self.rejected += 1
+        tenant.rejected += 1
+        return Overloaded(reason, self.retry_after())
+
+    async def acquire(self, tenant_name: str = DEFAULT_TENANT) -> Permit:
+        """等待空位并返回Permit；队列已满或等待超时时抛出Overloaded"""
+        tenant = self._tenant(tenant_name)
+        if not self.enabled:
+            return self._admit(tenant, 0.0)
+        start, finish = self._tag(tenant)
+        if not self._queue_depth and self.in_flight < int(self.limit):
+            self._virtual_time = start
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            return self._admit(tenant, 0.0)
+        if self._queue_depth >= self.queue_size:
+            tenant.finish_tag -= 1 / tenant.weight
+            raise self._reject(tenant, "服务繁忙，请稍后重试")
+        if tenant.queued >= self.tenant_queue_size:
+            tenant.finish_tag -= 1 / tenant.weight
+            raise self._reject(tenant, "该用户排队的请求过多，请稍后重试")
+
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (finish, next(self._sequence), start, waiter, tenant))
+        self._queue_depth += 1
+        tenant.queued += 1
+        self.queued += 1
+        self.peak_queue_depth = max(self.peak_queue_depth, self._queue_depth)
+        enqueued = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done() and not waiter.cancelled():
+                # 超时的同时_release已经把空位转交给本请求，排队计数已经更新，把空位交给下一个请求
+                self._release(None, False)
+            else:
+                self._abandon(tenant)
+            self.timed_out += 1
+            tenant.timed_out += 1
+            raise Overloaded("排队超时，请稍后重试", self.retry_after())
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # 已经分到空位时才被取消，把空位交给下一个请求
+                self._release(None, False)
+            else:
+                self._abandon(tenant)
+            raise
+        # 空位由_release转交，in_flight和排队计数已经更新
+        return self._admit(tenant, time.perf_counter() - enqueued)
+
+    @asynccontextmanager
+    async def admit(self, tenant_name: str = DEFAULT_TENANT):
+        """async with admission.admit(tenant): 处理请求"""
+        permit = await self.acquire(tenant_name)
+        try:
+            yield permit
+        except BaseException as e:
+            permit.release(e)
+            raise
+        else:
+            permit.release()
+
+    def _abandon(self, tenant: Tenant) -> None:
+        """等待中的请求放弃排队，对应的队列条目（future已取消）出队时跳过"""
+        self._queue_depth -= 1
+        tenant.queued -= 1
+
+    def _release(self, latency: Optional[float], failed: bool) -> None:
+        if not self.enabled:
+            # 不做准入控制时acquire不计入in_flight，只记录耗时
+            if latency is not None:
+                self._observe(latency)
+            return
+        self.in_flight -= 1
+        if self.adaptive:
+            self._adjust(latency, failed)
+        elif latency is not None:
+            self._observe(latency)
+        # 把空位转交给虚拟完成时间最小的等待请求
+        while self._queue and self.in_flight < int(self.limit):
+            _, _, start, waiter, tenant = heapq.heappop(self._queue)
+            if waiter.done():
+                continue
+            self._queue_depth -= 1
+            tenant.queued -= 1
+            self._virtual_time = start
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            waiter.set_result(None)
+
+    def _observe(self, latency: float) -> None:
+        self.latency_ewma = latency if self.latency_ewma is None else (
+            EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency_ewma
+        )
+        self.baseline = latency if self.baseline is None else min(latency, self.baseline * (1 + BASELINE_DRIFT))
+
+    def _adjust(self, latency: Optional[float], failed: bool) -> None:
+        if latency is not None:
+            self._observe(latency)
+        congested = failed or (latency is not None and latency > self.baseline * self.tolerance)
+        now = time.monotonic()
+        if congested:
+            # 同一批慢请求只减少一次，避免上限一下子降到最低
+            if now - self._last_decrease >= (self.baseline or 0.0):
+                self.limit = max(float(self.min_in_flight), self.limit * DECREASE_FACTOR)
+                self._last_decrease = now
+        elif latency is not None:
+            self.limit = min(float(self.max_in_flight), self.limit + 1 / self.limit)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "adaptive": self.adaptive,
+            "limit": int(self.limit),
+            "max_in_flight": self.max_in_flight,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "queue_depth": self._queue_depth,
+            "peak_queue_depth": self.peak_queue_depth,
+            "queue_size": self.queue_size,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma else None,
+            "baseline_ms": round(self.baseline * 1000, 1) if self.baseline else None,
+        }
+
+    def tenant_stats(self, top: int = 50) -> Dict[str, Dict[str, float]]:
+        """按累计准入请求数排序的租户统计"""
+        tenants = sorted(self._tenants.values(), key=lambda tenant: tenant.admitted, reverse=True)[:top]
+        return {tenant.name: tenant.stats() for tenant in tenants}
+
+
+admission = AdmissionController()
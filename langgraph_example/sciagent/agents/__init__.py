@@ -1,14 +1,11 @@
 # agents/__init__.py
 """
 科研助手系统的专业agent模块
+
+各个agent通过注册表按需加载，from agents import chat_agent 时才会导入对应的模块
 """
 
-from .chat_agent import chat_agent
-from .bioinformatics_agent import bioinformatics_agent
-from .bioinfo_interpret_agent import bioinfo_interpret_agent
-from .literature_agent import literature_agent
-from .research_image_agent import research_image_agent
-from .deep_research_agent import deep_research_agent
+from .registry import agent_registry
 
 # 导出所有agent
 __all__ = [
@@ -18,4 +15,12 @@ __all__ = [
     'literature_agent',
     'research_image_agent',
     'deep_research_agent',
+    'agent_registry',
 ]
+
+
+def __getattr__(name):
+    route = name[: -len("_agent")] if name.endswith("_agent") else None
+    if route in agent_registry:
+        return agent_registry[route]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
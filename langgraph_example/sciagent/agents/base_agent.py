@@ -3,31 +3,171 @@
 基础agent类，提供共享功能
 """
 
+import logging
+import threading
+
+from typing import Annotated, List, Optional
+
 from typing_extensions import TypedDict
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+
+from .semantic_cache import ENABLED as SEMANTIC_CACHE_ENABLED
+from .cascade import ENABLED as CASCADE_ENABLED
+
+logger = logging.getLogger(__name__)
+
+
+def merge_partial_outputs(left: Optional[List[dict]], right: Optional[List[dict]]) -> List[dict]:
+    """多agent模式的部分回答；写入None表示开始新的一轮对话，清空上一轮的结果"""
+    if right is None:
+        return []
+    return (left or []) + right
+
 
 # 导入共享的State类型
 class State(TypedDict):
     input: str
+    agent: Optional[str]
     decision: str
     output: str
+    # 多agent模式
+    multi_agent: bool
+    max_agents: Optional[int]
+    decisions: List[str]
+    partial_outputs: Annotated[List[dict], merge_partial_outputs]
+    bypass_cache: bool
+    speculation_id: Optional[str]
+    # 多轮对话记忆（见memory.py），无状态调用时为空
+    history: List[dict]
+    summary: str
+    usage: Optional[dict]
+    turn_tokens: Optional[dict]
+    # 长输入按map-reduce处理时的片段数和耗时
+    long_input: Optional[dict]
+    # 请求的截止时间（time.time()），见resilience.py
+    deadline: Optional[float]
+
+# 共享的LLM实例，第一次调用时由get_llm()创建（导入langchain_openai较慢）；测试时可以直接赋值替换
+llm = None
+_llm_lock = threading.Lock()
+
+
+def get_llm():
+    """返回共享的LLM实例，开启流式输出以便逐token推送给客户端；连接池和BASE_URL见llm_client.py"""
+    global llm
+    if llm is None:
+        with _llm_lock:
+            if llm is None:
+                from llm_client import chat_model
+                llm = chat_model("gpt-4o", streaming=True, stream_usage=True)
+    return llm
 
-# 创建共享的LLM实例
-llm = ChatOpenAI(model="gpt-4o")
 
 class BaseAgent:
     """基础agent类，提供共享功能"""
     
     @staticmethod
-    def create_agent(system_prompt):
-        """创建一个agent函数，使用指定的系统提示"""
-        
-        def agent_function(state: State):
-            result = llm.invoke([
+    def create_agent(system_prompt, semantic_cache=None, long_input=None, cascade=None):
+        """创建一个agent，使用指定的系统提示
+
+        返回的Runnable同时支持同步(invoke)和异步(ainvoke)调用，可以直接作为图的节点
+
+        semantic_cache: 可选的SemanticCache实例，启用后相似问题直接返回缓存的回答
+        long_input: 可选的MapReduce实例，输入超过阈值时切分成片段分别处理后再合并
+        cascade: 可选的Cascade实例，先用小模型回答，置信度不足时再使用大模型
+        """
+        from memory import history_messages
+        from tracing import traced
+
+        if not SEMANTIC_CACHE_ENABLED:
+            semantic_cache = None
+        if not CASCADE_ENABLED:
+            cascade = None
+
+        def build_messages(state: State):
+            # 多轮对话时在系统提示和当前问题之间插入摘要和最近的历史
+            return [
                 SystemMessage(content=system_prompt),
+                *history_messages(state),
                 HumanMessage(content=state["input"])
-            ])
-            return {"output": result.content}
-        
-        return agent_function
+            ]
+
+        def use_cache(state: State):
+            # 回答依赖之前的对话时不使用语义缓存
+            return semantic_cache is not None and not state.get("history") and not state.get("summary")
+
+        def embed(text: str):
+            try:
+                return semantic_cache.embed(text)
+            except Exception as e:
+                # 缓存不可用时不影响正常回答
+                logger.warning("语义缓存embedding失败: %s", e)
+                return None
+
+        async def aembed(text: str):
+            try:
+                return await semantic_cache.aembed(text)
+            except Exception as e:
+                logger.warning("语义缓存embedding失败: %s", e)
+                return None
+
+        def cacheable(answer: dict):
+            # 级联采纳的小模型回答不写入缓存：它只在阈值（如0.7）下对这一个问题打过分，
+            # 相似度0.95以上的改写（如"上调"和"下调"）也会命中，不应在TTL内反复返回
+            return answer.pop("escalated", True)
+
+        def is_long(state: State):
+            return long_input is not None and long_input.applies(state["input"])
+
+        def agent_function(state: State, config: Optional[RunnableConfig] = None):
+            if is_long(state):
+                return long_input.run(get_llm(), system_prompt, state["input"], history_messages(state), config)
+
+            vector = None
+            if use_cache(state) and not state.get("bypass_cache"):
+                vector = embed(state["input"])
+                cached = semantic_cache.lookup(vector) if vector is not None else None
+                if cached is not None:
+                    return {"output": cached}
+
+            if cascade is not None:
+                answer = cascade.run(get_llm(), build_messages(state), config)
+            else:
+                result = get_llm().invoke(build_messages(state), config=config)
+                answer = {"output": result.content, "usage": result.usage_metadata}
+
+            if cacheable(answer) and use_cache(state):
+                # 跳过缓存（Cache-Control: no-cache）的请求不查询，只在写入新回答时计算embedding
+                if state.get("bypass_cache"):
+                    vector = embed(state["input"])
+                if vector is not None:
+                    semantic_cache.store(vector, answer["output"])
+            return answer
+
+        async def aagent_function(state: State, config: Optional[RunnableConfig] = None):
+            if is_long(state):
+                return await long_input.arun(get_llm(), system_prompt, state["input"], history_messages(state), config)
+
+            vector = None
+            if use_cache(state) and not state.get("bypass_cache"):
+                vector = await aembed(state["input"])
+                cached = semantic_cache.lookup(vector) if vector is not None else None
+                if cached is not None:
+                    return {"output": cached}
+
+            if cascade is not None:
+                answer = await cascade.arun(get_llm(), build_messages(state), config)
+            else:
+                result = await get_llm().ainvoke(build_messages(state), config=config)
+                answer = {"output": result.content, "usage": result.usage_metadata}
+
+            if cacheable(answer) and use_cache(state):
+                if state.get("bypass_cache"):
+                    vector = await aembed(state["input"])
+                if vector is not None:
+                    semantic_cache.store(vector, answer["output"])
+            return answer
+
+        # 已采样的请求中记录agent函数的span（是否命中语义缓存、token用量）
+        return traced("agent_function", RunnableLambda(agent_function, afunc=aagent_function))
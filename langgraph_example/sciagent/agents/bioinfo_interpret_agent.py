@@ -4,9 +4,13 @@
 """
 
 from .base_agent import BaseAgent, State
+from .map_reduce import MapReduce
 
 # 系统提示
 SYSTEM_PROMPT = "你是一个专业的生物信息学解读助手，擅长解释各种生物信息学分析结果，包括差异表达分析、富集分析、网络分析等。"
 
-# 创建agent函数
-bioinfo_interpret_agent = BaseAgent.create_agent(SYSTEM_PROMPT)
+# 创建agent函数，粘贴的长文本按片段处理后再合并
+bioinfo_interpret_agent = BaseAgent.create_agent(
+    SYSTEM_PROMPT,
+    long_input=MapReduce(map_instruction="提取该片段中显著的基因、通路、统计量和值得注意的异常结果。"),
+)
@@ -4,9 +4,13 @@
 """
 
 from .base_agent import BaseAgent, State
+from .semantic_cache import ENABLED as SEMANTIC_CACHE_ENABLED, SemanticCache
 
 # 系统提示
 SYSTEM_PROMPT = "你是一个专业的生物信息学分析助手，擅长基因组学、转录组学、蛋白质组学等分析方法。"
 
-# 创建agent函数
-bioinformatics_agent = BaseAgent.create_agent(SYSTEM_PROMPT)
+# 创建agent函数，常见问题使用语义缓存（关闭时不创建，不导入numpy）
+bioinformatics_agent = BaseAgent.create_agent(
+    SYSTEM_PROMPT,
+    semantic_cache=SemanticCache("bioinformatics", ttl=7 * 86400) if SEMANTIC_CACHE_ENABLED else None,
+)
@@ -0,0 +1,235 @@
+# agents/cascade.py
+"""
+模型级联，供各个agent按需启用
+
+先用便宜、快速的小模型回答，并给回答打分：
+- verifier="self": 小模型在回答末尾自报置信度（一次调用）
+- verifier="judge": 再用小模型按问题和回答单独打分（多一次调用，更保守）
+分数达到阈值时直接返回小模型的回答，否则（包括无法解析分数时）改用大模型重新回答。
+
+小模型的回答不逐token推送给客户端（可能被丢弃），采纳时与缓存命中一样只在最终响应中返回；
+升级到大模型后照常流式输出，但要先等小模型回答完（耗时为两者之和）。
+因此默认关闭：开启后流式接口对采纳的回答不再逐token推送，回答也改由小模型给出。
+
+配置（环境变量）:
+- SCIAGENT_CASCADE: 设为1时启用了级联的agent先使用小模型，默认0（所有agent直接使用大模型）
+- SCIAGENT_CASCADE_MODEL: 小模型，默认gpt-4o-mini
+- SCIAGENT_CASCADE_THRESHOLD: 采纳小模型回答的最低分数，默认0.7
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from .map_reduce import merge_usage
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("SCIAGENT_CASCADE", "0") == "1"
+SMALL_MODEL = os.getenv("SCIAGENT_CASCADE_MODEL", "gpt-4o-mini")
+THRESHOLD = float(os.getenv("SCIAGENT_CASCADE_THRESHOLD", "0.7"))
+
+# 每百万token的价格（美元，输入/输出），用于估算节省的成本
+MODEL_PRICES = {
+    "gpt-4o": (2.5, 10.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-4.1": (2.0, 8.0),
+    "gpt-4.1-mini": (0.4, 1.6),
+    "gpt-4.1-nano": (0.1, 0.4),
+}
+
+CONFIDENCE_INSTRUCTION = (
+    "回答结束后另起一行，按“置信度: x”的格式给出你对回答准确、完整的把握（0到1之间的小数）。"
+    "问题超出你的能力、需要更专业的知识或你不确定时给出较低的值。"
+)
+JUDGE_PROMPT = """你负责评估助手的回答质量。根据用户的问题判断回答是否准确、完整、切题。
+只输出一个0到1之间的小数，不要输出其他内容。"""
+
+# 小模型不一定严格按格式输出：允许Markdown加粗、括号、全角冒号、百分数和结尾的句号
+_NUMBER = r"(\d+(?:\.\d+)?|\.\d+)\s*(%|％)?"
+_CONFIDENCE = re.compile(
+    r"[\s(（\[【*_]*(?:置信度|confidence)[*_\s]*[:：]?[*_\s]*" + _NUMBER + r"[*_\s)）\]】。.]*$",
+    re.IGNORECASE,
+)
+_SCORE = re.compile(_NUMBER)
+
+
+def _to_score(number: str, percent: Optional[str]) -> Optional[float]:
+    """转换为0到1之间的分数，超出范围时为None（按无法解析处理，升级到大模型）"""
+    value = float(number) / (100 if percent else 1)
+    return value if 0.0 <= value <= 1.0 else None
+
+
+def parse_confidence(content: str) -> Tuple[str, Optional[float]]:
+    """去掉回答末尾的置信度，返回 (回答, 置信度)；没有置信度或数值无效时为None"""
+    match = _CONFIDENCE.search(content)
+    if match is None:
+        return content, None
+    return content[: match.start()].rstrip(), _to_score(match.group(1), match.group(2))
+
+
+def parse_score(content: str) -> Optional[float]:
+    match = _SCORE.search(content)
+    return _to_score(match.group(1), match.group(2)) if match else None
+
+
+def estimate_cost(model: str, usage: Optional[dict]) -> float:
+    """按MODEL_PRICES估算一次调用的费用（美元），未知模型计为0"""
+    input_price, output_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    usage = usage or {}
+    return (usage.get("input_tokens", 0) * input_price + usage.get("output_tokens", 0) * output_price) / 1e6
+
+
+class Cascade:
+    """小模型优先、低置信度时升级到大模型"""
+
+    def __init__(self, name: str, small_model: str = SMALL_MODEL, large_model: str = "gpt-4o",
+                 threshold: float = THRESHOLD, verifier: str = "self", llm=None):
+        if verifier not in ("self", "judge"):
+            raise ValueError(f"未知的verifier: {verifier}")
+        self.name = name
+        self.small_model = small_model
+        self.large_model = large_model
+        self.threshold = threshold
+        self.verifier = verifier
+        # 小模型，第一次使用时创建；测试时可以直接赋值替换
+        self.llm = llm
+        self._llm_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.escalations = 0
+        self.unscored = 0
+        self.small_seconds = 0.0
+        self.large_seconds = 0.0
+        self.small_cost = 0.0
+        self.large_cost = 0.0
+        # 采纳小模型回答时按大模型价格估算的费用
+        self.avoided_cost = 0.0
+        _cascades.append(self)
+
+    def get_llm(self):
+        if self.llm is None:
+            with self._llm_lock:
+                if self.llm is None:
+                    from langgraph.constants import TAG_NOSTREAM
+                    from llm_client import chat_model
+                    self.llm = chat_model(self.small_model).with_config(tags=[TAG_NOSTREAM])
+        return self.llm
+
+    def small_messages(self, messages: List) -> List:
+        system, *rest = messages
+        if self.verifier == "self":
+            system = SystemMessage(content=f"{system.content}\n{CONFIDENCE_INSTRUCTION}")
+        return [system, *rest]
+
+    def judge_messages(self, question: str, answer: str) -> List:
+        return [
+            SystemMessage(content=JUDGE_PROMPT),
+            HumanMessage(content=f"用户的问题：\n{question}\n\n助手的回答：\n{answer}"),
+        ]
+
+    def _score(self, content: str) -> Tuple[str, Optional[float]]:
+        answer, confidence = parse_confidence(content)
+        return (answer, confidence) if self.verifier == "self" else (answer, None)
+
+    def _record(self, small_result, judge_result, large_result, small_seconds: float, large_seconds: float,
+                scored: bool) -> None:
+        small_usage = merge_usage([result for result in (small_result, judge_result) if result is not None])
+        with self._lock:
+            self.requests += 1
+            self.unscored += 0 if scored else 1
+            self.small_seconds += small_seconds
+            self.small_cost += estimate_cost(self.small_model, small_usage)
+            if large_result is None:
+                self.avoided_cost += estimate_cost(self.large_model, small_result.usage_metadata)
+            else:
+                self.escalations += 1
+                self.large_seconds += large_seconds
+                self.large_cost += estimate_cost(self.large_model, large_result.usage_metadata)
+
+    def _result(self, answer: str, small_result, judge_result, large_result) -> Dict:
+        results = [result for result in (small_result, judge_result, large_result) if result is not None]
+        return {
+            "output": answer if large_result is None else large_result.content,
+            "usage": merge_usage(results),
+            # 采纳的小模型回答只针对这一个问题打过分，语义缓存不保存（见base_agent.py）
+            "escalated": large_result is not None,
+        }
+
+    def run(self, large_llm, messages: List, config: Optional[dict] = None) -> Dict:
+        """返回 {"output", "usage", "escalated"}，usage为本次所有调用的用量之和，escalated表示是否升级到了大模型"""
+        start = time.perf_counter()
+        small_result = self.get_llm().invoke(self.small_messages(messages), config=config)
+        answer, score = self._score(small_result.content)
+        judge_result = None
+        if self.verifier == "judge":
+            judge_result = self.get_llm().invoke(self.judge_messages(messages[-1].content, answer), config=config)
+            score = parse_score(judge_result.content)
+        small_seconds = time.perf_counter() - start
+
+        large_result = None
+        if score is None or score < self.threshold:
+            logger.debug("%s: 小模型分数 %s 低于阈值，升级到大模型", self.name, score)
+            start = time.perf_counter()
+            large_result = large_llm.invoke(messages, config=config)
+        self._record(small_result, judge_result, large_result, small_seconds,
+                     time.perf_counter() - start, score is not None)
+        return self._result(answer, small_result, judge_result, large_result)
+
+    async def arun(self, large_llm, messages: List, config: Optional[dict] = None) -> Dict:
+        start = time.perf_counter()
+        small_result = await self.get_llm().ainvoke(self.small_messages(messages), config=config)
+        answer, score = self._score(small_result.content)
+        judge_result = None
+        if self.verifier == "judge":
+            judge_result = await self.get_llm().ainvoke(self.judge_messages(messages[-1].content, answer), config=config)
+            score = parse_score(judge_result.content)
+        small_seconds = time.perf_counter() - start
+
+        large_result = None
+        if score is None or score < self.threshold:
+            logger.debug("%s: 小模型分数 %s 低于阈值，升级到大模型", self.name, score)
+            start = time.perf_counter()
+            large_result = await large_llm.ainvoke(messages, config=config)
+        self._record(small_result, judge_result, large_result, small_seconds,
+                     time.perf_counter() - start, score is not None)
+        return self._result(answer, small_result, judge_result, large_result)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            accepted = self.requests - self.escalations
+            small_ms = self.small_seconds / self.requests * 1000 if self.requests else 0.0
+            large_ms = self.large_seconds / self.escalations * 1000 if self.escalations else None
+            return {
+                "small_model": self.small_model,
+                "large_model": self.large_model,
+                "verifier": self.verifier,
+                "threshold": self.threshold,
+                "requests": self.requests,
+                "accepted": accepted,
+                "escalations": self.escalations,
+                "escalation_rate": self.escalations / self.requests if self.requests else 0.0,
+                "unscored": self.unscored,
+                # 小模型（含打分）的平均耗时，以及升级后大模型的平均耗时
+                "avg_small_ms": round(small_ms, 1),
+                "avg_large_ms": round(large_ms, 1) if large_ms is not None else None,
+                # 与全部使用大模型相比，采纳的回答节省的耗时（按大模型平均耗时估算）减去升级时多花的小模型耗时
+                "latency_saved_ms": round(
+                    accepted * (large_ms - small_ms) - self.escalations * small_ms, 1
+                ) if large_ms is not None else None,
+                "cost_usd": round(self.small_cost + self.large_cost, 6),
+                "cost_saved_usd": round(self.avoided_cost - self.small_cost, 6),
+            }
+
+
+_cascades: List[Cascade] = []
+
+
+def cascade_stats() -> Dict[str, Dict[str, float]]:
+    """获取每个agent的模型级联统计"""
+    return {cascade.name: cascade.stats() for cascade in _cascades}
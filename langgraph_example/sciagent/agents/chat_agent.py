@@ -4,9 +4,15 @@
 """
 
 from .base_agent import BaseAgent, State
+from .semantic_cache import ENABLED as SEMANTIC_CACHE_ENABLED, SemanticCache
+from .cascade import Cascade
 
 # 系统提示
 SYSTEM_PROMPT = "你是一个友好的聊天助手，可以回答用户的一般性问题。"
 
-# 创建agent函数
-chat_agent = BaseAgent.create_agent(SYSTEM_PROMPT)
+# 创建agent函数，常见问题使用语义缓存（关闭时不创建，不导入numpy），一般问题由小模型回答
+chat_agent = BaseAgent.create_agent(
+    SYSTEM_PROMPT,
+    semantic_cache=SemanticCache("chat", ttl=3600) if SEMANTIC_CACHE_ENABLED else None,
+    cascade=Cascade("chat"),
+)
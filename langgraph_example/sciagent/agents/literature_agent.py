@@ -4,9 +4,15 @@
 """
 
 from .base_agent import BaseAgent, State
+from .map_reduce import MapReduce
+from .cascade import Cascade
 
 # 系统提示
 SYSTEM_PROMPT = "你是一个专业的文献辅助助手，擅长帮助用户理解、总结和分析科学文献，特别是生物医学领域的文献。"
 
-# 创建agent函数
-literature_agent = BaseAgent.create_agent(SYSTEM_PROMPT)
+# 创建agent函数，粘贴的长文本按片段处理后再合并；概念解释等简单问题由小模型回答，阈值比聊天更严格
+literature_agent = BaseAgent.create_agent(
+    SYSTEM_PROMPT,
+    long_input=MapReduce(map_instruction="提取该片段中的研究问题、方法、主要发现和局限性。"),
+    cascade=Cascade("literature", threshold=0.8),
+)
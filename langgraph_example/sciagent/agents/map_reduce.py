@@ -0,0 +1,183 @@
+# agents/map_reduce.py
+"""
+长输入的map-reduce处理，供各个agent按需启用
+
+输入超过阈值时按token切分成有重叠的片段，以有限的并发分别提取每个片段的要点（map），
+再用一次调用综合各片段的要点给出最终回答（reduce）。只有reduce调用会逐token推送给客户端。
+
+配置（环境变量）:
+- SCIAGENT_LONG_INPUT_THRESHOLD: 输入超过多少token时启用，默认6000
+- SCIAGENT_CHUNK_TOKENS: 每个片段的token数，默认3000
+- SCIAGENT_CHUNK_OVERLAP: 相邻片段重叠的token数，默认200
+- SCIAGENT_MAP_CONCURRENCY: 同时处理的片段数，默认4
+"""
+
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from tokens import count_tokens
+
+THRESHOLD = int(os.getenv("SCIAGENT_LONG_INPUT_THRESHOLD", "6000"))
+CHUNK_TOKENS = int(os.getenv("SCIAGENT_CHUNK_TOKENS", "3000"))
+CHUNK_OVERLAP = int(os.getenv("SCIAGENT_CHUNK_OVERLAP", "200"))
+MAP_CONCURRENCY = int(os.getenv("SCIAGENT_MAP_CONCURRENCY", "4"))
+
+# 用户的问题通常写在粘贴内容的开头或结尾，map和reduce调用都带上这两部分
+EXCERPT_TOKENS = 150
+
+
+def _units(text: str, max_tokens: int) -> List[Tuple[str, int]]:
+    """按行切分，超长的行再按字符切开，返回 (文本, token数)"""
+    units = []
+    for line in text.splitlines(keepends=True):
+        tokens = count_tokens(line)
+        if tokens <= max_tokens:
+            units.append((line, tokens))
+            continue
+        step = max(1, len(line) * max_tokens // tokens)
+        for start in range(0, len(line), step):
+            piece = line[start:start + step]
+            units.append((piece, count_tokens(piece)))
+    return units
+
+
+def split_text(text: str, chunk_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP) -> List[str]:
+    """切分成每段不超过chunk_tokens的片段，相邻片段重叠约overlap_tokens，尽量在行边界处切分"""
+    chunks = []
+    current: List[Tuple[str, int]] = []
+    current_tokens = 0
+    for unit, tokens in _units(text, chunk_tokens):
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append("".join(piece for piece, _ in current))
+            # 上一段末尾的若干行作为下一段的开头
+            tail: List[Tuple[str, int]] = []
+            tail_tokens = 0
+            for piece, piece_tokens in reversed(current):
+                if tail_tokens + piece_tokens > overlap_tokens:
+                    break
+                tail.insert(0, (piece, piece_tokens))
+                tail_tokens += piece_tokens
+            current, current_tokens = tail, tail_tokens
+        current.append((unit, tokens))
+        current_tokens += tokens
+    if current:
+        chunks.append("".join(piece for piece, _ in current))
+    return chunks
+
+
+def _excerpt(text: str, tokens: int, from_end: bool = False) -> str:
+    total = count_tokens(text)
+    if total <= tokens:
+        return text
+    length = len(text) * tokens // total
+    return text[-length:] if from_end else text[:length]
+
+
+def merge_usage(results) -> Dict[str, int]:
+    usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    for result in results:
+        for key, value in (getattr(result, "usage_metadata", None) or {}).items():
+            if key in usage:
+                usage[key] += value
+    return usage
+
+
+class MapReduce:
+    """对超长输入做map-reduce"""
+
+    def __init__(
+        self,
+        map_instruction: str = "提取该片段中与用户请求相关的要点、数据和结论。",
+        threshold: int = THRESHOLD,
+        chunk_tokens: int = CHUNK_TOKENS,
+        overlap_tokens: int = CHUNK_OVERLAP,
+        max_concurrency: int = MAP_CONCURRENCY,
+    ):
+        self.map_instruction = map_instruction
+        self.threshold = threshold
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.max_concurrency = max_concurrency
+
+    def applies(self, text: str) -> bool:
+        return count_tokens(text) > self.threshold
+
+    def _request_excerpt(self, text: str) -> str:
+        return (f"用户请求的开头：\n{_excerpt(text, EXCERPT_TOKENS)}\n\n"
+                f"用户请求的结尾：\n{_excerpt(text, EXCERPT_TOKENS, from_end=True)}")
+
+    def map_messages(self, system_prompt: str, text: str, chunks: List[str]) -> List[List]:
+        request = self._request_excerpt(text)
+        return [
+            [
+                SystemMessage(content=f"{system_prompt}\n用户提供的内容较长，已被切分为{len(chunks)}个片段分别处理。"
+                                      f"{self.map_instruction}只根据片段内容作答，不要编造片段中没有的信息。"),
+                HumanMessage(content=f"{request}\n\n第{index}/{len(chunks)}个片段：\n{chunk}"),
+            ]
+            for index, chunk in enumerate(chunks, start=1)
+        ]
+
+    def reduce_messages(self, system_prompt: str, text: str, partials: List[str], history: List) -> List:
+        notes = "\n\n".join(f"### 片段{index}\n{partial}" for index, partial in enumerate(partials, start=1))
+        return [
+            SystemMessage(content=system_prompt),
+            *history,
+            HumanMessage(content=f"{self._request_excerpt(text)}\n\n用户提供的完整内容过长，以下是对各个片段的分析要点：\n\n"
+                                 f"{notes}\n\n请综合这些要点，完整地回答用户的请求。"),
+        ]
+
+    def _report(self, text: str, chunks: List[str], start: float, map_done: float, end: float) -> Dict:
+        return {
+            "input_tokens": count_tokens(text),
+            "chunks": len(chunks),
+            "chunk_tokens": self.chunk_tokens,
+            "overlap_tokens": self.overlap_tokens,
+            "map_ms": round((map_done - start) * 1000, 1),
+            "reduce_ms": round((end - map_done) * 1000, 1),
+            "total_ms": round((end - start) * 1000, 1),
+        }
+
+    def run(self, llm, system_prompt: str, text: str, history: List, config: Optional[dict] = None) -> Dict:
+        """返回 {"output", "usage", "long_input"}，long_input为片段数和各阶段耗时"""
+        from langgraph.constants import TAG_NOSTREAM
+
+        start = time.perf_counter()
+        chunks = split_text(text, self.chunk_tokens, self.overlap_tokens)
+        # 片段的中间结果不推送给客户端
+        partials = llm.with_config(tags=[TAG_NOSTREAM]).batch(
+            self.map_messages(system_prompt, text, chunks),
+            config={**(config or {}), "max_concurrency": self.max_concurrency},
+        )
+        map_done = time.perf_counter()
+        result = llm.invoke(
+            self.reduce_messages(system_prompt, text, [partial.content for partial in partials], history),
+            config=config,
+        )
+        return {
+            "output": result.content,
+            "usage": merge_usage([*partials, result]),
+            "long_input": self._report(text, chunks, start, map_done, time.perf_counter()),
+        }
+
+    async def arun(self, llm, system_prompt: str, text: str, history: List, config: Optional[dict] = None) -> Dict:
+        from langgraph.constants import TAG_NOSTREAM
+
+        start = time.perf_counter()
+        chunks = split_text(text, self.chunk_tokens, self.overlap_tokens)
+        partials = await llm.with_config(tags=[TAG_NOSTREAM]).abatch(
+            self.map_messages(system_prompt, text, chunks),
+            config={**(config or {}), "max_concurrency": self.max_concurrency},
+        )
+        map_done = time.perf_counter()
+        result = await llm.ainvoke(
+            self.reduce_messages(system_prompt, text, [partial.content for partial in partials], history),
+            config=config,
+        )
+        return {
+            "output": result.content,
+            "usage": merge_usage([*partials, result]),
+            "long_input": self._report(text, chunks, start, map_done, time.perf_counter()),
+        }
@@ -0,0 +1,97 @@
+# agents/registry.py
+"""
+agent注册表：按名称发现agent，第一次使用时才导入
+
+agent模块按约定命名为 agents/<name>_agent.py，并在模块中定义同名的 <name>_agent。
+发现agent时只扫描文件名，不导入模块；模块中的提示、语义缓存以及共享的LLM客户端都在第一次调用时才创建，
+这样导入api.py和router.py时不需要付出这部分开销。
+"""
+
+import importlib
+import logging
+import pkgutil
+import sys
+import threading
+import time
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class LazyAgent:
+    """agent的代理，第一次调用时才从注册表加载真正的agent"""
+
+    def __init__(self, registry: "AgentRegistry", name: str):
+        self._registry = registry
+        self.name = name
+
+    def invoke(self, state: dict, config: Optional[dict] = None) -> Any:
+        return self._registry[self.name].invoke(state, config)
+
+    async def ainvoke(self, state: dict, config: Optional[dict] = None) -> Any:
+        return await self._registry[self.name].ainvoke(state, config)
+
+
+class AgentRegistry(Mapping):
+    """路由名称到agent的映射，按需导入agent模块"""
+
+    def __init__(self, package: str = __package__, path: Path = Path(__file__).parent):
+        self._package = package
+        self._names: List[str] = [
+            module.name[: -len("_agent")]
+            for module in pkgutil.iter_modules([str(path)])
+            if module.name.endswith("_agent") and module.name != "base_agent"
+        ]
+        self._agents: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self.load_times: Dict[str, float] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        agent = self._agents.get(name)
+        if agent is not None:
+            return agent
+        if name not in self._names:
+            raise KeyError(name)
+        with self._lock:
+            if name not in self._agents:
+                start = time.perf_counter()
+                module = importlib.import_module(f".{name}_agent", self._package)
+                agent = getattr(module, f"{name}_agent")
+                # 导入子模块会把包上的同名属性设为模块本身，这里改回agent，与 from .x import x 的效果一致
+                setattr(sys.modules[self._package], f"{name}_agent", agent)
+                self.load_times[name] = time.perf_counter() - start
+                self._agents[name] = agent
+                logger.info("加载agent %s，耗时 %.1f ms", name, self.load_times[name] * 1000)
+        return self._agents[name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name) -> bool:
+        return name in self._names
+
+    def lazy(self, name: str) -> LazyAgent:
+        """返回不会立即加载的agent代理，用于构建图"""
+        if name not in self._names:
+            raise KeyError(name)
+        return LazyAgent(self, name)
+
+    def load_all(self) -> None:
+        """预先加载所有agent"""
+        for name in self._names:
+            self[name]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "available": list(self._names),
+            "loaded": list(self._agents),
+            "load_time_ms": {name: round(seconds * 1000, 1) for name, seconds in self.load_times.items()},
+        }
+
+
+agent_registry = AgentRegistry()
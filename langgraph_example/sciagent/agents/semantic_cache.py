@@ -0,0 +1,148 @@
+# agents/semantic_cache.py
+"""
+语义响应缓存，供各个agent按需启用
+
+对用户输入做embedding，在进程内的向量索引（NumPy矩阵，余弦相似度top-1）中查找，
+相似度超过阈值时直接返回之前的回答，跳过LLM调用。
+
+未命中时也要先等一次embedding请求才能调用LLM，因此默认关闭，设置 SCIAGENT_SEMANTIC_CACHE=1 后
+创建agent时传入了SemanticCache的agent才会使用。
+"""
+
+import logging
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+# 导入numpy约需100 ms，base_agent和api只用到ENABLED和统计，创建缓存时才导入
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 全局开关，设为1时传入了SemanticCache的agent才使用语义缓存，默认关闭
+ENABLED = os.getenv("SCIAGENT_SEMANTIC_CACHE", "0") == "1"
+EMBEDDING_MODEL = os.getenv("SCIAGENT_EMBEDDING_MODEL", "text-embedding-3-small")
+
+_embeddings = None
+_embeddings_lock = threading.Lock()
+
+
+def get_embeddings():
+    """延迟创建共享的embedding客户端"""
+    global _embeddings
+    with _embeddings_lock:
+        if _embeddings is None:
+            from llm_client import embeddings_model
+            _embeddings = embeddings_model(EMBEDDING_MODEL)
+        return _embeddings
+
+
+def _normalize(embedding) -> "np.ndarray":
+    import numpy as np
+
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class SemanticCache:
+    """基于余弦相似度的语义缓存，容量有限，条目按TTL过期"""
+
+    def __init__(self, name: str, ttl: float = 3600, threshold: float = 0.95,
+                 max_size: int = 1000, embeddings=None):
+        import numpy as np
+
+        self.name = name
+        self.ttl = ttl
+        self.threshold = threshold
+        self.max_size = max_size
+        self._embeddings = embeddings
+        self._lock = threading.Lock()
+        self._matrix: Optional["np.ndarray"] = None  # (max_size, dim)，行向量已归一化
+        self._expires_at = np.zeros(max_size)
+        self._last_used = np.zeros(max_size)
+        self._answers: List[Optional[str]] = [None] * max_size
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        _caches.append(self)
+
+    def embed(self, text: str) -> "np.ndarray":
+        """计算归一化后的embedding向量"""
+        embeddings = self._embeddings or get_embeddings()
+        return _normalize(embeddings.embed_query(text))
+
+    async def aembed(self, text: str) -> "np.ndarray":
+        """embed的异步版本"""
+        embeddings = self._embeddings or get_embeddings()
+        return _normalize(await embeddings.aembed_query(text))
+
+    def lookup(self, vector: "np.ndarray") -> Optional[str]:
+        """查找最相似的条目，相似度超过阈值且未过期时返回缓存的回答"""
+        import numpy as np
+
+        with self._lock:
+            if self._size == 0:
+                self.misses += 1
+                return None
+            now = time.time()
+            similarities = self._matrix[:self._size] @ vector
+            similarities[self._expires_at[:self._size] <= now] = -1.0
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                self.misses += 1
+                return None
+            self._last_used[best] = now
+            self.hits += 1
+            return self._answers[best]
+
+    def store(self, vector: "np.ndarray", answer: str) -> None:
+        """写入缓存，已有相似条目时直接覆盖；满了以后优先替换过期条目，其次替换最久未使用的条目"""
+        import numpy as np
+
+        with self._lock:
+            now = time.time()
+            if self._matrix is None:
+                self._matrix = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+            similarities = self._matrix[:self._size] @ vector
+            if self._size and similarities.max() >= self.threshold:
+                slot = int(np.argmax(similarities))
+            elif self._size < self.max_size:
+                slot = self._size
+                self._size += 1
+            else:
+                expired = np.flatnonzero(self._expires_at <= now)
+                if expired.size:
+                    slot = int(expired[0])
+                else:
+                    slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            self._matrix[slot] = vector
+            self._expires_at[slot] = now + self.ttl
+            self._last_used[slot] = now
+            self._answers[slot] = answer
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": self._size,
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# 所有已创建的缓存，用于汇总统计
+_caches: List[SemanticCache] = []
+
+
+def semantic_cache_stats() -> Dict[str, Dict[str, float]]:
+    """获取每个agent的语义缓存统计"""
+    return {cache.name: cache.stats() for cache in _caches}
@@ -9,24 +9,46 @@
 API提供以下功能:
 - POST /api/query: 发送查询并获取回答
 - POST /api/query/stream: 发送查询并以流式方式获取回答
+- POST /api/query/batch: 批量发送查询，按完成顺序以NDJSON格式返回结果
 - GET /api/agents: 获取所有可用的专业助手列表
+- GET /api/agents/stats: 获取各专业助手的统计信息
+- GET /api/router/stats: 获取路由器统计信息
+- GET /api/stats: 获取API层面的统计信息
+- GET /metrics: Prometheus指标
 """
 
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import Response, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Dict, List, Optional, AsyncGenerator, Any
 import time
 import asyncio
 import json
 import logging
-from contextlib import asynccontextmanager
+import os
+import sys
+from contextlib import asynccontextmanager, nullcontext
 
 # 导入路由系统
 try:
-    from router import router_workflow, Route
+    from router import get_workflow, Route, AGENT_NODES
+    from agents.registry import agent_registry
+    from fast_router import stats as fast_router_stats
+    from route_cache import route_cache, normalize_query
+    from agents.semantic_cache import semantic_cache_stats
+    from agents.cascade import cascade_stats
+    from speculation import METADATA_KEY as SPECULATION_KEY, speculator
+    from keyword_router import keyword_router
+    from singleflight import SingleFlight, StreamSingleFlight
+    from memory import ENABLED as MEMORY_ENABLED, new_turn, schedule_compaction, thread_config, user_lock
+    from admission import Overloaded, Permit, admission
+    from resilience import CircuitOpen, DeadlineExceeded, breaker_stats, deadline_from_header, timeout_from_header
+    import metrics
+    from timing import FirstTokenHandler, Timings, timings_scope
+    import tokens
+    import tracing
 except ImportError:
     raise ImportError("请确保router.py文件在同一目录下，并且已安装所有依赖")
 
@@ -34,24 +56,58 @@ except ImportError:
 class QueryRequest(BaseModel):
     query: str
     user_id: Optional[str] = None
+    agent: Optional[str] = None
+    multi_agent: bool = False
+    max_agents: Optional[int] = None
+    debug: bool = False
+
+class BatchQueryRequest(BaseModel):
+    queries: List[QueryRequest]
+    # 0或负数会在开始返回结果之后才出错，在校验请求体时直接返回422
+    max_concurrency: Optional[int] = Field(None, ge=1)
 
 class QueryResponse(BaseModel):
     response: str
     agent_type: str
     processing_time: float
+    agent_types: Optional[List[str]] = None
+    turn_tokens: Optional[Dict[str, Any]] = None
+    long_input: Optional[Dict[str, Any]] = None
+    timings: Optional[Dict[str, float]] = None
 
 class AgentInfo(BaseModel):
     id: str
     name: str
     description: str
 
+# 批量查询的默认和最大并发数
+BATCH_MAX_CONCURRENCY = int(os.getenv("SCIAGENT_BATCH_MAX_CONCURRENCY", "16"))
+
+# 设为1时服务启动后在后台线程中预先构建工作流并加载所有agent，不阻塞启动
+PRELOAD = os.getenv("SCIAGENT_PRELOAD", "0") == "1"
+
+
+def preload():
+    start = time.perf_counter()
+    get_workflow()
+    agent_registry.load_all()
+    logger.info("预加载完成，耗时 %.1f ms", (time.perf_counter() - start) * 1000)
+
 # 创建应用实例
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 启动时的操作
     print("科研助手路由系统API已启动")
+    # tiktoken编码可能需要下载，不在第一个请求中同步加载
+    tokens.start_loading()
+    if PRELOAD:
+        asyncio.get_running_loop().run_in_executor(None, preload)
     yield
     # 关闭时的操作
+    # llm_client（导入httpx较慢）在第一次调用LLM时才导入，未导入时不需要关闭
+    if "llm_client" in sys.modules:
+        await sys.modules["llm_client"].aclose()
+    tracing.shutdown()
     print("科研助手路由系统API已关闭")
 
 app = FastAPI(
@@ -70,6 +126,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 查询接口的端到端耗时和进行中的请求数
+if metrics.ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# 查询请求的追踪（根span）
+if tracing.ENABLED:
+    app.add_middleware(tracing.TracingMiddleware)
+
 # 定义可用的专业助手
 AGENTS = [
     AgentInfo(
@@ -104,6 +168,143 @@ AGENTS = [
     ),
 ]
 
+AGENT_IDS = {agent.id for agent in AGENTS}
+
+# 相同查询的并发请求只执行一次工作流
+query_flight = SingleFlight()
+stream_flight = StreamSingleFlight()
+
+# 处理完成之前客户端断开连接（包括调用方超时放弃）的请求数
+disconnects = {"query": 0, "stream": 0}
+
+class ClientDisconnected(ConnectionAbortedError):
+    """客户端在处理完成之前断开了连接"""
+
+class PermitEventSourceResponse(EventSourceResponse):
+    """事件流结束时释放准入的Permit
+
+    事件生成器在finally中按结果释放；生成器没有开始迭代时（客户端在第一次发送前断开、发送响应头时出错）
+    其finally不会执行，由这里兜底释放，不计入耗时样本。Permit.release可以重复调用
+    """
+
+    def __init__(self, content, permit: Permit, **kwargs):
+        super().__init__(content, **kwargs)
+        self.permit = permit
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        except BaseException as e:
+            self.permit.release(e)
+            raise
+        finally:
+            self.permit.release(asyncio.CancelledError())
+
+def build_input(request: QueryRequest, req: Request) -> Dict[str, Any]:
+    """根据请求构建工作流的输入状态"""
+    if request.agent is not None and request.agent not in AGENT_IDS:
+        raise HTTPException(status_code=400, detail=f"未知的专业助手: {request.agent}")
+    cache_control = req.headers.get("cache-control", "").lower()
+    return {
+        "input": request.query,
+        "agent": request.agent,
+        "multi_agent": request.multi_agent,
+        "max_agents": request.max_agents,
+        "bypass_cache": "no-cache" in cache_control,
+        # X-Request-Timeout（秒）指定本次请求的超时，未指定时使用默认值
+        "deadline": deadline_from_header(req.headers.get("x-request-timeout")),
+    }
+
+def session_id(request: QueryRequest) -> Optional[str]:
+    """提供了user_id且启用了对话记忆时，本轮对话在该用户的会话中执行"""
+    return request.user_id if request.user_id and MEMORY_ENABLED else None
+
+def coalesce_key(inputs: Dict[str, Any], req: Request, user_id: Optional[str] = None):
+    """请求合并的key：归一化后的查询和其他请求参数都相同的请求才合并；多轮对话只合并同一用户的请求
+
+    合并的请求共享第一个请求的截止时间，因此超时（X-Request-Timeout）不同的请求不合并：
+    否则一个超时很短的请求会让所有相同请求一起504，超时很短的后到请求又会等到远超自己的截止时间。
+    超时相同时后到请求的截止时间只会更晚，共享的截止时间不会超过它自己的
+    """
+    return (
+        normalize_query(inputs["input"]),
+        inputs["agent"],
+        inputs["multi_agent"],
+        inputs["max_agents"],
+        inputs["bypass_cache"],
+        timeout_from_header(req.headers.get("x-request-timeout")),
+        user_id,
+    )
+
+def tenant_key(request: QueryRequest, req: Request) -> str:
+    """公平排队的租户：user_id，没有时为客户端IP"""
+    if request.user_id:
+        return request.user_id
+    return f"ip:{req.client.host}" if req.client else "anonymous"
+
+async def admit(request: QueryRequest, req: Request):
+    """按租户公平排队等待准入，服务繁忙时返回429，Retry-After为建议的重试等待秒数"""
+    try:
+        return await admission.acquire(tenant_key(request, req))
+    except Overloaded as e:
+        metrics.record_error(e)
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+def error_status(error: Exception):
+    """工作流异常对应的HTTP状态码和额外的响应头"""
+    if isinstance(error, DeadlineExceeded):
+        return 504, None
+    if isinstance(error, CircuitOpen):
+        return 503, {"Retry-After": str(error.retry_after)}
+    return 500, None
+
+async def wait_disconnect(req: Request) -> None:
+    """等待客户端断开连接；请求体已经读完，之后收到的消息只可能是http.disconnect"""
+    while (await req.receive())["type"] != "http.disconnect":
+        pass
+
+async def until_disconnected(req: Request, awaitable):
+    """等待awaitable完成，客户端先断开连接时取消它并抛出ClientDisconnected"""
+    task = asyncio.ensure_future(awaitable)
+    watcher = asyncio.ensure_future(wait_disconnect(req))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task.done():
+            return task.result()
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        raise ClientDisconnected()
+    finally:
+        watcher.cancel()
+        task.cancel()
+
+def workflow_callbacks(timings: Optional[Timings] = None) -> Dict[str, Any]:
+    """工作流配置中的回调：已采样的请求记录LLM调用的span，debug请求记录第一个token的时间"""
+    callbacks = tracing.callbacks()
+    if timings is not None:
+        callbacks.append(FirstTokenHandler(timings))
+    return {"callbacks": callbacks} if callbacks else {}
+
+async def run_workflow(inputs: Dict[str, Any], user_id: Optional[str] = None,
+                       timings: Optional[Timings] = None) -> Dict[str, Any]:
+    """执行一轮对话；有会话时使用带检查点的工作流，同一用户的请求依次执行
+
+    timings不为None时记录各阶段的耗时
+    """
+    with timings_scope(timings):
+        config = workflow_callbacks(timings)
+        if user_id is None:
+            return await get_workflow().ainvoke(inputs, config or None)
+        workflow = get_workflow(memory=True)
+        wait_start = time.perf_counter()
+        async with user_lock(user_id):
+            if timings is not None:
+                timings.add("queue", time.perf_counter() - wait_start)
+            state = await workflow.ainvoke(new_turn(inputs), {**thread_config(user_id), **config})
+        # 历史超出保留轮数时在后台生成摘要，不增加本轮的延迟
+        schedule_compaction(workflow, user_id, state.get("history"))
+        return state
+
 # 获取所有可用的专业助手
 @app.get("/api/agents", response_model=List[AgentInfo], tags=["agents"])
 async def get_agents():
@@ -112,120 +313,406 @@ async def get_agents():
 
 # 处理查询请求
 @app.post("/api/query", response_model=QueryResponse, tags=["query"])
-async def process_query(request: QueryRequest):
+async def process_query(request: QueryRequest, req: Request):
     """
     处理用户查询并返回回答
 
     - **query**: 用户的查询文本
-    - **user_id**: 可选的用户ID，用于未来的历史记录功能
+    - **user_id**: 可选的用户ID，提供时启用多轮对话记忆，同一用户的请求共享对话历史
+    - **agent**: 可选，直接指定处理的专业助手，跳过路由
+    - **multi_agent**: 是否允许同时调用多个专业助手并合并回答
+    - **max_agents**: 多agent模式下最多调用的专业助手数，不能超过服务端配置的上限
+
+    - **debug**: 为true时返回耗时分解（排队、路由、agent、首token、序列化），同时放在 `Server-Timing` 响应头和 `timings` 字段中；
+      debug请求不与其他相同请求合并
+
+    请求头 `Cache-Control: no-cache` 可以跳过路由缓存和语义缓存，强制重新生成回答；
+    请求头 `X-Request-Timeout` 指定超时秒数，超时返回504，对应的专业助手熔断且无法改由聊天助手回答时返回503
+
+    服务繁忙（并发数和等待队列都已满）时返回429，响应头 `Retry-After` 为建议的重试等待秒数。
+    客户端在处理完成之前断开连接时停止排队或取消工作流（没有其他相同请求在等待时），正在进行的LLM调用随之中止
     """
+    timings = Timings() if request.debug else None
+    inputs = build_input(request, req)
+    user_id = session_id(request)
+    try:
+        permit = await until_disconnected(req, admit(request, req))
+    except ClientDisconnected as e:
+        disconnects["query"] += 1
+        metrics.record_error(e)
+        logger.info("客户端在排队时断开连接")
+        raise HTTPException(status_code=499, detail="客户端已断开连接")
+    if timings is not None:
+        timings.add("queue", time.perf_counter() - timings.start)
     try:
         # 记录开始时间
         start_time = time.time()
 
-        # 使用异步方式调用路由系统
-        # 由于LangGraph不是原生异步的，我们使用run_in_executor来避免阻塞
-        def run_workflow():
-            return router_workflow.invoke({"input": request.query})
-
-        # 在线程池中运行同步代码
-        state = await asyncio.get_event_loop().run_in_executor(None, run_workflow)
+        # 路由器和agent节点都是原生异步的，直接在事件循环中等待，不占用线程池
+        # 相同查询正在处理时直接等待其结果；debug请求单独执行，耗时分解只反映本次请求
+        if timings is not None:
+            state = await until_disconnected(req, run_workflow(inputs, user_id, timings))
+        else:
+            state = await until_disconnected(req, query_flight.do(
+                coalesce_key(inputs, req, user_id), lambda: run_workflow(inputs, user_id)
+            ))
 
         # 计算处理时间
         processing_time = time.time() - start_time
 
         # 构建响应
-        return QueryResponse(
+        serialize_start = time.perf_counter()
+        result = QueryResponse(
             response=state["output"],
             agent_type=state["decision"],
-            processing_time=processing_time
+            processing_time=processing_time,
+            agent_types=state.get("decisions"),
+            turn_tokens=state.get("turn_tokens"),
+            long_input=state.get("long_input")
         )
+        if timings is None:
+            return result
+        # 按不带耗时的响应计算序列化时间，再把耗时放进响应
+        result.model_dump_json()
+        timings.add("serialize", time.perf_counter() - serialize_start)
+        timings.finish()
+        result.timings = timings.as_dict()
+        return Response(content=result.model_dump_json(), media_type="application/json",
+                        headers={"Server-Timing": timings.header()})
+    except ClientDisconnected as e:
+        # 没有人读取响应，状态码只用于访问日志
+        disconnects["query"] += 1
+        metrics.record_error(e)
+        logger.info("客户端已断开连接，工作流已取消")
+        permit.release(asyncio.CancelledError())
+        raise HTTPException(status_code=499, detail="客户端已断开连接")
     except Exception as e:
         # 记录错误并返回HTTP错误
+        permit.release(e)
+        metrics.record_error(e)
         error_msg = f"处理查询时出错: {str(e)}"
         print(error_msg)
-        raise HTTPException(status_code=500, detail=error_msg)
+        status_code, headers = error_status(e)
+        raise HTTPException(status_code=status_code, detail=error_msg, headers=headers)
+    except BaseException as e:
+        permit.release(e)
+        raise
+    finally:
+        permit.release()
 
 # 设置日志记录器
 logger = logging.getLogger("api")
 
+async def workflow_events(inputs: Dict[str, Any], user_id: Optional[str] = None,
+                          timings: Optional[Timings] = None) -> AsyncGenerator[Dict[str, str], None]:
+    """运行工作流并产生SSE事件，出错时产生error事件；有会话时使用带检查点的工作流
+
+    timings不为None时记录各阶段的耗时，放在response事件的timings字段中
+    """
+    def encode(data: Dict[str, Any]) -> str:
+        if timings is None:
+            return json.dumps(data, ensure_ascii=False)
+        start = time.perf_counter()
+        text = json.dumps(data, ensure_ascii=False)
+        timings.add("serialize", time.perf_counter() - start)
+        return text
+
+    try:
+        # 记录开始时间
+        start_time = time.time()
+
+        agent_type = None
+        response = None
+        turn_tokens = None
+        long_input = None
+        history = None
+        # 路由结果确定之前推测执行生成的token: (预测的路由, 内容)
+        speculative_tokens = []
+
+        workflow = get_workflow(memory=user_id is not None)
+        config = {**(thread_config(user_id) if user_id is not None else {}), **workflow_callbacks(timings)} or None
+        if user_id is not None:
+            inputs = new_turn(inputs)
+
+        # updates模式获取节点输出（路由决策、最终回答），messages模式获取agent的逐token输出
+        wait_start = time.perf_counter()
+        async with user_lock(user_id) if user_id is not None else nullcontext():
+            if timings is not None and user_id is not None:
+                timings.add("queue", time.perf_counter() - wait_start)
+            with timings_scope(timings):
+                async for mode, chunk in workflow.astream(inputs, config, stream_mode=["updates", "messages"]):
+                    if mode == "messages":
+                        message, metadata = chunk
+                        if not message.content:
+                            continue
+                        speculated = metadata.get(SPECULATION_KEY)
+                        if speculated is not None:
+                            # 推测执行在路由节点中运行：路由结果确定之前先缓存，之后只转发命中的token
+                            if agent_type is None:
+                                speculative_tokens.append((speculated, message.content))
+                                continue
+                            if speculated != agent_type:
+                                continue
+                        elif metadata.get("langgraph_node") not in AGENT_NODES:
+                            continue
+                        yield {
+                            "event": "token",
+                            "data": encode({"content": message.content})
+                        }
+                        continue
+
+                    for node, update in chunk.items():
+                        if not update:
+                            continue
+                        if node == "llm_call_router":
+                            # 路由器完成后立即发送决策信息
+                            agent_type = update["decision"]
+                            decision_data = {
+                                "agent_type": agent_type,
+                                "agent_types": update.get("decisions")
+                            }
+                            yield {
+                                "event": "decision",
+                                "data": encode(decision_data)
+                            }
+                            for speculated, content in speculative_tokens:
+                                if speculated == agent_type:
+                                    yield {"event": "token", "data": encode({"content": content})}
+                            speculative_tokens = []
+                        elif "output" in update:
+                            response = update["output"]
+                            long_input = update.get("long_input") or long_input
+                        elif node == "update_memory":
+                            turn_tokens = update.get("turn_tokens")
+                            history = update.get("history")
+        if user_id is not None:
+            # 释放该用户的锁之后再生成摘要，不推迟response事件
+            schedule_compaction(workflow, user_id, history)
+
+        # 计算处理时间
+        processing_time = time.time() - start_time
+
+        # 发送完整响应，缓存命中或推测执行命中时没有token事件，客户端直接使用完整回答
+        response_data = {
+            "response": response,
+            "agent_type": agent_type,
+            "processing_time": processing_time,
+            "turn_tokens": turn_tokens,
+            "long_input": long_input
+        }
+        if timings is not None:
+            timings.finish()
+            response_data["timings"] = timings.as_dict()
+        yield {
+            "event": "response",
+            "data": encode(response_data)
+        }
+
+    except Exception as e:
+        # 发送错误信息，合并的流式请求只记录一次
+        metrics.record_error(e)
+        error_data = {
+            "error": str(e),
+            "status": error_status(e)[0]
+        }
+        yield {
+            "event": "error",
+            "data": json.dumps(error_data, ensure_ascii=False)
+        }
+
 # 处理流式查询请求
 @app.post("/api/query/stream", tags=["query"])
 async def process_query_stream(request: QueryRequest, req: Request):
     """
     处理用户查询并以流式方式返回回答
 
+    依次发送以下SSE事件:
+    - **decision**: 路由器完成后立即发送，包含agent_type
+    - **token**: agent生成的增量文本
+    - **response**: 完整回答和处理时间
+    - **error**: 处理出错时发送
+
     - **query**: 用户的查询文本
-    - **user_id**: 可选的用户ID，用于未来的历史记录功能
+    - **user_id**: 可选的用户ID，提供时启用多轮对话记忆
+    - **agent**: 可选，直接指定处理的专业助手，跳过路由
+    - **multi_agent**: 是否允许同时调用多个专业助手；此时不发送token事件，合并后的回答在response事件中返回
+    - **max_agents**: 多agent模式下最多调用的专业助手数
+    - **debug**: 为true时response事件带有耗时分解 `timings`（响应头在事件流开始前已发送，不带 `Server-Timing`）；
+      debug请求不与其他相同请求合并
+
+    服务繁忙时在开始推送之前返回429，响应头 `Retry-After` 为建议的重试等待秒数
     """
+    timings = Timings() if request.debug else None
+    inputs = build_input(request, req)
+    user_id = session_id(request)
+    # 在返回事件流之前完成准入，被拒绝时客户端收到的是429而不是一个出错的事件流
+    try:
+        permit = await until_disconnected(req, admit(request, req))
+    except ClientDisconnected as e:
+        disconnects["stream"] += 1
+        metrics.record_error(e)
+        logger.info("客户端在排队时断开连接")
+        raise HTTPException(status_code=499, detail="客户端已断开连接")
+    if timings is not None:
+        timings.add("queue", time.perf_counter() - timings.start)
 
     async def event_generator():
+        error = None
         try:
-            # 记录开始时间
-            start_time = time.time()
-
-            # 使用完整的工作流处理请求
-            def run_workflow():
-                return router_workflow.invoke({"input": request.query})
-
             # 检查客户端是否已断开连接
             if await req.is_disconnected():
+                disconnects["stream"] += 1
+                metrics.record_error(ClientDisconnected())
                 logger.info("客户端已断开连接，停止工作流")
                 return
 
-            # 在线程池中运行同步代码
-            state = await asyncio.get_event_loop().run_in_executor(None, run_workflow)
+            # 相同查询的流式请求共享同一个事件流，debug请求单独执行
+            if timings is not None:
+                events = workflow_events(inputs, user_id, timings)
+            else:
+                events = stream_flight.subscribe(coalesce_key(inputs, req, user_id), lambda: workflow_events(inputs, user_id))
+            async for event in events:
+                yield event
+                if event["event"] == "error":
+                    error = RuntimeError(event["data"])
+
+                # 检查客户端是否已断开连接
+                if event["event"] != "token" and await req.is_disconnected():
+                    disconnects["stream"] += 1
+                    metrics.record_error(ClientDisconnected())
+                    logger.info("客户端已断开连接，停止工作流")
+                    return
+        except asyncio.CancelledError as e:
+            # 客户端断开时EventSourceResponse取消本生成器，退出订阅后没有其他订阅者时工作流随之取消
+            disconnects["stream"] += 1
+            metrics.record_error(e)
+            logger.info("流处理已取消")
+            error = e
+            raise
+        finally:
+            permit.release(error)
+
+    try:
+        return PermitEventSourceResponse(
+            event_generator(),
+            permit,
+            media_type="text/event-stream",
+            sep="\n"
+        )
+    except BaseException as e:
+        permit.release(e)
+        raise
 
-            # 获取决策和输出
-            agent_type = state["decision"]
-            response = state["output"]
+# 批量查询
+@app.post("/api/query/batch", tags=["query"])
+async def process_query_batch(request: BatchQueryRequest, req: Request):
+    """
+    批量处理查询，按完成顺序以NDJSON格式逐行返回结果
 
-            # 发送决策信息
-            decision_data = {
-                "agent_type": agent_type
-            }
-            yield {
-                "event": "decision",
-                "data": json.dumps(decision_data, ensure_ascii=False)
-            }
+    - **queries**: 查询列表，每一项与 /api/query 的请求体相同
+    - **max_concurrency**: 可选的最大并发数（至少为1），超过服务端配置的上限时按上限处理
 
-            # 检查客户端是否已断开连接
-            if await req.is_disconnected():
-                logger.info("客户端已断开连接，停止工作流")
-                return
+    批量查询不使用对话记忆，请求中的user_id只用于公平排队。请求头 `X-Request-Timeout` 是整个批次的超时，未指定时不限制。
 
-            # 计算处理时间
-            processing_time = time.time() - start_time
-
-            # 发送完整响应
-            response_data = {
-                "response": response,
-                "agent_type": agent_type,
-                "processing_time": processing_time
-            }
-            yield {
-                "event": "response",
-                "data": json.dumps(response_data, ensure_ascii=False)
-            }
-
-        except asyncio.CancelledError:
-            logger.info("流处理已取消")
-            raise
-        except Exception as e:
-            # 发送错误信息
-            error_data = {
-                "error": str(e)
-            }
-            yield {
-                "event": "error",
-                "data": json.dumps(error_data, ensure_ascii=False)
-            }
-
-    return EventSourceResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        sep="\n"
-    )
+    每一项查询与单个查询一样经过准入控制，按该项的user_id（没有时为客户端IP）公平排队，
+    一个批量请求不能绕过并发上限和租户的份额；排队被拒绝的查询返回 `status` 为429的错误行。
+
+    每行是一个JSON对象，`index`为该查询在请求列表中的位置，`processing_time`为从批量请求开始到该查询完成的时间；
+    出错的查询返回`error`字段和对应的HTTP状态码`status`
+    """
+    max_concurrency = min(request.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    inputs = [build_input(query, req) for query in request.queries]
+    tenants = [tenant_key(query, req) for query in request.queries]
+    if "x-request-timeout" not in req.headers:
+        # 批量查询排队时间较长，只有显式指定超时时才对整个批次设置截止时间
+        for item in inputs:
+            item["deadline"] = None
+
+    async def run_item(index: int, limit: asyncio.Semaphore):
+        """在批次的并发数以内逐项准入并执行，返回 (原始下标, 结果或异常)"""
+        async with limit:
+            try:
+                async with admission.admit(tenants[index]):
+                    return index, await get_workflow().ainvoke(inputs[index], workflow_callbacks() or None)
+            except Exception as e:
+                return index, e
+
+    async def result_generator():
+        start_time = time.time()
+        limit = asyncio.Semaphore(max_concurrency)
+        tasks = [asyncio.ensure_future(run_item(index, limit)) for index in range(len(inputs))]
+        try:
+            # 按完成顺序返回；客户端断开时取消还没有完成的查询
+            for completed in asyncio.as_completed(tasks):
+                index, state = await completed
+                if isinstance(state, Exception):
+                    metrics.record_error(state)
+                    status = 429 if isinstance(state, Overloaded) else error_status(state)[0]
+                    result = {"index": index, "error": str(state), "status": status}
+                else:
+                    result = {
+                        "index": index,
+                        "response": state["output"],
+                        "agent_type": state["decision"],
+                        "agent_types": state.get("decisions"),
+                        "long_input": state.get("long_input"),
+                        "processing_time": time.time() - start_time,
+                    }
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(result_generator(), media_type="application/x-ndjson")
+
+# agent统计
+@app.get("/api/agents/stats", tags=["agents"])
+async def agents_stats():
+    """获取各专业助手的统计信息"""
+    return {"semantic_cache": semantic_cache_stats(), "cascade": cascade_stats(), "circuit_breakers": breaker_stats()}
+
+# 系统统计
+@app.get("/api/stats", tags=["system"])
+async def system_stats():
+    """获取API层面的统计信息"""
+    # llm_client在第一次调用LLM时才导入，这里不为统计触发导入
+    llm_client = sys.modules.get("llm_client")
+    llm_stats = llm_client.stats() if llm_client is not None else None
+    return {
+        "coalescing": {
+            "query": query_flight.stats(),
+            "stream": stream_flight.stats(),
+        },
+        "cancellation": {
+            "client_disconnects": disconnects,
+            "workflows_cancelled": query_flight.cancelled + stream_flight.cancelled,
+            "llm_calls": llm_stats["cancellation"] if llm_stats is not None else "未初始化",
+        },
+        "admission": admission.stats(),
+        "tenants": admission.tenant_stats(),
+        "llm_pool": llm_stats if llm_stats is not None else "未初始化",
+    }
+
+# 路由统计
+@app.get("/api/router/stats", tags=["system"])
+async def router_stats():
+    """获取路由器的统计信息"""
+    return {
+        "rules": keyword_router.stats() if keyword_router is not None else None,
+        "fast_path": fast_router_stats.snapshot(),
+        "route_cache": route_cache.stats(),
+        "speculation": speculator.stats(),
+        "agents": agent_registry.stats(),
+    }
+
+# Prometheus指标
+@app.get("/metrics", tags=["system"])
+async def prometheus_metrics():
+    """Prometheus格式的指标（需要安装prometheus-client）"""
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=501, detail="未启用指标，请安装prometheus-client或检查SCIAGENT_METRICS")
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 # 健康检查端点
 @app.get("/health", tags=["system"])
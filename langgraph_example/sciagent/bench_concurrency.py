@@ -0,0 +1,110 @@
+"""
+并发基准测试：run_in_executor + invoke 与原生 ainvoke 的对比
+
+用FakeChatModel替换路由器和agent的LLM，模拟慢速的上游调用，分别测量:
+- before: 每个请求通过 run_in_executor(None, router_workflow.invoke) 在默认线程池中执行
+- after: 每个请求直接 await router_workflow.ainvoke
+
+每种模式在单独的子进程中运行，以便分别统计内存峰值（RSS）。
+
+使用方法:
+    python bench_concurrency.py --requests 1000 --latency 0.5
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+# 基准测试不访问真实的API，也不使用缓存和推测执行
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ["SCIAGENT_SEMANTIC_CACHE"] = "0"
+os.environ["SCIAGENT_ROUTE_CACHE_SIZE"] = "0"
+os.environ["SCIAGENT_SPECULATIVE"] = "0"
+os.environ["SCIAGENT_CASCADE"] = "0"
+
+import router as router_module
+from agents import base_agent
+from fake_llm import FakeChatModel
+
+
+def install_fake_llm(latency: float) -> None:
+    """把路由器和agent的LLM替换为假模型"""
+    fake = FakeChatModel(latency=latency, route_fn=lambda text: "chat")
+    base_agent.llm = fake
+    router_module.router = fake.with_structured_output(router_module.Route)
+
+
+async def run_batch(mode: str, n_requests: int) -> dict:
+    """并发执行n_requests个请求，记录耗时和线程数"""
+    workflow = router_module.router_workflow
+    loop = asyncio.get_running_loop()
+    peak_threads = threading.active_count()
+    done = asyncio.Event()
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while not done.is_set():
+            peak_threads = max(peak_threads, threading.active_count())
+            await asyncio.sleep(0.01)
+
+    async def one(i: int):
+        state = {"input": f"基准测试请求 {i}"}
+        if mode == "before":
+            return await loop.run_in_executor(None, workflow.invoke, state)
+        return await workflow.ainvoke(state)
+
+    sampler = asyncio.create_task(sample_threads())
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n_requests)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    await sampler
+
+    return {
+        "mode": mode,
+        "requests": n_requests,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(n_requests / elapsed, 1),
+        "peak_threads": peak_threads,
+        # Linux上ru_maxrss的单位是KB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run_in_executor与原生异步执行的并发对比")
+    parser.add_argument("--requests", type=int, default=1000, help="并发请求数")
+    parser.add_argument("--latency", type=float, default=0.5, help="每次LLM调用的模拟延迟（秒）")
+    parser.add_argument("--mode", choices=["before", "after"], help="只运行一种模式（供子进程使用）")
+    parser.add_argument("--output", help="结果JSON的保存路径")
+    args = parser.parse_args()
+
+    if args.mode:
+        install_fake_llm(args.latency)
+        print(json.dumps(asyncio.run(run_batch(args.mode, args.requests)), ensure_ascii=False))
+        return
+
+    results = []
+    for mode in ("before", "after"):
+        completed = subprocess.run(
+            [sys.executable, __file__, "--mode", mode,
+             "--requests", str(args.requests), "--latency", str(args.latency)],
+            capture_output=True, text=True, check=True,
+        )
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        results.append(result)
+        print(json.dumps(result, ensure_ascii=False))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+路由系统的离线基准测试和准确率评估
+
+用带标注的查询语料（JSONL，每行包含query和label）驱动router_workflow，路由器和agent的LLM
+都替换为FakeChatModel，不访问任何外部服务。报告:
+- 每个图节点耗时的p50/p95/p99，以及端到端耗时
+- 不同并发度下的吞吐量
+- 路由混淆矩阵、准确率，以及各阶段（关键词规则/快速路由/LLM路由器）做出决策的次数
+- 顺序执行时每个请求保留的内存块数和内存峰值（tracemalloc）
+
+结果写成JSON，可以用 --baseline 与之前某次提交的结果对比。
+
+使用方法:
+    python bench_router.py --concurrency 1,8,32 --agent-latency lognormal:0.5,0.6 --output bench.json
+    python bench_router.py --baseline bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List
+
+# 基准测试不访问真实的API，默认不使用缓存和推测执行，保证每次结果可比
+os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+os.environ.setdefault("SCIAGENT_SEMANTIC_CACHE", "0")
+os.environ.setdefault("SCIAGENT_ROUTE_CACHE_SIZE", "0")
+os.environ.setdefault("SCIAGENT_SPECULATIVE", "0")
+os.environ.setdefault("SCIAGENT_CASCADE", "0")
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import fast_router
+import keyword_router
+import router as router_module
+from agents import base_agent
+from fake_llm import FakeChatModel, latency_distribution
+
+DEFAULT_CORPUS = Path(__file__).parent / "data" / "router_corpus.jsonl"
+ROUTES = list(router_module.AGENT_FUNCTIONS)
+
+
+class NodeTimer(BaseCallbackHandler):
+    """记录每个图节点的执行耗时"""
+
+    # 在事件循环中同步调用，避免回调排队影响计时
+    run_inline = True
+
+    def __init__(self):
+        self._starts: Dict = {}
+        self.durations: Dict[str, List[float]] = defaultdict(list)
+
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        node = (metadata or {}).get("langgraph_node")
+        # 只统计节点本身的运行，不统计节点内部的子链
+        if node and kwargs.get("name") == node:
+            self._starts[run_id] = (node, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        started = self._starts.pop(run_id, None)
+        if started:
+            node, start = started
+            self.durations[node].append(time.perf_counter() - start)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._starts.pop(run_id, None)
+
+
+class OracleRouter:
+    """按语料标注返回路由结果，并以error_rate的概率返回错误的路由，模拟LLM路由器的误判"""
+
+    def __init__(self, labels: Dict[str, str], error_rate: float = 0.0, seed: int = 0):
+        self.labels = labels
+        self.error_rate = error_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+
+    def __call__(self, text: str) -> str:
+        self.calls += 1
+        label = self.labels.get(text, "chat")
+        if self._rng.random() < self.error_rate:
+            return self._rng.choice([route for route in ROUTES if route != label])
+        return label
+
+
+def load_corpus(path) -> List[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def install_fake_llm(oracle: OracleRouter, router_latency: str, agent_latency: str, seed: int) -> None:
+    """把路由器和agent的LLM替换为假模型"""
+    agent_llm = FakeChatModel(latency=latency_distribution(agent_latency, seed))
+    router_llm = FakeChatModel(latency=latency_distribution(router_latency, seed + 1), route_fn=oracle)
+    base_agent.llm = agent_llm
+    router_module.router = router_llm.with_structured_output(router_module.Route)
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """返回p50/p95/p99（毫秒，最近秩法）"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered))) - 1))]
+
+    return {
+        "count": len(ordered),
+        "p50_ms": round(rank(0.50) * 1000, 2),
+        "p95_ms": round(rank(0.95) * 1000, 2),
+        "p99_ms": round(rank(0.99) * 1000, 2),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+    }
+
+
+def stage_counters(oracle: OracleRouter) -> Dict[str, int]:
+    """各路由阶段当前的命中计数"""
+    rules = keyword_router.keyword_router
+    return {
+        "rules": rules.hits if rules else 0,
+        "fast_path": fast_router.stats.hits,
+        "llm_router": oracle.calls,
+    }
+
+
+async def run_level(corpus: List[dict], concurrency: int, repeat: int) -> dict:
+    """以给定并发度执行语料repeat遍"""
+    workflow = router_module.router_workflow
+    timer = NodeTimer()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    predictions: List[tuple] = []
+    errors = 0
+
+    async def one(item: dict):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await workflow.ainvoke({"input": item["query"]}, config={"callbacks": [timer]})
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+            predictions.append((item["label"], result.get("decision")))
+
+    items = corpus * repeat
+    start = time.perf_counter()
+    await asyncio.gather(*(one(item) for item in items))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(items),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(items) / elapsed, 2),
+        "end_to_end": percentiles(latencies),
+        "nodes": {node: percentiles(values) for node, values in sorted(timer.durations.items())},
+        "_predictions": predictions,
+    }
+
+
+def confusion(predictions: List[tuple]) -> dict:
+    """混淆矩阵（行为标注，列为路由结果）以及每个路由的召回率"""
+    matrix = {label: {route: 0 for route in ROUTES} for label in ROUTES}
+    for label, predicted in predictions:
+        matrix[label][predicted] = matrix[label].get(predicted, 0) + 1
+    correct = sum(matrix[label][label] for label in ROUTES)
+    recall = {
+        label: round(row[label] / sum(row.values()), 4)
+        for label, row in matrix.items() if sum(row.values())
+    }
+    return {
+        "accuracy": round(correct / len(predictions), 4) if predictions else 0.0,
+        "recall": recall,
+        "matrix": matrix,
+    }
+
+
+async def measure_allocations(corpus: List[dict]) -> dict:
+    """顺序执行一遍语料，统计每个请求新增（未释放）的内存块和执行期间的内存峰值"""
+    workflow = router_module.router_workflow
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    for item in corpus:
+        await workflow.ainvoke({"input": item["query"]})
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    diff = after.compare_to(before, "filename")
+    allocated = [stat for stat in diff if stat.size_diff > 0]
+    n = len(corpus)
+    return {
+        "requests": n,
+        "retained_blocks_per_request": round(sum(stat.count_diff for stat in allocated) / n, 1),
+        "retained_kb_per_request": round(sum(stat.size_diff for stat in allocated) / n / 1024, 2),
+        "peak_traced_mb": round(peak / 1024 / 1024, 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def run_benchmark(args) -> dict:
+    corpus = load_corpus(args.corpus)
+    oracle = OracleRouter({item["query"]: item["label"] for item in corpus}, args.router_error_rate, args.seed)
+    install_fake_llm(oracle, args.router_latency, args.agent_latency, args.seed)
+
+    # 预热一次，排除首次调用的初始化开销
+    await router_module.router_workflow.ainvoke({"input": corpus[0]["query"]})
+
+    counters_before = stage_counters(oracle)
+    levels = []
+    predictions: List[tuple] = []
+    for concurrency in args.concurrency:
+        level = await run_level(corpus, concurrency, args.repeat)
+        predictions.extend(level.pop("_predictions"))
+        levels.append(level)
+    counters_after = stage_counters(oracle)
+
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "corpus": str(args.corpus),
+            "corpus_size": len(corpus),
+            "repeat": args.repeat,
+            "router_latency": args.router_latency,
+            "agent_latency": args.agent_latency,
+            "router_error_rate": args.router_error_rate,
+            "seed": args.seed,
+        },
+        "levels": levels,
+        "routing": {
+            **confusion(predictions),
+            "decided_by": {name: counters_after[name] - counters_before[name] for name in counters_after},
+        },
+        "allocations": await measure_allocations(corpus) if not args.skip_allocations else None,
+    }
+
+
+def compare(current: dict, baseline: dict) -> None:
+    """打印与基线结果的差异"""
+
+    def change(new, old):
+        return f"{new} ({(new - old) / old * 100:+.1f}%)" if old else str(new)
+
+    print(f"对比基线 {baseline.get('commit')} -> {current.get('commit')}")
+    print(f"准确率: {change(current['routing']['accuracy'], baseline['routing']['accuracy'])}")
+    old_levels = {level["concurrency"]: level for level in baseline["levels"]}
+    for level in current["levels"]:
+        old = old_levels.get(level["concurrency"])
+        if old is None:
+            continue
+        print(f"并发 {level['concurrency']}: "
+              f"吞吐 {change(level['throughput_rps'], old['throughput_rps'])} rps, "
+              f"p95 {change(level['end_to_end']['p95_ms'], old['end_to_end']['p95_ms'])} ms")
+    if current.get("allocations") and baseline.get("allocations"):
+        print(f"每请求保留: {change(current['allocations']['retained_kb_per_request'], baseline['allocations']['retained_kb_per_request'])} KB")
+        print(f"内存峰值: {change(current['allocations']['peak_traced_mb'], baseline['allocations']['peak_traced_mb'])} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="路由系统离线基准测试")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="带标注的查询语料（JSONL）")
+    parser.add_argument("--concurrency", default="1,8,32",
+                        type=lambda value: [int(x) for x in value.split(",")], help="逗号分隔的并发度列表")
+    parser.add_argument("--repeat", type=int, default=2, help="每个并发度下语料执行的遍数")
+    parser.add_argument("--router-latency", default="lognormal:0.3,0.4", help="路由器LLM的延迟分布")
+    parser.add_argument("--agent-latency", default="lognormal:0.8,0.5", help="agent LLM的延迟分布")
+    parser.add_argument("--router-error-rate", type=float, default=0.05, help="LLM路由器返回错误路由的概率")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--skip-allocations", action="store_true", help="不统计内存分配")
+    parser.add_argument("--output", help="结果JSON的保存路径")
+    parser.add_argument("--baseline", help="与之前的结果JSON对比")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            compare(result, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+对话记忆的检查点存储（见memory.py）
+
+在LangGraph的MemorySaver基础上，每个用户只保留最近的几个检查点，并按LRU淘汰不活跃的用户。
+单独成模块，导入api时不需要加载langgraph，构建带记忆的工作流时才导入。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Tuple
+
+from langgraph.checkpoint.memory import MemorySaver
+
+from memory import MAX_USERS
+
+
+class BoundedMemorySaver(MemorySaver):
+    """只保留每个用户最近的几个检查点，并按LRU淘汰不活跃的用户，避免内存随时间无限增长"""
+
+    def __init__(self, keep: int = 2, max_threads: int = MAX_USERS):
+        super().__init__()
+        # 至少保留两个: 最新检查点的待执行任务（Send）记录在上一个检查点的写入中
+        self.keep = max(keep, 2)
+        self.max_threads = max_threads
+        self._threads: OrderedDict = OrderedDict()
+        self._blob_keys: Dict[Tuple[str, str], set] = {}
+        self._prune_lock = threading.Lock()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._prune_lock:
+            self._blob_keys.setdefault((thread_id, checkpoint_ns), set()).update(
+                (thread_id, checkpoint_ns, channel, version) for channel, version in new_versions.items()
+            )
+            self._prune(thread_id, checkpoint_ns)
+            self._threads[thread_id] = None
+            self._threads.move_to_end(thread_id)
+            while len(self._threads) > self.max_threads:
+                evicted, _ = self._threads.popitem(last=False)
+                self._drop_thread(evicted)
+        return result
+
+    def _prune(self, thread_id: str, checkpoint_ns: str) -> None:
+        checkpoints = self.storage[thread_id][checkpoint_ns]
+        if len(checkpoints) <= self.keep:
+            return
+        for checkpoint_id in list(checkpoints)[: -self.keep]:
+            del checkpoints[checkpoint_id]
+            self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+
+        # 删除剩余检查点不再引用的通道值
+        live = set()
+        for saved_checkpoint, _, _ in checkpoints.values():
+            versions = self.serde.loads_typed(saved_checkpoint)["channel_versions"]
+            live.update((thread_id, checkpoint_ns, channel, version) for channel, version in versions.items())
+        keys = self._blob_keys[(thread_id, checkpoint_ns)]
+        for key in keys - live:
+            self.blobs.pop(key, None)
+        keys &= live
+
+    def _drop_thread(self, thread_id: str) -> None:
+        for checkpoint_ns, checkpoints in self.storage.pop(thread_id, {}).items():
+            for checkpoint_id in checkpoints:
+                self.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            for key in self._blob_keys.pop((thread_id, checkpoint_ns), set()):
+                self.blobs.pop(key, None)
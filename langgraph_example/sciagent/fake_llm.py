@@ -0,0 +1,89 @@
+"""
+用于基准测试的假聊天模型
+
+不发起任何网络请求，按配置的延迟返回固定内容，支持同步/异步调用和with_structured_output，
+可以替换router.py和agents/base_agent.py中的LLM，在本地测量路由系统本身的开销。
+
+延迟可以是固定值，也可以是latency_distribution()返回的采样函数，例如:
+    FakeChatModel(latency=latency_distribution("lognormal:0.5,0.6"))
+"""
+
+import asyncio
+import math
+import random
+import time
+from typing import Any, Callable, List, Optional, Union
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+
+def latency_distribution(spec: str, seed: Optional[int] = None) -> Callable[[], float]:
+    """根据描述创建延迟采样函数（单位为秒）
+
+    支持的格式:
+    - "const:0.5": 固定延迟
+    - "uniform:0.2,0.8": 均匀分布
+    - "lognormal:0.5,0.6": 对数正态分布，参数为中位数和sigma，适合模拟带长尾的上游延迟
+    """
+    rng = random.Random(seed)
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",")] if params else []
+    if kind == "const":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: rng.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"未知的延迟分布: {spec}")
+
+
+class FakeChatModel(BaseChatModel):
+    """按配置的延迟返回回答的假模型"""
+
+    latency: Union[float, Callable[[], float]] = 0.5
+    response: str = "这是一个用于基准测试的回答。"
+    # 结构化输出时根据最后一条消息的内容选择字段值
+    route_fn: Optional[Callable[[str], Any]] = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _sample_latency(self) -> float:
+        return self.latency() if callable(self.latency) else self.latency
+
+    def _result(self) -> ChatResult:
+        message = AIMessage(
+            content=self.response,
+            usage_metadata={"input_tokens": 50, "output_tokens": 20, "total_tokens": 70},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self._sample_latency())
+        return self._result()
+
+    async def _agenerate(self, messages: List[BaseMessage], stop=None, run_manager=None, **kwargs) -> ChatResult:
+        await asyncio.sleep(self._sample_latency())
+        return self._result()
+
+    def with_structured_output(self, schema, **kwargs):
+        """返回schema实例，字段值由route_fn根据用户输入决定"""
+
+        def build(messages):
+            value = self.route_fn(messages[-1].content) if self.route_fn else None
+            return schema(step=value)
+
+        def invoke(messages):
+            time.sleep(self._sample_latency())
+            return build(messages)
+
+        async def ainvoke(messages):
+            await asyncio.sleep(self._sample_latency())
+            return build(messages)
+
+        return RunnableLambda(invoke, afunc=ainvoke)
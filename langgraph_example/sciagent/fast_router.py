@@ -0,0 +1,266 @@
+"""
+本地快速路由分类器
+
+使用字符n-gram TF-IDF特征 + 线性(softmax)分类器，从记录下来的 (query, decision) 数据训练。
+置信度高于阈值的请求直接在本地给出路由结果，低于阈值时回退到LLM路由器。
+
+使用说明:
+1. 记录路由数据: 设置环境变量 SCIAGENT_ROUTE_LOG=data/route_log.jsonl 后正常运行API
+2. 训练并导出模型: python fast_router.py train --data data/route_log.jsonl --output fast_router_model.json
+3. 启用快速路由: 将模型放在 SCIAGENT_FAST_ROUTER_MODEL 指定的位置（默认为本目录下的 fast_router_model.json）
+4. 调整阈值: SCIAGENT_FAST_ROUTER_THRESHOLD（默认0.85）
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import jsonl_log
+
+# 配置
+DEFAULT_MODEL_PATH = Path(__file__).parent / "fast_router_model.json"
+MODEL_PATH = Path(os.getenv("SCIAGENT_FAST_ROUTER_MODEL", DEFAULT_MODEL_PATH))
+THRESHOLD = float(os.getenv("SCIAGENT_FAST_ROUTER_THRESHOLD", "0.85"))
+ROUTE_LOG_PATH = os.getenv("SCIAGENT_ROUTE_LOG")
+
+
+def char_ngrams(text: str, n_min: int = 1, n_max: int = 3) -> Counter:
+    """提取字符n-gram，中英文混合输入都适用"""
+    text = " ".join(text.lower().split())
+    padded = f" {text} "
+    grams = Counter()
+    for n in range(n_min, n_max + 1):
+        for i in range(len(padded) - n + 1):
+            gram = padded[i:i + n]
+            if gram.strip():
+                grams[gram] += 1
+    return grams
+
+
+class FastRouter:
+    """字符n-gram TF-IDF线性分类器"""
+
+    def __init__(self, labels: List[str], features: Dict[str, Tuple[float, List[float]]],
+                 bias: List[float], n_min: int = 1, n_max: int = 3):
+        self.labels = labels
+        # n-gram -> (idf, 每个类别的权重)
+        self.features = features
+        self.bias = bias
+        self.n_min = n_min
+        self.n_max = n_max
+
+    def _vectorize(self, text: str) -> Dict[str, float]:
+        """计算L2归一化的TF-IDF向量，只保留词表中的n-gram"""
+        vector = {}
+        for gram, tf in char_ngrams(text, self.n_min, self.n_max).items():
+            entry = self.features.get(gram)
+            if entry is not None:
+                vector[gram] = (1.0 + math.log(tf)) * entry[0]
+        norm = math.sqrt(sum(v * v for v in vector.values()))
+        if norm > 0:
+            for gram in vector:
+                vector[gram] /= norm
+        return vector
+
+    def predict_proba(self, text: str) -> List[float]:
+        """返回每个类别的概率"""
+        scores = list(self.bias)
+        for gram, value in self._vectorize(text).items():
+            weights = self.features[gram][1]
+            for k in range(len(scores)):
+                scores[k] += weights[k] * value
+        return _softmax(scores)
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """返回 (最可能的类别, 置信度)"""
+        probs = self.predict_proba(text)
+        best = max(range(len(probs)), key=probs.__getitem__)
+        return self.labels[best], probs[best]
+
+    @classmethod
+    def train(cls, samples: List[Tuple[str, str]], epochs: int = 20, learning_rate: float = 0.5,
+              l2: float = 1e-4, min_df: int = 2, n_min: int = 1, n_max: int = 3,
+              seed: int = 0) -> "FastRouter":
+        """用SGD训练多分类逻辑回归"""
+        if not samples:
+            raise ValueError("没有训练样本：检查路由日志是否为空，或减小--holdout")
+        labels = sorted({label for _, label in samples})
+        label_index = {label: i for i, label in enumerate(labels)}
+
+        # 统计文档频率，过滤低频n-gram
+        grams_per_doc = [char_ngrams(text, n_min, n_max) for text, _ in samples]
+        df = Counter()
+        for grams in grams_per_doc:
+            df.update(grams.keys())
+        n_docs = len(samples)
+        features = {
+            gram: (math.log((1 + n_docs) / (1 + count)) + 1.0, [0.0] * len(labels))
+            for gram, count in df.items() if count >= min_df
+        }
+        model = cls(labels, features, [0.0] * len(labels), n_min, n_max)
+
+        data = [(model._vectorize(text), label_index[label]) for text, label in samples]
+        rng = random.Random(seed)
+        for epoch in range(epochs):
+            rng.shuffle(data)
+            lr = learning_rate / (1.0 + epoch)
+            for vector, target in data:
+                probs = _softmax([
+                    model.bias[k] + sum(features[g][1][k] * v for g, v in vector.items())
+                    for k in range(len(labels))
+                ])
+                for k in range(len(labels)):
+                    grad = probs[k] - (1.0 if k == target else 0.0)
+                    model.bias[k] -= lr * grad
+                    for gram, value in vector.items():
+                        weights = features[gram][1]
+                        weights[k] -= lr * (grad * value + l2 * weights[k])
+        return model
+
+    def save(self, path) -> None:
+        """导出模型为JSON文件"""
+        payload = {
+            "labels": self.labels,
+            "bias": self.bias,
+            "n_min": self.n_min,
+            "n_max": self.n_max,
+            "features": {gram: [idf, weights] for gram, (idf, weights) in self.features.items()},
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path) -> "FastRouter":
+        """从JSON文件加载模型"""
+        with open(path, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        features = {gram: (idf, weights) for gram, (idf, weights) in payload["features"].items()}
+        return cls(payload["labels"], features, payload["bias"], payload["n_min"], payload["n_max"])
+
+
+def _softmax(scores: List[float]) -> List[float]:
+    top = max(scores)
+    exps = [math.exp(s - top) for s in scores]
+    total = sum(exps)
+    return [e / total for e in exps]
+
+
+# 快速路由统计
+class FastPathStats:
+    """快速路由命中计数器（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.fallbacks = 0
+
+    def record(self, hit: bool) -> None:
+        with self._lock:
+            self.requests += 1
+            if hit:
+                self.hits += 1
+            else:
+                self.fallbacks += 1
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "fast_path_hits": self.hits,
+                "llm_fallbacks": self.fallbacks,
+                "hit_rate": self.hits / self.requests if self.requests else 0.0,
+            }
+
+
+stats = FastPathStats()
+
+# 启动时加载模型，模型不存在时快速路由不生效
+_model: Optional[FastRouter] = FastRouter.load(MODEL_PATH) if MODEL_PATH.exists() else None
+
+
+def fast_route(query: str, threshold: float = THRESHOLD) -> Optional[str]:
+    """置信度足够时返回路由结果，否则返回None表示需要回退到LLM路由器"""
+    if _model is None:
+        return None
+    label, confidence = _model.predict(query)
+    hit = confidence >= threshold
+    stats.record(hit)
+    return label if hit else None
+
+
+def guess_route(query: str) -> Optional[str]:
+    """不考虑置信度，返回分类器最可能的路由，供推测执行使用"""
+    if _model is None:
+        return None
+    return _model.predict(query)[0]
+
+
+def log_decision(query: str, decision: str) -> None:
+    """记录LLM路由器的决策，作为快速路由的训练数据（由后台线程写入文件）"""
+    if not ROUTE_LOG_PATH:
+        return
+    jsonl_log.append(ROUTE_LOG_PATH, {"query": query, "decision": decision, "ts": time.time()})
+
+
+def load_samples(paths: Iterable[str]) -> List[Tuple[str, str]]:
+    """读取JSONL格式的 (query, decision) 数据"""
+    samples = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    record = json.loads(line)
+                    samples.append((record["query"], record["decision"]))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="训练和导出本地快速路由分类器")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    train_parser = subparsers.add_parser("train", help="从路由日志训练模型并导出")
+    train_parser.add_argument("--data", nargs="+", required=True, help="JSONL格式的路由日志")
+    train_parser.add_argument("--output", default=str(DEFAULT_MODEL_PATH), help="模型导出路径")
+    train_parser.add_argument("--epochs", type=int, default=20)
+    train_parser.add_argument("--min-df", type=int, default=2)
+    train_parser.add_argument("--holdout", type=float, default=0.1, help="用于评估的数据比例")
+    train_parser.add_argument("--threshold", type=float, default=THRESHOLD)
+
+    args = parser.parse_args()
+
+    samples = load_samples(args.data)
+    random.Random(0).shuffle(samples)
+    n_holdout = int(len(samples) * args.holdout)
+    holdout, train_set = samples[:n_holdout], samples[n_holdout:]
+    print(f"训练样本: {len(train_set)}, 评估样本: {len(holdout)}")
+
+    start_time = time.time()
+    model = FastRouter.train(train_set, epochs=args.epochs, min_df=args.min_df)
+    print(f"训练完成, 特征数: {len(model.features)}, 耗时: {time.time() - start_time:.2f}s")
+
+    if holdout:
+        # 报告阈值下的覆盖率和准确率，便于选择阈值
+        covered = correct = 0
+        for text, label in holdout:
+            predicted, confidence = model.predict(text)
+            if confidence >= args.threshold:
+                covered += 1
+                correct += predicted == label
+        print(f"阈值 {args.threshold}: 覆盖率 {covered / len(holdout):.2%}, "
+              f"准确率 {correct / covered if covered else 0.0:.2%}")
+
+    model.save(args.output)
+    print(f"模型已导出到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+对冲请求（hedged requests），降低上游偶发慢请求造成的长尾延迟
+
+在异步HTTP transport层实现：chat completions请求在自适应阈值内没有返回时，再发一个相同的请求
+（可以发往备用的OpenAI兼容服务），采用先返回的响应并取消另一个。非流式请求以完整响应为准，
+流式请求以第一个数据块（首token）为准，两个请求中只有采用的那个会继续读取，不会重复推送token。
+
+- 阈值: 按 (agent, 模型, 是否流式) 分别统计最近的耗时，取 SCIAGENT_HEDGE_QUANTILE 分位数（默认p95）；
+  agent由resilience.py的节点包装放在上下文变量中（路由器为"router"），同一模型下深度科研和聊天的耗时
+  相差很大，混在一起时慢的agent几乎每次都会对冲。样本不足时不对冲
+- 样本只来自原请求：对冲请求先返回时，原请求按已等待的时间记一个样本（实际耗时不小于此），
+  否则慢请求的样本被对冲请求的耗时取代，阈值越来越低
+- 预算: 每个请求积累 SCIAGENT_HEDGE_BUDGET 个对冲额度（默认0.05，即对冲请求最多约占5%），额度不足时不对冲
+- 只对异步调用生效；同步调用在线程中无法取消，不做对冲
+
+配置（环境变量）:
+- SCIAGENT_HEDGE: 设为1时启用
+- SCIAGENT_HEDGE_QUANTILE: 触发对冲的分位数，默认0.95
+- SCIAGENT_HEDGE_BUDGET: 对冲请求占总请求数的比例上限，默认0.05
+- SCIAGENT_HEDGE_MIN_SAMPLES: 开始对冲前需要的样本数，默认20
+- SCIAGENT_HEDGE_MIN_DELAY_MS: 阈值的下限（毫秒），默认50
+- SCIAGENT_HEDGE_BASE_URL: 对冲请求发往的备用服务地址，默认与原请求相同
+- SCIAGENT_HEDGE_API_KEY: 备用服务的API key，默认与原请求相同
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import httpx
+
+from resilience import current_caller
+
+logger = logging.getLogger(__name__)
+
+# (agent, 模型, 是否流式)
+Key = Tuple[Optional[str], str, bool]
+
+ENABLED = os.getenv("SCIAGENT_HEDGE", "0") == "1"
+QUANTILE = float(os.getenv("SCIAGENT_HEDGE_QUANTILE", "0.95"))
+BUDGET = float(os.getenv("SCIAGENT_HEDGE_BUDGET", "0.05"))
+MIN_SAMPLES = int(os.getenv("SCIAGENT_HEDGE_MIN_SAMPLES", "20"))
+MIN_DELAY = float(os.getenv("SCIAGENT_HEDGE_MIN_DELAY_MS", "50")) / 1000
+SECONDARY_BASE_URL = os.getenv("SCIAGENT_HEDGE_BASE_URL")
+SECONDARY_API_KEY = os.getenv("SCIAGENT_HEDGE_API_KEY")
+
+# 每个key保留的样本数，以及额度最多积累多少（避免长时间空闲后集中对冲）
+WINDOW = 500
+MAX_CREDITS = 10.0
+
+
+class LatencyWindow:
+    """最近WINDOW个样本的分位数"""
+
+    def __init__(self, size: int = WINDOW):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.samples) < MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+
+class _Prefetched(httpx.AsyncByteStream):
+    """已经读出第一个数据块的响应体"""
+
+    def __init__(self, first: Optional[bytes], iterator, stream: httpx.AsyncByteStream):
+        self._first = first
+        self._iterator = iterator
+        self._stream = stream
+
+    async def __aiter__(self):
+        if self._first is not None:
+            yield self._first
+        async for chunk in self._iterator:
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+class HedgingTransport(httpx.AsyncBaseTransport):
+    """包装另一个异步transport，对慢的chat completions请求发出对冲请求"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, primary_base_url: str,
+                 secondary_base_url: Optional[str] = SECONDARY_BASE_URL,
+                 secondary_api_key: Optional[str] = SECONDARY_API_KEY,
+                 quantile: float = QUANTILE, budget: float = BUDGET):
+        self._transport = transport
+        self.primary_base_url = primary_base_url.rstrip("/")
+        self.secondary_base_url = secondary_base_url.rstrip("/") if secondary_base_url else None
+        self.secondary_api_key = secondary_api_key
+        self.quantile = quantile
+        self.budget = budget
+        self._windows: Dict[Key, LatencyWindow] = {}
+        self._credits = 1.0
+        self.requests = 0
+        self.fired = 0
+        self.won = 0
+        self.budget_exhausted = 0
+        self.errors = 0
+
+    @staticmethod
+    def _key(request: httpx.Request) -> Optional[Key]:
+        if request.method != "POST" or not request.url.path.endswith("/chat/completions"):
+            return None
+        try:
+            body = json.loads(request.content)
+        except ValueError:
+            return None
+        return current_caller(), body.get("model", ""), bool(body.get("stream"))
+
+    def _window(self, key: Key) -> LatencyWindow:
+        window = self._windows.get(key)
+        if window is None:
+            window = self._windows[key] = LatencyWindow()
+        return window
+
+    def delay(self, key: Key) -> Optional[float]:
+        threshold = self._window(key).quantile(self.quantile)
+        return None if threshold is None else max(threshold, MIN_DELAY)
+
+    def _duplicate(self, request: httpx.Request) -> httpx.Request:
+        url = str(request.url)
+        if self.secondary_base_url and url.startswith(self.primary_base_url):
+            url = self.secondary_base_url + url[len(self.primary_base_url):]
+        headers = dict(request.headers)
+        headers.pop("host", None)
+        if self.secondary_api_key:
+            headers["authorization"] = f"Bearer {self.secondary_api_key}"
+        return httpx.Request(request.method, url, headers=headers, content=request.content,
+                             extensions=request.extensions)
+
+    async def _attempt(self, request: httpx.Request, key: Key, start: Optional[float] = None) -> httpx.Response:
+        """发出一次请求；start不为None时（原请求）完成后记录耗时"""
+        response = await self._transport.handle_async_request(request)
+        _, _, stream = key
+        if stream:
+            # 流式请求的响应头可能在生成之前就已返回，等到第一个数据块再算完成
+            iterator = response.stream.__aiter__()
+            try:
+                first = await iterator.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except BaseException:
+                await response.aclose()
+                raise
+            response.stream = _Prefetched(first, iterator, response.stream)
+        if start is not None:
+            self._window(key).add(time.perf_counter() - start)
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        key = self._key(request)
+        if key is None:
+            return await self._transport.handle_async_request(request)
+
+        self.requests += 1
+        self._credits = min(MAX_CREDITS, self._credits + self.budget)
+        delay = self.delay(key)
+        start = time.perf_counter()
+        primary = asyncio.create_task(self._attempt(request, key, start))
+        if delay is None:
+            return await primary
+
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        if done:
+            return primary.result()
+        if self._credits < 1:
+            self.budget_exhausted += 1
+            return await primary
+
+        self._credits -= 1
+        self.fired += 1
+        hedge = asyncio.create_task(self._attempt(self._duplicate(request), key))
+        logger.debug("%s 超过 %.0f ms 未返回，发出对冲请求", key, delay * 1000)
+        return await self._first(primary, hedge, key, start)
+
+    async def _first(self, primary: asyncio.Task, hedge: asyncio.Task, key: Key, start: float) -> httpx.Response:
+        """返回先成功的响应，取消另一个；两个都失败时抛出主请求的异常"""
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.won += 1
+                            if primary in pending:
+                                # 原请求被取消前已经等待的时间是其耗时的下限
+                                self._window(key).add(time.perf_counter() - start)
+                        for other in pending:
+                            other.cancel()
+                        # 两个请求同时完成时关闭没有采用的响应，释放连接
+                        for other in done - {task}:
+                            if other.exception() is None:
+                                await other.result().aclose()
+                        return task.result()
+                    self.errors += 1
+            raise primary.exception()
+        except asyncio.CancelledError:
+            for task in (primary, hedge):
+                task.cancel()
+            raise
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+    def stats(self) -> Dict[str, object]:
+        thresholds = {}
+        for (caller, model, stream), window in self._windows.items():
+            delay = self.delay((caller, model, stream))
+            name = f"{caller}/{model}" if caller else model
+            thresholds[f"{name}{' (stream)' if stream else ''}"] = {
+                "samples": len(window.samples),
+                "threshold_ms": round(delay * 1000, 1) if delay is not None else None,
+            }
+        return {
+            "quantile": self.quantile,
+            "budget": self.budget,
+            "secondary_base_url": self.secondary_base_url,
+            "requests": self.requests,
+            "hedges_fired": self.fired,
+            "hedges_won": self.won,
+            "hedge_rate": self.fired / self.requests if self.requests else 0.0,
+            "win_rate": self.won / self.fired if self.fired else 0.0,
+            "budget_exhausted": self.budget_exhausted,
+            "attempt_errors": self.errors,
+            "thresholds": thresholds,
+        }
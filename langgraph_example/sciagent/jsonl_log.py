@@ -0,0 +1,66 @@
+"""
+JSONL日志的后台写入
+
+路由日志（SCIAGENT_ROUTE_LOG）和规则日志（SCIAGENT_RULES_LOG）在路由节点中产生，
+调用方只把记录放进队列，由单个后台线程按顺序追加到文件，不在事件循环上等待磁盘。
+"""
+
+import atexit
+import json
+import logging
+import queue
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (文件路径, 一行JSON)
+_queue: "queue.Queue[Tuple[str, str]]" = queue.Queue()
+_thread: Optional[threading.Thread] = None
+_thread_lock = threading.Lock()
+
+
+def append(path: str, record: dict) -> None:
+    """把一条记录追加到JSONL文件，立即返回"""
+    _start()
+    _queue.put((path, json.dumps(record, ensure_ascii=False) + "\n"))
+
+
+def flush() -> None:
+    """等待队列中的记录全部写入（测试和退出时使用）"""
+    if _thread is not None:
+        _queue.join()
+
+
+def _start() -> None:
+    global _thread
+    if _thread is not None:
+        return
+    with _thread_lock:
+        if _thread is None:
+            _thread = threading.Thread(target=_run, name="jsonl-log", daemon=True)
+            _thread.start()
+            atexit.register(flush)
+
+
+def _run() -> None:
+    while True:
+        batch = [_queue.get()]
+        # 一次取出积压的记录，每个文件只打开一次
+        while True:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        lines: Dict[str, List[str]] = defaultdict(list)
+        for path, line in batch:
+            lines[path].append(line)
+        for path, chunk in lines.items():
+            try:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.writelines(chunk)
+            except OSError:
+                logger.exception("写入 %s 失败，丢弃 %d 条记录", path, len(chunk))
+        for _ in batch:
+            _queue.task_done()
@@ -0,0 +1,236 @@
+"""
+声明式关键词路由规则
+
+从JSON（或YAML）词典加载每个路由的关键词及权重，启动时编译成Aho-Corasick自动机，
+对输入做一次线性扫描即可得到各路由的加权得分。得分足够高且领先足够多时直接给出路由结果，跳过LLM路由器。
+
+规则命中、未命中以及与LLM决策的冲突都会记录下来，便于持续扩充词典。
+日志中只记录查询的长度和哈希，不记录原文；需要原文时设置 SCIAGENT_RULES_LOG 写入单独的文件。
+
+配置（环境变量）:
+- SCIAGENT_ROUTING_RULES: 词典文件路径，默认为本目录下的 routing_rules.json
+- SCIAGENT_RULES_SHADOW: 设为1时规则只记录不生效，所有决策仍由后续阶段给出，用于评估词典
+- SCIAGENT_RULES_LOG: 可选的JSONL文件路径，记录未命中和冲突的查询
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import jsonl_log
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RULES_PATH = Path(__file__).parent / "routing_rules.json"
+RULES_PATH = Path(os.getenv("SCIAGENT_ROUTING_RULES", DEFAULT_RULES_PATH))
+SHADOW = os.getenv("SCIAGENT_RULES_SHADOW", "0") == "1"
+RULES_LOG_PATH = os.getenv("SCIAGENT_RULES_LOG")
+
+
+class AhoCorasick:
+    """多模式字符串匹配自动机"""
+
+    def __init__(self, patterns: List[str]):
+        # 每个状态: 转移表、失败指针、在该状态结束的模式编号
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        self.patterns = patterns
+
+        for index, pattern in enumerate(patterns):
+            state = 0
+            for ch in pattern:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(index)
+
+        # 广度优先计算失败指针，并合并输出
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(ch, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def search(self, text: str) -> List[Tuple[int, int]]:
+        """返回所有匹配的 (模式编号, 结束位置)"""
+        matches = []
+        state = 0
+        for position, ch in enumerate(text):
+            while state and ch not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(ch, 0)
+            for index in self._output[state]:
+                matches.append((index, position))
+        return matches
+
+
+@dataclass
+class RuleMatch:
+    """一次规则匹配的结果"""
+    scores: Dict[str, float] = field(default_factory=dict)
+    terms: List[str] = field(default_factory=list)
+    route: Optional[str] = None  # 满足得分和领先幅度要求时才有值
+
+    @property
+    def best(self) -> Optional[str]:
+        """得分最高的路由，不论是否满足阈值"""
+        return max(self.scores, key=self.scores.get) if self.scores else None
+
+
+class KeywordRouter:
+    """基于加权关键词的路由规则"""
+
+    def __init__(self, routes: Dict[str, Dict[str, float]], min_score: float = 2.0, min_margin: float = 1.0):
+        self.min_score = min_score
+        self.min_margin = min_margin
+        self._terms: List[Tuple[str, str, float]] = []  # (关键词, 路由, 权重)
+        for route, terms in routes.items():
+            for term, weight in terms.items():
+                self._terms.append((term.casefold(), route, float(weight)))
+        self._automaton = AhoCorasick([term for term, _, _ in self._terms])
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.ambiguous = 0
+        self.agreements = 0
+        self.conflicts = 0
+
+    @classmethod
+    def load(cls, path) -> "KeywordRouter":
+        """从JSON或YAML文件加载词典"""
+        path = Path(path)
+        with open(path, "r", encoding="utf-8") as f:
+            if path.suffix in (".yaml", ".yml"):
+                try:
+                    import yaml
+                except ImportError:
+                    raise ImportError("使用YAML格式的路由规则需要安装pyyaml: pip install pyyaml")
+                config = yaml.safe_load(f)
+            else:
+                config = json.load(f)
+        return cls(
+            config["routes"],
+            min_score=config.get("min_score", 2.0),
+            min_margin=config.get("min_margin", 1.0),
+        )
+
+    def match(self, query: str) -> RuleMatch:
+        """对输入做一次扫描，计算各路由的得分；同一个关键词只计一次"""
+        text = query.casefold()
+        result = RuleMatch()
+        seen = set()
+        for index, end in self._automaton.search(text):
+            if index in seen:
+                continue
+            term, route, weight = self._terms[index]
+            if not _on_word_boundary(text, end - len(term) + 1, end):
+                continue
+            seen.add(index)
+            result.scores[route] = result.scores.get(route, 0.0) + weight
+            result.terms.append(term)
+
+        if result.scores:
+            ranked = sorted(result.scores.values(), reverse=True)
+            runner_up = ranked[1] if len(ranked) > 1 else 0.0
+            if ranked[0] >= self.min_score and ranked[0] - runner_up >= self.min_margin:
+                result.route = result.best
+        return result
+
+    def route(self, query: str) -> Optional[str]:
+        """规则足够确定时返回路由结果，否则返回None交给后续阶段"""
+        result = self.match(query)
+        with self._lock:
+            if result.route is not None:
+                self.hits += 1
+            elif result.scores:
+                self.ambiguous += 1
+            else:
+                self.misses += 1
+
+        if result.route is not None:
+            logger.debug("规则命中 %s: %s", result.route, result.terms)
+        elif result.scores:
+            logger.debug("规则不确定 %s: %s", result.scores, _describe(query))
+        else:
+            logger.debug("规则未命中: %s", _describe(query))
+            _log_rule_event("miss", query, result)
+        return None if SHADOW else result.route
+
+    def check(self, query: str, decision: str) -> None:
+        """与LLM的决策对比，记录一致和冲突的情况"""
+        result = self.match(query)
+        if result.best is None:
+            return
+        with self._lock:
+            if result.best == decision:
+                self.agreements += 1
+            else:
+                self.conflicts += 1
+        if result.best != decision:
+            logger.warning("规则与LLM决策冲突: 规则=%s %s, LLM=%s, 查询=%s",
+                           result.best, result.terms, decision, _describe(query))
+            _log_rule_event("conflict", query, result, decision)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses + self.ambiguous
+            return {
+                "shadow": SHADOW,
+                "terms": len(self._terms),
+                "hits": self.hits,
+                "misses": self.misses,
+                "ambiguous": self.ambiguous,
+                "agreements_with_llm": self.agreements,
+                "conflicts_with_llm": self.conflicts,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def _on_word_boundary(text: str, start: int, end: int) -> bool:
+    """英文关键词要求两侧不是字母数字，避免"GO"匹配到"good"；中文关键词不做限制"""
+    if not text[start:end + 1].isascii():
+        return True
+    before = text[start - 1] if start > 0 else " "
+    after = text[end + 1] if end + 1 < len(text) else " "
+    return not (before.isascii() and before.isalnum()) and not (after.isascii() and after.isalnum())
+
+
+def _describe(query: str) -> str:
+    """日志中代替查询原文：长度和SHA-256的前12位，相同的查询可以对应起来"""
+    digest = hashlib.sha256(query.encode("utf-8")).hexdigest()[:12]
+    return f"{len(query)}字符 sha256={digest}"
+
+
+def _log_rule_event(kind: str, query: str, result: RuleMatch, decision: Optional[str] = None) -> None:
+    if not RULES_LOG_PATH:
+        return
+    jsonl_log.append(RULES_LOG_PATH, {
+        "kind": kind,
+        "query": query,
+        "rule_scores": result.scores,
+        "rule_terms": result.terms,
+        "llm_decision": decision,
+        "ts": time.time(),
+    })
+
+
+# 启动时编译一次词典
+keyword_router: Optional[KeywordRouter] = KeywordRouter.load(RULES_PATH) if RULES_PATH.exists() else None
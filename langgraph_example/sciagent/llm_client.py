@@ -0,0 +1,596 @@
+"""
+共享的LLM客户端
+
+路由器、各个agent、摘要和embedding都通过这里创建模型，共用同一个带连接池的HTTP客户端（同步和异步各一个），
+避免每个模型各自维护一套默认配置的连接池。安装了h2时启用HTTP/2（仅对https生效），一个连接上可以复用多个请求。
+
+连接池的使用情况（进行中的请求数、峰值、打开和空闲的连接数、等待连接超时的次数）通过 stats() 查看，
+用于根据实际流量调整连接池大小。
+
+transport由内到外依次为: 连接池计数 -> 对冲请求（可选，见hedging.py，仅异步）-> 截止时间和重试 -> 取消统计（仅异步）。
+- 截止时间: 每次请求的超时限制在当前请求的剩余时间之内（截止时间由resilience.py的节点包装设置）
+- 重试: 连接失败、超时以及408/429/5xx响应按带随机抖动的指数退避重试（响应带Retry-After时按其等待），
+  剩余时间不够等待和再次请求时不再重试。重试发生在读取响应体之前，流式输出不会重复推送token，
+  OpenAI客户端自身的重试相应关闭
+- 取消统计: 客户端断开或超时导致异步调用被取消时，上游的HTTP请求（包括流式响应）随之关闭；
+  按该模型已完成请求的平均输出token数减去取消前已收到的token数估算节省的token
+
+配置（环境变量）:
+- BASE_URL: OpenAI兼容服务的地址，默认为OpenAI官方接口
+- SCIAGENT_HTTP_MAX_CONNECTIONS: 每个客户端最多的连接数，默认100
+- SCIAGENT_HTTP_MAX_KEEPALIVE: 最多保持的空闲连接数，默认20
+- SCIAGENT_HTTP_KEEPALIVE_EXPIRY: 空闲连接保持的秒数，默认30
+- SCIAGENT_HTTP_CONNECT_TIMEOUT: 建立连接的超时（秒），默认5
+- SCIAGENT_HTTP_READ_TIMEOUT: 读取响应的超时（秒），默认60
+- SCIAGENT_HTTP_POOL_TIMEOUT: 等待空闲连接的超时（秒），默认10
+- SCIAGENT_HTTP2: 设为0时不使用HTTP/2
+- SCIAGENT_LLM_MAX_RETRIES: 最多重试次数，默认2
+- SCIAGENT_RETRY_BACKOFF_MS: 第一次重试前的平均等待时间（毫秒），之后每次翻倍，默认250
+"""
+
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import threading
+import time
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import httpx
+
+from resilience import DeadlineExceeded, remaining
+
+MAX_CONNECTIONS = int(os.getenv("SCIAGENT_HTTP_MAX_CONNECTIONS", "100"))
+MAX_KEEPALIVE = int(os.getenv("SCIAGENT_HTTP_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY = float(os.getenv("SCIAGENT_HTTP_KEEPALIVE_EXPIRY", "30"))
+CONNECT_TIMEOUT = float(os.getenv("SCIAGENT_HTTP_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("SCIAGENT_HTTP_READ_TIMEOUT", "60"))
+POOL_TIMEOUT = float(os.getenv("SCIAGENT_HTTP_POOL_TIMEOUT", "10"))
+HTTP2 = os.getenv("SCIAGENT_HTTP2", "1") != "0" and importlib.util.find_spec("h2") is not None
+MAX_RETRIES = int(os.getenv("SCIAGENT_LLM_MAX_RETRIES", "2"))
+RETRY_BACKOFF = float(os.getenv("SCIAGENT_RETRY_BACKOFF_MS", "250")) / 1000
+MAX_BACKOFF = 4.0
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+LIMITS = httpx.Limits(
+    max_connections=MAX_CONNECTIONS,
+    max_keepalive_connections=MAX_KEEPALIVE,
+    keepalive_expiry=KEEPALIVE_EXPIRY,
+)
+TIMEOUT = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT, pool=POOL_TIMEOUT)
+
+
+class PoolStats:
+    """一个连接池的请求计数器（线程安全），请求从发出到响应体读完（或关闭）之间计为进行中"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.pool_timeouts = 0
+
+    def start(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if isinstance(error, httpx.PoolTimeout):
+                self.pool_timeouts += 1
+            elif isinstance(error, asyncio.CancelledError):
+                self.cancelled += 1
+            elif error is not None:
+                self.errors += 1
+
+    def snapshot(self, pool) -> Dict[str, float]:
+        connections = list(pool.connections)
+        idle = sum(1 for connection in connections if connection.is_idle())
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "errors": self.errors,
+                "cancelled": self.cancelled,
+                "pool_timeouts": self.pool_timeouts,
+                "connections": len(connections),
+                "idle_connections": idle,
+                # HTTP/1.1下每个连接同时只处理一个请求，接近1时说明连接池不够用
+                "utilization": self.in_flight / MAX_CONNECTIONS,
+                "peak_utilization": self.peak_in_flight / MAX_CONNECTIONS,
+            }
+
+
+class _Release:
+    """只执行一次的finish回调，响应体读完、关闭或出错时调用"""
+
+    def __init__(self, stats: PoolStats):
+        self._stats = stats
+        self._done = False
+
+    def __call__(self, error: Optional[BaseException] = None) -> None:
+        if not self._done:
+            self._done = True
+            self._stats.finish(error)
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    def __init__(self, stream, release: _Release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        try:
+            yield from self._stream
+        except BaseException as e:
+            self._release(e)
+            raise
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+
+class _AsyncTrackedStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release: _Release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        except BaseException as e:
+            self._release(e)
+            raise
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class CountingTransport(httpx.HTTPTransport):
+    """记录连接池使用情况的同步transport"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = PoolStats()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.start()
+        release = _Release(self.stats)
+        try:
+            response = super().handle_request(request)
+        except BaseException as e:
+            release(e)
+            raise
+        response.stream = _TrackedStream(response.stream, release)
+        return response
+
+    def snapshot(self) -> Dict[str, float]:
+        return self.stats.snapshot(self._pool)
+
+
+class AsyncCountingTransport(httpx.AsyncHTTPTransport):
+    """记录连接池使用情况的异步transport"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.stats = PoolStats()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.stats.start()
+        release = _Release(self.stats)
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException as e:
+            release(e)
+            raise
+        response.stream = _AsyncTrackedStream(response.stream, release)
+        return response
+
+    def snapshot(self) -> Dict[str, float]:
+        return self.stats.snapshot(self._pool)
+
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+
+
+# 超时异常对应的超时设置
+_TIMEOUT_KEYS = (
+    (httpx.ConnectTimeout, "connect"),
+    (httpx.ReadTimeout, "read"),
+    (httpx.WriteTimeout, "write"),
+    (httpx.PoolTimeout, "pool"),
+)
+
+
+def _clamp_timeout(request: httpx.Request, left: float) -> FrozenSet[str]:
+    """把超时限制在剩余时间之内，返回被缩短的超时（connect/read/write/pool）"""
+    timeout = request.extensions.get("timeout") or {}
+    request.extensions["timeout"] = {
+        key: left if timeout.get(key) is None else min(timeout[key], left)
+        for key in ("connect", "read", "write", "pool")
+    }
+    return frozenset(key for key in ("connect", "read", "write", "pool")
+                     if timeout.get(key) is None or timeout[key] > left)
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers["retry-after"])
+    except (KeyError, ValueError):
+        return None
+
+
+class RetryStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.gave_up = 0
+        self.deadline_exceeded = 0
+
+    def add(self, field: str) -> None:
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "max_retries": MAX_RETRIES,
+                "requests": self.requests,
+                "retries": self.retries,
+                "gave_up": self.gave_up,
+                "deadline_exceeded": self.deadline_exceeded,
+            }
+
+
+class _RetryPolicy:
+    """同步和异步transport共用的重试判断"""
+
+    def __init__(self, max_retries: int, backoff: float):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = RetryStats()
+
+    def prepare(self, request: httpx.Request) -> FrozenSet[str]:
+        """按剩余时间限制超时，返回被截止时间缩短的超时"""
+        left = remaining()
+        if left is None:
+            return frozenset()
+        if left <= 0:
+            self.stats.add("deadline_exceeded")
+            raise DeadlineExceeded("请求已超过截止时间")
+        return _clamp_timeout(request, left)
+
+    def timed_out(self, clamped: FrozenSet[str], error: httpx.TimeoutException) -> None:
+        """截止时间已过，或者触发的正是被截止时间缩短的那个超时时，说明是调用方自己的截止时间到了，
+        改为抛出DeadlineExceeded，不重试，熔断器也不把它计为上游故障。
+        其他超时（例如剩余时间还很充足时5秒的连接超时）是上游的问题，照常重试"""
+        left = remaining()
+        fired = next((key for error_type, key in _TIMEOUT_KEYS if isinstance(error, error_type)), None)
+        if (left is not None and left <= 0) or fired in clamped:
+            self.stats.add("deadline_exceeded")
+            raise DeadlineExceeded("请求已超过截止时间") from error
+
+    def wait(self, attempt: int, retry_after: Optional[float]) -> Optional[float]:
+        """第attempt次失败后的等待秒数，不应再重试时返回None"""
+        if attempt >= self.max_retries:
+            self.stats.add("gave_up")
+            return None
+        # full jitter: 在 [0, backoff * 2^attempt] 内均匀随机
+        delay = retry_after if retry_after is not None else random.uniform(
+            0, min(MAX_BACKOFF, self.backoff * 2 ** attempt)
+        )
+        left = remaining()
+        if left is not None and delay >= left:
+            self.stats.add("gave_up")
+            return None
+        self.stats.add("retries")
+        return delay
+
+
+class RetryTransport(httpx.BaseTransport):
+    """按截止时间限制超时并重试失败请求的同步transport"""
+
+    def __init__(self, transport: httpx.BaseTransport, max_retries: int = MAX_RETRIES, backoff: float = RETRY_BACKOFF):
+        self._transport = transport
+        self.policy = _RetryPolicy(max_retries, backoff)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        self.policy.stats.add("requests")
+        attempt = 0
+        while True:
+            clamped = self.policy.prepare(request)
+            try:
+                response = self._transport.handle_request(request)
+            except httpx.TimeoutException as e:
+                self.policy.timed_out(clamped, e)
+                delay = self.policy.wait(attempt, None)
+                if delay is None:
+                    raise
+            except httpx.TransportError:
+                delay = self.policy.wait(attempt, None)
+                if delay is None:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                delay = self.policy.wait(attempt, _retry_after(response))
+                if delay is None:
+                    return response
+                response.close()
+            attempt += 1
+            time.sleep(delay)
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncRetryTransport(httpx.AsyncBaseTransport):
+    """RetryTransport的异步版本"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, max_retries: int = MAX_RETRIES,
+                 backoff: float = RETRY_BACKOFF):
+        self._transport = transport
+        self.policy = _RetryPolicy(max_retries, backoff)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.policy.stats.add("requests")
+        attempt = 0
+        while True:
+            clamped = self.policy.prepare(request)
+            try:
+                response = await self._transport.handle_async_request(request)
+            except httpx.TimeoutException as e:
+                self.policy.timed_out(clamped, e)
+                delay = self.policy.wait(attempt, None)
+                if delay is None:
+                    raise
+            except httpx.TransportError:
+                delay = self.policy.wait(attempt, None)
+                if delay is None:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES:
+                    return response
+                delay = self.policy.wait(attempt, _retry_after(response))
+                if delay is None:
+                    return response
+                await response.aclose()
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def _chat_request(request: httpx.Request) -> Optional[Tuple[str, bool]]:
+    """chat completions请求的 (模型, 是否流式)，其他请求为None"""
+    if request.method != "POST" or not request.url.path.endswith("/chat/completions"):
+        return None
+    try:
+        body = json.loads(request.content)
+    except ValueError:
+        return None
+    return body.get("model", ""), bool(body.get("stream"))
+
+
+class CancellationStats:
+    """被取消的chat completions请求数和估算节省的输出token数（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # 模型 -> [已完成的请求数, 输出token总数]
+        self._completed: Dict[str, List[int]] = {}
+        self.cancelled = 0
+        self.tokens_received = 0
+        self.tokens_saved = 0.0
+
+    def complete(self, model: str, tokens: int) -> None:
+        with self._lock:
+            totals = self._completed.setdefault(model, [0, 0])
+            totals[0] += 1
+            totals[1] += tokens
+
+    def cancel(self, model: str, received: int) -> None:
+        with self._lock:
+            requests, tokens = self._completed.get(model, (0, 0))
+            self.cancelled += 1
+            self.tokens_received += received
+            # 还没有完成过的请求时无法估计，不计入
+            if requests:
+                self.tokens_saved += max(0.0, tokens / requests - received)
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "cancelled": self.cancelled,
+                "tokens_received_before_cancel": self.tokens_received,
+                "estimated_tokens_saved": round(self.tokens_saved),
+                "avg_output_tokens": {
+                    model: round(tokens / requests, 1) for model, (requests, tokens) in self._completed.items()
+                },
+            }
+
+
+class _MeteredStream(httpx.AsyncByteStream):
+    """统计响应的输出token：流式响应按数据块计，非流式响应读取usage"""
+
+    def __init__(self, stream, stats: CancellationStats, model: str, streaming: bool):
+        self._stream = stream
+        self._stats = stats
+        self._model = model
+        self._body: Optional[List[bytes]] = None if streaming else []
+        self._tokens = 0
+        self._settled = False
+
+    def _complete(self) -> None:
+        self._settled = True
+        tokens = self._tokens
+        if self._body is not None:
+            try:
+                tokens = json.loads(b"".join(self._body))["usage"]["completion_tokens"]
+            except (ValueError, KeyError, TypeError):
+                return
+        self._stats.complete(self._model, tokens)
+
+    def _cancel(self) -> None:
+        if not self._settled:
+            self._settled = True
+            self._stats.cancel(self._model, self._tokens)
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                if self._body is None:
+                    self._tokens += chunk.count(b"data: {")
+                else:
+                    self._body.append(chunk)
+                yield chunk
+        except asyncio.CancelledError:
+            self._cancel()
+            raise
+        except Exception:
+            self._settled = True
+            raise
+        self._complete()
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            # 没有读完就关闭（读取响应的任务被取消）
+            self._cancel()
+
+
+class AsyncCancellationTransport(httpx.AsyncBaseTransport):
+    """记录被取消的chat completions请求；同步调用在线程中无法取消，不需要统计"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+        self.stats = CancellationStats()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        chat = _chat_request(request)
+        if chat is None:
+            return await self._transport.handle_async_request(request)
+        model, streaming = chat
+        try:
+            response = await self._transport.handle_async_request(request)
+        except asyncio.CancelledError:
+            self.stats.cancel(model, 0)
+            raise
+        response.stream = _MeteredStream(response.stream, self.stats, model, streaming)
+        return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+_http_client: Optional[httpx.Client] = None
+_http_async_client: Optional[httpx.AsyncClient] = None
+# 各层transport，用于统计
+_sync_pool: Optional[CountingTransport] = None
+_async_pool: Optional[AsyncCountingTransport] = None
+_sync_retry: Optional[RetryTransport] = None
+_async_retry: Optional[AsyncRetryTransport] = None
+_cancellation: Optional[AsyncCancellationTransport] = None
+_hedging = None
+_client_lock = threading.Lock()
+
+
+def http_client() -> httpx.Client:
+    """进程内共享的同步HTTP客户端"""
+    global _http_client, _sync_pool, _sync_retry
+    if _http_client is None:
+        with _client_lock:
+            if _http_client is None:
+                _sync_pool = CountingTransport(limits=LIMITS, http2=HTTP2)
+                _sync_retry = RetryTransport(_sync_pool)
+                _http_client = httpx.Client(transport=_sync_retry, timeout=TIMEOUT)
+    return _http_client
+
+
+def http_async_client() -> httpx.AsyncClient:
+    """进程内共享的异步HTTP客户端，连接绑定在第一次使用它的事件循环上"""
+    global _http_async_client, _async_pool, _async_retry, _hedging, _cancellation
+    if _http_async_client is None:
+        with _client_lock:
+            if _http_async_client is None:
+                import hedging
+                _async_pool = transport = AsyncCountingTransport(limits=LIMITS, http2=HTTP2)
+                if hedging.ENABLED:
+                    _hedging = transport = hedging.HedgingTransport(
+                        transport, os.getenv("BASE_URL") or DEFAULT_BASE_URL
+                    )
+                _async_retry = AsyncRetryTransport(transport)
+                _cancellation = AsyncCancellationTransport(_async_retry)
+                _http_async_client = httpx.AsyncClient(transport=_cancellation, timeout=TIMEOUT)
+    return _http_async_client
+
+
+def _client_kwargs() -> dict:
+    return {
+        "base_url": os.getenv("BASE_URL"),
+        "timeout": TIMEOUT,
+        "max_retries": 0,
+        "http_client": http_client(),
+        "http_async_client": http_async_client(),
+    }
+
+
+def chat_model(model: str = "gpt-4o", **kwargs):
+    """创建使用共享连接池的ChatOpenAI，其余参数原样传给ChatOpenAI"""
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=model, **{**_client_kwargs(), **kwargs})
+
+
+def embeddings_model(model: str, **kwargs):
+    """创建使用共享连接池的OpenAIEmbeddings"""
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(model=model, **{**_client_kwargs(), **kwargs})
+
+
+def stats() -> Dict[str, object]:
+    """连接池配置和使用情况，客户端尚未创建时对应的值为None"""
+    return {
+        "http2": HTTP2,
+        "max_connections": MAX_CONNECTIONS,
+        "max_keepalive_connections": MAX_KEEPALIVE,
+        "keepalive_expiry": KEEPALIVE_EXPIRY,
+        "sync": _sync_pool.snapshot() if _sync_pool is not None else None,
+        "async": _async_pool.snapshot() if _async_pool is not None else None,
+        "hedging": _hedging.stats() if _hedging is not None else None,
+        "retries": {
+            "sync": _sync_retry.policy.stats.snapshot() if _sync_retry is not None else None,
+            "async": _async_retry.policy.stats.snapshot() if _async_retry is not None else None,
+        },
+        "cancellation": _cancellation.stats.snapshot() if _cancellation is not None else None,
+    }
+
+
+async def aclose() -> None:
+    """关闭共享的HTTP客户端（服务关闭时调用）"""
+    global _http_client, _http_async_client, _sync_pool, _async_pool, _sync_retry, _async_retry, _hedging, \
+        _cancellation
+    with _client_lock:
+        client, async_client = _http_client, _http_async_client
+        _http_client = _http_async_client = _sync_pool = _async_pool = _sync_retry = _async_retry = _hedging = None
+        _cancellation = None
+    if client is not None:
+        client.close()
+    if async_client is not None:
+        await async_client.aclose()
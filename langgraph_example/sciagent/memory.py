@@ -0,0 +1,197 @@
+"""
+按用户保存的多轮对话记忆
+
+- 以user_id作为LangGraph检查点的thread_id，每个用户的历史和摘要保存在检查点中
+- 最近 SCIAGENT_MEMORY_TURNS 轮对话原样保留，更早的轮次增量合并进摘要。摘要在回答发送之后由后台任务生成
+  （持有该用户的锁，见schedule_compaction），不增加本轮的延迟；摘要完成之前超出的轮次仍在历史中，受token上限约束
+- 构建提示时历史部分（摘要+最近的轮次）不超过 SCIAGENT_MEMORY_MAX_TOKENS 个token，超出时从最早的轮次开始省略
+- 每轮对话记录输入、历史和输出的token数
+
+检查点保存在进程内存中，每个用户只保留最近的几个检查点，长时间不活跃的用户按LRU淘汰（见checkpointer.py）。
+
+配置（环境变量）:
+- SCIAGENT_MEMORY: 设为0时忽略user_id，所有请求都不使用对话记忆
+- SCIAGENT_MEMORY_TURNS: 原样保留的轮数，默认6
+- SCIAGENT_MEMORY_MAX_TOKENS: 提示中历史部分的token上限，默认3000
+- SCIAGENT_MEMORY_MAX_USERS: 内存中最多保存的用户数，默认10000
+- SCIAGENT_SUMMARY_MODEL: 生成摘要使用的模型，默认gpt-4o-mini
+"""
+
+import asyncio
+import logging
+import os
+import time
+import weakref
+from typing import List
+
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from tokens import MESSAGE_OVERHEAD, count_message_tokens, count_tokens
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("SCIAGENT_MEMORY", "1") != "0"
+MAX_TURNS = int(os.getenv("SCIAGENT_MEMORY_TURNS", "6"))
+MAX_HISTORY_TOKENS = int(os.getenv("SCIAGENT_MEMORY_MAX_TOKENS", "3000"))
+MAX_USERS = int(os.getenv("SCIAGENT_MEMORY_MAX_USERS", "10000"))
+SUMMARY_MODEL = os.getenv("SCIAGENT_SUMMARY_MODEL", "gpt-4o-mini")
+
+SUMMARY_PROMPT = """你负责维护一段对话的摘要。根据已有的摘要和新的对话内容，输出更新后的摘要。
+保留用户的研究背景、数据情况、已经给出的结论和尚未解决的问题，省略寒暄，不超过300字。"""
+
+
+def create_checkpointer():
+    """按user_id保存检查点的checkpointer，构建带记忆的工作流时才导入langgraph"""
+    from checkpointer import BoundedMemorySaver
+
+    return BoundedMemorySaver()
+
+
+def thread_config(user_id: str) -> dict:
+    return {"configurable": {"thread_id": user_id}}
+
+
+def new_turn(inputs: dict) -> dict:
+    """检查点会保留上一轮的状态，开始新的一轮时清空只属于单轮的字段"""
+    return {
+        **inputs,
+        "decisions": [],
+        "partial_outputs": None,
+        "speculation_id": None,
+        "usage": None,
+        "turn_tokens": None,
+        "long_input": None,
+    }
+
+
+_user_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def user_lock(user_id: str) -> asyncio.Lock:
+    """同一用户的请求依次执行，避免并发的两轮对话读到同一个历史、互相覆盖"""
+    lock = _user_locks.get(user_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _user_locks[user_id] = lock
+    return lock
+
+
+def history_messages(state: dict, max_tokens: int = MAX_HISTORY_TOKENS) -> List:
+    """把摘要和最近的轮次转换为消息，总token数不超过max_tokens，优先保留最近的轮次"""
+    messages = []
+    budget = max_tokens
+    summary = state.get("summary")
+    if summary:
+        summary_message = SystemMessage(content=f"此前对话的摘要：{summary}")
+        budget -= count_message_tokens([summary_message])
+        messages.append(summary_message)
+
+    turns = []
+    for turn in reversed(state.get("history") or []):
+        pair = [HumanMessage(content=turn["user"]), AIMessage(content=turn["assistant"])]
+        cost = turn["tokens"]["turn"]
+        if cost > budget:
+            break
+        budget -= cost
+        turns.append(pair)
+    for pair in reversed(turns):
+        messages.extend(pair)
+    return messages
+
+
+# 生成摘要的LLM，第一次使用时创建；测试时可以直接赋值替换
+summary_llm = None
+
+
+def get_summary_llm():
+    global summary_llm
+    if summary_llm is None:
+        from langgraph.constants import TAG_NOSTREAM
+        from llm_client import chat_model
+        summary_llm = chat_model(SUMMARY_MODEL).with_config(tags=[TAG_NOSTREAM])
+    return summary_llm
+
+
+def _summary_messages(summary: str, turns: List[dict]) -> List:
+    dialogue = "\n".join(f"用户：{turn['user']}\n助手：{turn['assistant']}" for turn in turns)
+    return [
+        SystemMessage(content=SUMMARY_PROMPT),
+        HumanMessage(content=f"已有的摘要：{summary or '（无）'}\n\n新的对话：\n{dialogue}"),
+    ]
+
+
+def _record_turn(state: dict) -> dict:
+    """本轮对话的记录"""
+    usage = state.get("usage") or {}
+    history_tokens = count_message_tokens(history_messages(state))
+    input_tokens = count_tokens(state["input"])
+    output_tokens = count_tokens(state["output"])
+    turn = {
+        "user": state["input"],
+        "assistant": state["output"],
+        "agents": state.get("decisions") or [state.get("decision")],
+        "ts": time.time(),
+        "tokens": {
+            "input": input_tokens,
+            "history": history_tokens,
+            "output": output_tokens,
+            # 这一轮在之后的提示中占用的token数
+            "turn": input_tokens + output_tokens + 2 * MESSAGE_OVERHEAD,
+            # 上游返回的实际用量（缓存命中或多agent模式时没有）
+            "prompt_reported": usage.get("input_tokens"),
+            "completion_reported": usage.get("output_tokens"),
+        },
+    }
+    return turn
+
+
+def update_memory(state: dict, config=None) -> dict:
+    """把本轮对话加入历史；不调用LLM，超出保留轮数的部分由schedule_compaction在后台合并进摘要"""
+    turn = _record_turn(state)
+    history = list(state.get("history") or []) + [turn]
+    logger.debug("对话记忆: %s", turn["tokens"])
+    # 摘要一直失败时最多保留两倍的轮数
+    return {"history": history[-2 * MAX_TURNS:], "turn_tokens": turn["tokens"]}
+
+
+async def aupdate_memory(state: dict, config=None) -> dict:
+    return update_memory(state)
+
+
+def needs_compaction(history) -> bool:
+    return len(history or []) > MAX_TURNS
+
+
+async def compact(workflow, user_id: str) -> None:
+    """把超出保留轮数的历史合并进摘要，持有该用户的锁，读取和写回的都是最新的检查点"""
+    async with user_lock(user_id):
+        config = thread_config(user_id)
+        values = (await workflow.aget_state(config)).values
+        history = values.get("history") or []
+        if not needs_compaction(history):
+            return
+        overflow, recent = history[:-MAX_TURNS], history[-MAX_TURNS:]
+        start = time.perf_counter()
+        result = await get_summary_llm().ainvoke(_summary_messages(values.get("summary") or "", overflow))
+        await workflow.aupdate_state(config, {"history": recent, "summary": result.content}, as_node="update_memory")
+        logger.debug("用户 %s 的 %d 轮对话已合并进摘要，耗时 %.0f ms", user_id, len(overflow),
+                     (time.perf_counter() - start) * 1000)
+
+
+_compactions: set = set()
+
+
+def schedule_compaction(workflow, user_id: str, history) -> None:
+    """本轮结束后历史超出保留轮数时，在后台生成摘要；必须在释放该用户的锁之后调用"""
+    if not needs_compaction(history):
+        return
+
+    def done(task: asyncio.Task) -> None:
+        _compactions.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            # 下一轮结束后会重新尝试
+            logger.warning("生成对话摘要失败: %s", task.exception())
+
+    task = asyncio.get_running_loop().create_task(compact(workflow, user_id))
+    _compactions.add(task)
+    task.add_done_callback(done)
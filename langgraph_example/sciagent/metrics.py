@@ -0,0 +1,185 @@
+"""
+Prometheus指标，由 /metrics 接口导出
+
+- sciagent_request_duration_seconds: 查询接口端到端耗时（含排队），按接口
+- sciagent_requests_in_flight: 正在处理的查询请求数，按接口
+- sciagent_node_duration_seconds: 图中各节点（路由器、六个agent、多agent调用）的耗时
+- sciagent_nodes_in_flight: 正在执行的节点数
+- sciagent_route_total: 路由结果分布（包括缓存、快速路由和直接指定agent的请求）
+- sciagent_tokens_total: 各agent的输入和输出token数（缓存命中的回答没有用量，路由器的用量不统计）
+- sciagent_errors_total: 返回给客户端的错误，按类型
+- 准入控制和LLM连接池的当前状态（抓取时读取，不增加请求的开销）
+
+所有带标签的子指标在导入时创建，请求处理时只做字典查找和计数，不创建指标对象。
+没有安装prometheus_client（pip install prometheus-client）或者 SCIAGENT_METRICS=0 时，所有记录函数都不做任何事，
+/metrics 返回501。
+"""
+
+import asyncio
+import importlib.util
+import os
+import sys
+import time
+from typing import Iterable, Optional
+
+from langchain_core.runnables import RunnableLambda
+
+ENABLED = os.getenv("SCIAGENT_METRICS", "1") != "0" and importlib.util.find_spec("prometheus_client") is not None
+
+ENDPOINTS = {"/api/query": "query", "/api/query/stream": "stream", "/api/query/batch": "batch"}
+ROUTES = ("chat", "bioinformatics", "bioinfo_interpret", "literature", "research_image", "deep_research")
+NODES = ("llm_call_router", *(f"{route}_agent" for route in ROUTES), "fanout_agent")
+ERROR_TYPES = ("overloaded", "deadline_exceeded", "circuit_open", "client_disconnect", "upstream", "internal")
+
+# LLM调用从几十毫秒到几十秒不等
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+if ENABLED:
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Gauge, Histogram, generate_latest
+    from prometheus_client.core import GaugeMetricFamily
+
+    _request_duration = Histogram("sciagent_request_duration_seconds", "查询接口的端到端耗时", ["endpoint"],
+                                  buckets=BUCKETS)
+    _requests_in_flight = Gauge("sciagent_requests_in_flight", "正在处理的查询请求数", ["endpoint"])
+    _node_duration = Histogram("sciagent_node_duration_seconds", "图中各节点的耗时", ["node"], buckets=BUCKETS)
+    _nodes_in_flight = Gauge("sciagent_nodes_in_flight", "正在执行的节点数", ["node"])
+    _routes = Counter("sciagent_route_total", "路由结果", ["route"])
+    _tokens = Counter("sciagent_tokens_total", "各agent使用的token数", ["agent", "kind"])
+    _errors = Counter("sciagent_errors_total", "返回给客户端的错误", ["type"])
+
+    REQUEST_DURATION = {name: _request_duration.labels(name) for name in ENDPOINTS.values()}
+    REQUESTS_IN_FLIGHT = {name: _requests_in_flight.labels(name) for name in ENDPOINTS.values()}
+    NODE_DURATION = {node: _node_duration.labels(node) for node in NODES}
+    NODES_IN_FLIGHT = {node: _nodes_in_flight.labels(node) for node in NODES}
+    ROUTE_COUNT = {route: _routes.labels(route) for route in ROUTES}
+    PROMPT_TOKENS = {route: _tokens.labels(route, "prompt") for route in ROUTES}
+    COMPLETION_TOKENS = {route: _tokens.labels(route, "completion") for route in ROUTES}
+    ERRORS = {kind: _errors.labels(kind) for kind in ERROR_TYPES}
+
+    class _StateCollector:
+        """抓取时读取准入控制和LLM连接池的状态"""
+
+        def collect(self):
+            from admission import admission
+            stats = admission.stats()
+            for name, key, doc in (
+                ("sciagent_admission_in_flight", "in_flight", "已准入、正在处理的请求数"),
+                ("sciagent_admission_queue_depth", "queue_depth", "等待准入的请求数"),
+                ("sciagent_admission_limit", "limit", "当前的并发上限"),
+            ):
+                yield GaugeMetricFamily(name, doc, value=stats[key])
+            # llm_client在第一次调用LLM时才导入
+            llm_client = sys.modules.get("llm_client")
+            pool = llm_client.stats() if llm_client is not None else {}
+            in_flight = GaugeMetricFamily("sciagent_llm_requests_in_flight", "进行中的LLM HTTP请求数",
+                                          labels=["client"])
+            for client in ("sync", "async"):
+                if pool.get(client) is not None:
+                    in_flight.add_metric([client], pool[client]["in_flight"])
+            yield in_flight
+
+    REGISTRY.register(_StateCollector())
+
+
+def error_type(error: BaseException) -> str:
+    """错误对应的类型标签"""
+    from admission import Overloaded
+    from resilience import CircuitOpen, DeadlineExceeded
+    if isinstance(error, Overloaded):
+        return "overloaded"
+    if isinstance(error, DeadlineExceeded):
+        return "deadline_exceeded"
+    if isinstance(error, CircuitOpen):
+        return "circuit_open"
+    if isinstance(error, (asyncio.CancelledError, ConnectionAbortedError)):
+        return "client_disconnect"
+    if type(error).__module__.split(".")[0] in ("openai", "httpx", "httpcore"):
+        return "upstream"
+    return "internal"
+
+
+def record_error(error: BaseException) -> None:
+    if ENABLED:
+        ERRORS[error_type(error)].inc()
+
+
+def record_routes(decisions: Iterable[str]) -> None:
+    if ENABLED:
+        for decision in decisions:
+            counter = ROUTE_COUNT.get(decision)
+            if counter is not None:
+                counter.inc()
+
+
+def record_usage(agent: str, usage: Optional[dict]) -> None:
+    if ENABLED and usage and agent in PROMPT_TOKENS:
+        PROMPT_TOKENS[agent].inc(usage.get("input_tokens", 0))
+        COMPLETION_TOKENS[agent].inc(usage.get("output_tokens", 0))
+
+
+def instrument(node: str, runnable: RunnableLambda, agent: Optional[str] = None) -> RunnableLambda:
+    """记录节点的耗时和进行中的数量；agent不为None时同时记录返回结果中的token用量
+
+    直接包装RunnableLambda的同步和异步函数，不额外增加一层Runnable（每层在每次调用时都有回调和配置的开销）
+    """
+    if not ENABLED:
+        return runnable
+    func, afunc = runnable.func, runnable.afunc
+    duration = NODE_DURATION[node]
+    in_flight = NODES_IN_FLIGHT[node]
+
+    def finish(start: float, result) -> None:
+        in_flight.dec()
+        duration.observe(time.perf_counter() - start)
+        if agent is not None and isinstance(result, dict):
+            record_usage(agent, result.get("usage"))
+
+    def run(state: dict, config=None):
+        start = time.perf_counter()
+        in_flight.inc()
+        result = None
+        try:
+            result = func(state, config)
+            return result
+        finally:
+            finish(start, result)
+
+    async def arun(state: dict, config=None):
+        start = time.perf_counter()
+        in_flight.inc()
+        result = None
+        try:
+            result = await afunc(state, config)
+            return result
+        finally:
+            finish(start, result)
+
+    return RunnableLambda(run, afunc=arun, name=runnable.name)
+
+
+class MetricsMiddleware:
+    """记录查询接口的端到端耗时（流式接口到最后一个事件发送完）和进行中的请求数
+
+    纯ASGI中间件，不包装receive，不影响接口检测客户端断开
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        endpoint = ENDPOINTS.get(scope["path"]) if scope["type"] == "http" else None
+        if endpoint is None:
+            return await self.app(scope, receive, send)
+        in_flight = REQUESTS_IN_FLIGHT[endpoint]
+        start = time.perf_counter()
+        in_flight.inc()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            in_flight.dec()
+            REQUEST_DURATION[endpoint].observe(time.perf_counter() - start)
+
+
+def render():
+    """返回 (指标文本, Content-Type)"""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
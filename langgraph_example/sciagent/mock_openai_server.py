@@ -0,0 +1,417 @@
+"""
+本地的OpenAI兼容模拟服务，用于离线压测
+
+实现 /v1/chat/completions（含流式输出、工具调用和 response_format=json_schema 的结构化输出）、
+/v1/embeddings 和 /v1/models，不消耗真实的token。把 BASE_URL 指向本服务后，sciagent的路由器、
+各个agent以及 mcp_0408/mcp_client 下的MCP客户端都会改为请求本服务:
+
+    python mock_openai_server.py --port 8100 --latency lognormal:0.4,0.5 --token-rate 60 --error-rate 0.01
+    export BASE_URL=http://localhost:8100/v1 OPENAI_API_KEY=sk-mock
+
+可配置项:
+- --latency: 首token延迟的分布，格式同 fake_llm.latency_distribution
+- --token-rate: 每秒输出的token数，0表示不限速
+- --error-rate / --error-status: 按概率返回错误（429会带Retry-After）
+- --script: 脚本化回答的JSON文件，按顺序用正则匹配最后一条消息，例如:
+    [{"match": "天气", "tool_call": {"name": "query_weather", "arguments": {"city": "Beijing"}}},
+     {"match": "DESeq2", "json": {"step": "bioinformatics"}},
+     {"match": "超时", "error": 503},
+     {"match": ".*", "content": "固定的回答"}]
+
+运行期间可以通过 GET /mock/stats 查看请求统计，通过 POST /mock/config 修改延迟、错误率等配置。
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import re
+import struct
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from fake_llm import latency_distribution
+
+DEFAULT_RESPONSE = "这是本地模拟服务返回的回答，用于压力测试，不代表真实模型的输出。"
+
+# 粗略的分词: 连续的英文/数字算一个token，其余每个字符算一个token
+_TOKEN = re.compile(r"[A-Za-z0-9_]+|\s+|.", re.S)
+
+
+@dataclass
+class MockConfig:
+    """模拟服务的配置"""
+    latency: str = "const:0.2"
+    token_rate: float = 50.0
+    error_rate: float = 0.0
+    error_status: List[int] = field(default_factory=lambda: [429, 500, 503])
+    response: str = DEFAULT_RESPONSE
+    script: List[Dict[str, Any]] = field(default_factory=list)
+    # 请求带tools且未指定tool_choice时是否调用工具
+    tool_calls: bool = True
+    embedding_dim: int = 1536
+    seed: Optional[int] = None
+
+
+class MockStats:
+    """请求计数"""
+
+    def __init__(self):
+        self.requests = 0
+        self.streamed = 0
+        self.errors = 0
+        self.tool_calls = 0
+        self.structured = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return dict(vars(self))
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text or "")
+
+
+def message_text(message: dict) -> str:
+    """消息内容可能是字符串或多段内容的列表"""
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def _stable_index(key: str, n: int) -> int:
+    """同样的输入总是得到同样的选择，便于复现"""
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest(), 16) % n
+
+
+def sample_from_schema(schema: dict, key: str, defs: Optional[dict] = None) -> Any:
+    """按JSON Schema生成一个符合要求的值，枚举值根据输入的哈希选择"""
+    defs = defs if defs is not None else schema.get("$defs", schema.get("definitions", {}))
+    if "$ref" in schema:
+        return sample_from_schema(defs[schema["$ref"].split("/")[-1]], key, defs)
+    for combinator in ("anyOf", "oneOf", "allOf"):
+        if combinator in schema:
+            options = [option for option in schema[combinator] if option.get("type") != "null"]
+            return sample_from_schema(options[0], key, defs) if options else None
+    if "const" in schema:
+        return schema["const"]
+    if "enum" in schema:
+        return schema["enum"][_stable_index(key, len(schema["enum"]))]
+
+    kind = schema.get("type", "object" if "properties" in schema else "string")
+    if isinstance(kind, list):
+        kind = next((item for item in kind if item != "null"), "string")
+    if kind == "object":
+        return {
+            name: sample_from_schema(prop, f"{key}.{name}", defs)
+            for name, prop in schema.get("properties", {}).items()
+        }
+    if kind == "array":
+        return [sample_from_schema(schema.get("items", {}), key, defs)]
+    return {"integer": 1, "number": 1.0, "boolean": True, "null": None}.get(kind, "mock")
+
+
+class MockOpenAI:
+    """根据请求和配置决定回答内容，并负责延迟和错误注入"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.stats = MockStats()
+        self._rng = random.Random(config.seed)
+        self._latency = latency_distribution(config.latency, config.seed)
+
+    def update(self, changes: Dict[str, Any]) -> None:
+        for name, value in changes.items():
+            if hasattr(self.config, name):
+                setattr(self.config, name, value)
+        if "latency" in changes:
+            self._latency = latency_distribution(self.config.latency, self.config.seed)
+
+    def match_script(self, text: str) -> dict:
+        for rule in self.config.script:
+            if re.search(rule.get("match", ".*"), text):
+                return rule
+        return {}
+
+    def injected_error(self, rule: dict) -> Optional[JSONResponse]:
+        status = rule.get("error")
+        if status is None and self._rng.random() < self.config.error_rate:
+            status = self._rng.choice(self.config.error_status)
+        if status is None:
+            return None
+        self.stats.errors += 1
+        headers = {"retry-after": "1"} if status == 429 else None
+        return JSONResponse(
+            status_code=status,
+            headers=headers,
+            content={"error": {"message": f"模拟错误 {status}", "type": "mock_error", "code": status}},
+        )
+
+    def plan(self, body: dict, rule: dict) -> dict:
+        """返回 {"content": ...} 或 {"tool_call": {"name", "arguments"}}"""
+        messages = body.get("messages", [])
+        last = messages[-1] if messages else {}
+        text = message_text(last)
+
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            self.stats.structured += 1
+            schema = response_format.get("json_schema", {}).get("schema", {})
+            value = rule["json"] if "json" in rule else sample_from_schema(schema, text)
+            return {"content": json.dumps(value, ensure_ascii=False)}
+        if response_format.get("type") == "json_object":
+            self.stats.structured += 1
+            return {"content": json.dumps(rule.get("json", {"response": self.config.response}), ensure_ascii=False)}
+
+        tools = body.get("tools") or []
+        tool_choice = body.get("tool_choice", "auto")
+        # 工具结果返回之后给出文字回答，避免客户端无限循环调用
+        if tools and tool_choice != "none" and last.get("role") != "tool":
+            if "tool_call" in rule:
+                return {"tool_call": rule["tool_call"]}
+            forced = tool_choice.get("function", {}).get("name") if isinstance(tool_choice, dict) else None
+            if forced or tool_choice == "required" or self.config.tool_calls:
+                function = next(
+                    (tool["function"] for tool in tools if tool["function"]["name"] == forced),
+                    tools[0]["function"],
+                )
+                arguments = sample_from_schema(function.get("parameters", {}), text)
+                return {"tool_call": {"name": function["name"], "arguments": arguments}}
+
+        return {"content": rule.get("content", self.config.response)}
+
+    def ttft(self) -> float:
+        return self._latency()
+
+    def generation_time(self, n_tokens: int) -> float:
+        return n_tokens / self.config.token_rate if self.config.token_rate > 0 else 0.0
+
+
+def _completion_id() -> str:
+    return f"chatcmpl-mock-{uuid.uuid4().hex[:24]}"
+
+
+def _tool_call_payload(plan: dict) -> dict:
+    call = plan["tool_call"]
+    arguments = call.get("arguments", {})
+    return {
+        "id": f"call_{uuid.uuid4().hex[:24]}",
+        "type": "function",
+        "function": {
+            "name": call["name"],
+            "arguments": arguments if isinstance(arguments, str) else json.dumps(arguments, ensure_ascii=False),
+        },
+    }
+
+
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    mock = MockOpenAI(config or MockConfig())
+    app = FastAPI(title="Mock OpenAI API")
+    app.state.mock = mock
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        messages = body.get("messages", [])
+        rule = mock.match_script(message_text(messages[-1]) if messages else "")
+        mock.stats.requests += 1
+
+        error = mock.injected_error(rule)
+        if error is not None:
+            return error
+
+        plan = mock.plan(body, rule)
+        model = body.get("model", "gpt-4o")
+        created = int(time.time())
+        completion_id = _completion_id()
+        prompt_tokens = sum(len(tokenize(message_text(message))) + 4 for message in messages)
+
+        if "tool_call" in plan:
+            mock.stats.tool_calls += 1
+            tool_call = _tool_call_payload(plan)
+            tokens = tokenize(tool_call["function"]["arguments"])
+            finish_reason = "tool_calls"
+        else:
+            tool_call = None
+            tokens = tokenize(plan["content"])
+            finish_reason = "stop"
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        mock.stats.prompt_tokens += prompt_tokens
+        mock.stats.completion_tokens += len(tokens)
+
+        if not body.get("stream"):
+            mock.stats.in_flight += 1
+            mock.stats.max_in_flight = max(mock.stats.max_in_flight, mock.stats.in_flight)
+            try:
+                await asyncio.sleep(mock.ttft() + mock.generation_time(len(tokens)))
+            finally:
+                mock.stats.in_flight -= 1
+            message = {"role": "assistant", "content": None if tool_call else plan["content"]}
+            if tool_call:
+                message["tool_calls"] = [tool_call]
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": message, "logprobs": None, "finish_reason": finish_reason}],
+                "usage": usage,
+            }
+
+        mock.stats.streamed += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def chunk(delta: dict, finish: Optional[str] = None, **extra) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "logprobs": None, "finish_reason": finish}],
+                **extra,
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        async def stream():
+            loop = asyncio.get_running_loop()
+            mock.stats.in_flight += 1
+            mock.stats.max_in_flight = max(mock.stats.max_in_flight, mock.stats.in_flight)
+            try:
+                await asyncio.sleep(mock.ttft())
+                if tool_call:
+                    header = {**tool_call, "function": {"name": tool_call["function"]["name"], "arguments": ""}}
+                    yield chunk({"role": "assistant", "content": None, "tool_calls": [{"index": 0, **header}]})
+                else:
+                    yield chunk({"role": "assistant", "content": ""})
+
+                start = loop.time()
+                for i, token in enumerate(tokens):
+                    # 按目标时间表发送，短于5毫秒的间隔不单独sleep，减少大并发下的唤醒次数
+                    delay = start + mock.generation_time(i + 1) - loop.time()
+                    if delay > 0.005:
+                        await asyncio.sleep(delay)
+                    if tool_call:
+                        yield chunk({"tool_calls": [{"index": 0, "function": {"arguments": token}}]})
+                    else:
+                        yield chunk({"content": token})
+
+                yield chunk({}, finish_reason)
+                if include_usage:
+                    payload = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [],
+                        "usage": usage,
+                    }
+                    yield f"data: {json.dumps(payload)}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                mock.stats.in_flight -= 1
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dim = body.get("dimensions") or mock.config.embedding_dim
+        mock.stats.requests += 1
+
+        data = []
+        for index, item in enumerate(inputs):
+            # 同样的输入得到同样的单位向量
+            rng = random.Random(hashlib.md5(str(item).encode("utf-8")).hexdigest())
+            vector = [rng.gauss(0.0, 1.0) for _ in range(dim)]
+            norm = sum(value * value for value in vector) ** 0.5
+            vector = [value / norm for value in vector]
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(struct.pack(f"<{dim}f", *vector)).decode("ascii")
+            else:
+                embedding = vector
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+
+        tokens = sum(len(item) if isinstance(item, list) else len(tokenize(item)) for item in inputs)
+        mock.stats.prompt_tokens += tokens
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-3-small"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.get("/v1/models")
+    async def models():
+        names = ["gpt-4o", "gpt-4o-mini", "text-embedding-3-small"]
+        return {"object": "list", "data": [{"id": name, "object": "model", "owned_by": "mock"} for name in names]}
+
+    @app.get("/mock/stats")
+    async def stats():
+        return mock.stats.as_dict()
+
+    @app.get("/mock/config")
+    async def get_config():
+        return asdict(mock.config)
+
+    @app.post("/mock/config")
+    async def update_config(request: Request):
+        mock.update(await request.json())
+        return asdict(mock.config)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地的OpenAI兼容模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", default="const:0.2", help="首token延迟分布，如 lognormal:0.4,0.5")
+    parser.add_argument("--token-rate", type=float, default=50.0, help="每秒输出的token数，0表示不限速")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回错误的概率")
+    parser.add_argument("--error-status", default="429,500,503", help="注入错误时随机选择的状态码")
+    parser.add_argument("--response", default=DEFAULT_RESPONSE, help="默认的回答内容")
+    parser.add_argument("--script", help="脚本化回答的JSON文件")
+    parser.add_argument("--no-tool-calls", action="store_true", help="请求带tools时默认不调用工具")
+    parser.add_argument("--seed", type=int, help="随机种子")
+    args = parser.parse_args()
+
+    script = []
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+
+    config = MockConfig(
+        latency=args.latency,
+        token_rate=args.token_rate,
+        error_rate=args.error_rate,
+        error_status=[int(status) for status in args.error_status.split(",")],
+        response=args.response,
+        script=script,
+        tool_calls=not args.no_tool_calls,
+        seed=args.seed,
+    )
+
+    import uvicorn
+    uvicorn.run(create_app(config), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+请求截止时间、LLM调用重试和按agent的熔断
+
+截止时间: API根据请求头 X-Request-Timeout（秒）或默认值计算截止时间，写入工作流状态的deadline字段。
+路由器和agent节点执行时把截止时间放入上下文变量，llm_client的HTTP客户端据此把每次请求的超时
+限制在剩余时间之内；异步执行时整个节点也以剩余时间为上限，超时抛出DeadlineExceeded（API返回504）。
+
+重试: 连接失败、超时以及408/429/5xx响应由llm_client在HTTP层重试，不超过剩余时间（见llm_client.py）。
+
+熔断: 每个agent一个熔断器，最近的调用中失败比例过高时打开，在冷却时间内直接失败
+（或者改由聊天agent回答），冷却后放行一个探测请求，成功则恢复。
+超过请求截止时间的失败（包括被截止时间缩短的HTTP超时）由调用方的超时设置决定，不计入熔断器，
+否则一个设置很短超时的调用方就能让所有用户的请求都被熔断。408和429以外的4xx响应（参数错误、输入过长、
+鉴权失败等）是请求本身的问题，同样不计入。
+
+配置（环境变量）:
+- SCIAGENT_REQUEST_TIMEOUT: 请求未指定超时时的默认值（秒），默认60
+- SCIAGENT_MAX_REQUEST_TIMEOUT: 请求头可以指定的最长超时（秒），默认300
+- SCIAGENT_BREAKER_FAILURE_RATE: 打开熔断器的失败比例，默认0.5
+- SCIAGENT_BREAKER_MIN_CALLS: 统计窗口内至少多少次调用后才判断，默认5
+- SCIAGENT_BREAKER_COOLDOWN: 熔断器打开后的冷却时间（秒），默认30
+- SCIAGENT_BREAKER_FALLBACK: 设为0时熔断后直接返回错误，默认改由聊天agent回答
+"""
+
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Deque, Dict, Optional
+
+from langchain_core.runnables import Runnable, RunnableLambda
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = float(os.getenv("SCIAGENT_REQUEST_TIMEOUT", "60"))
+MAX_TIMEOUT = float(os.getenv("SCIAGENT_MAX_REQUEST_TIMEOUT", "300"))
+MIN_TIMEOUT = 1.0
+BREAKER_FAILURE_RATE = float(os.getenv("SCIAGENT_BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_MIN_CALLS = int(os.getenv("SCIAGENT_BREAKER_MIN_CALLS", "5"))
+BREAKER_COOLDOWN = float(os.getenv("SCIAGENT_BREAKER_COOLDOWN", "30"))
+BREAKER_WINDOW = 20
+FALLBACK = os.getenv("SCIAGENT_BREAKER_FALLBACK", "1") != "0"
+
+# 当前请求的截止时间（time.time()），由节点包装设置，llm_client的HTTP transport读取
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("sciagent_deadline", default=None)
+# 发起LLM调用的agent（路由器为"router"），由节点包装设置，hedging.py按agent分别统计耗时
+_caller: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("sciagent_caller", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """请求的截止时间已过"""
+
+
+class CircuitOpen(Exception):
+    """熔断器已打开，retry_after为距离冷却结束的秒数"""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"{name} 暂时不可用，请稍后重试")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def timeout_from_header(value: Optional[str]) -> float:
+    """X-Request-Timeout 请求头（秒）对应的超时，超出范围时截断到 [1, SCIAGENT_MAX_REQUEST_TIMEOUT]"""
+    timeout = DEFAULT_TIMEOUT
+    if value:
+        try:
+            timeout = float(value)
+        except ValueError:
+            pass
+    return min(max(timeout, MIN_TIMEOUT), MAX_TIMEOUT)
+
+
+def deadline_from_header(value: Optional[str], now: Optional[float] = None) -> float:
+    """根据 X-Request-Timeout 请求头（秒）计算截止时间"""
+    return (time.time() if now is None else now) + timeout_from_header(value)
+
+
+def remaining() -> Optional[float]:
+    """当前请求剩余的秒数，没有截止时间时为None"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.time()
+
+
+@contextmanager
+def deadline_scope(deadline: Optional[float]):
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def current_caller() -> Optional[str]:
+    """当前LLM调用所属的agent，不在agent或路由器节点中时为None"""
+    return _caller.get()
+
+
+@contextmanager
+def caller_scope(name: Optional[str]):
+    token = _caller.set(name)
+    try:
+        yield
+    finally:
+        _caller.reset(token)
+
+
+# 熔断
+
+
+class CircuitBreaker:
+    """按最近BREAKER_WINDOW次调用的失败比例打开，冷却后放行一个探测请求（线程安全）"""
+
+    def __init__(self, name: str, failure_rate: float = BREAKER_FAILURE_RATE, min_calls: int = BREAKER_MIN_CALLS,
+                 cooldown: float = BREAKER_COOLDOWN, window: int = BREAKER_WINDOW):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._probing = False
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.opened = 0
+        self.fallbacks = 0
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.cooldown:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            if self.state == "closed":
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.cooldown - (time.monotonic() - self._opened_at)))
+
+    def record(self, success: bool) -> None:
+        with self._lock:
+            self.calls += 1
+            self.failures += 0 if success else 1
+            if self.state == "half_open":
+                self._probing = False
+                if success:
+                    self.state = "closed"
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append(success)
+            failed = self._outcomes.count(False)
+            if len(self._outcomes) >= self.min_calls and failed / len(self._outcomes) >= self.failure_rate:
+                self._open()
+
+    def release_probe(self) -> None:
+        """探测请求被取消或超过截止时间时让出名额，不计入结果"""
+        with self._lock:
+            self._probing = False
+
+    def record_fallback(self) -> None:
+        with self._lock:
+            self.fallbacks += 1
+
+    def _open(self) -> None:
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self.opened += 1
+        logger.warning("%s 的熔断器已打开，%g 秒后重试", self.name, self.cooldown)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "calls": self.calls,
+                "failures": self.failures,
+                "recent_failure_rate": self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0,
+                "rejected": self.rejected,
+                "opened": self.opened,
+                "fallbacks": self.fallbacks,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str) -> CircuitBreaker:
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def breaker_stats() -> Dict[str, Dict[str, object]]:
+    return {name: item.stats() for name, item in _breakers.items()}
+
+
+# 节点包装
+
+
+def _expired(state: dict) -> bool:
+    deadline = state.get("deadline")
+    return deadline is not None and time.time() >= deadline
+
+
+def with_deadline(node: Runnable, caller: Optional[str] = None) -> Runnable:
+    """在节点执行期间设置截止时间；异步执行时以剩余时间为上限
+
+    caller: 节点中LLM调用所属的agent（例如"router"），agent节点由with_breaker设置
+    """
+
+    def run(state: dict, config=None):
+        if _expired(state):
+            raise DeadlineExceeded("请求已超过截止时间")
+        with deadline_scope(state.get("deadline")), caller_scope(caller or current_caller()):
+            try:
+                return node.invoke(state, config)
+            except Exception as e:
+                # 超时或重试被截止时间打断时，OpenAI客户端会把原因包装成连接错误
+                if _expired(state) and not isinstance(e, DeadlineExceeded):
+                    raise DeadlineExceeded("请求已超过截止时间") from e
+                raise
+
+    async def arun(state: dict, config=None):
+        deadline = state.get("deadline")
+        if _expired(state):
+            raise DeadlineExceeded("请求已超过截止时间")
+        with deadline_scope(deadline), caller_scope(caller or current_caller()):
+            try:
+                if deadline is None:
+                    return await node.ainvoke(state, config)
+                return await asyncio.wait_for(node.ainvoke(state, config), deadline - time.time())
+            except asyncio.TimeoutError as e:
+                raise DeadlineExceeded("请求已超过截止时间") from e
+            except Exception as e:
+                if _expired(state) and not isinstance(e, DeadlineExceeded):
+                    raise DeadlineExceeded("请求已超过截止时间") from e
+                raise
+
+    return RunnableLambda(run, afunc=arun)
+
+
+def _caused_by_deadline(error: BaseException, state: dict) -> bool:
+    """失败是否由请求自身的截止时间导致（OpenAI客户端会把DeadlineExceeded包装成连接错误）"""
+    if _expired(state):
+        return True
+    while error is not None:
+        if isinstance(error, DeadlineExceeded):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _client_error(error: BaseException) -> bool:
+    """失败是否为请求本身的4xx错误（408和429除外，它们在重试后仍失败说明上游过载）
+
+    OpenAI客户端的APIStatusError带status_code，httpx的HTTPStatusError带response.status_code
+    """
+    while error is not None:
+        status = getattr(error, "status_code", None)
+        if status is None:
+            status = getattr(getattr(error, "response", None), "status_code", None)
+        if isinstance(status, int):
+            return 400 <= status < 500 and status not in (408, 429)
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def with_breaker(route: str, agent: Runnable, fallback: Optional[Runnable] = None) -> Runnable:
+    """agent的熔断器打开时改用fallback（通常是聊天agent）回答，没有fallback时抛出CircuitOpen"""
+    circuit = breaker(route)
+
+    def rejected():
+        if fallback is None or not FALLBACK:
+            raise CircuitOpen(route, circuit.retry_after())
+        circuit.record_fallback()
+        logger.info("%s 熔断中，改由聊天agent回答", route)
+
+    def run(state: dict, config=None):
+        if not circuit.allow():
+            rejected()
+            return fallback.invoke(state, config)
+        try:
+            with caller_scope(route):
+                result = agent.invoke(state, config)
+        except Exception as e:
+            if _caused_by_deadline(e, state) or _client_error(e):
+                circuit.release_probe()
+            else:
+                circuit.record(False)
+            raise
+        circuit.record(True)
+        return result
+
+    async def arun(state: dict, config=None):
+        if not circuit.allow():
+            rejected()
+            return await fallback.ainvoke(state, config)
+        try:
+            with caller_scope(route):
+                result = await agent.ainvoke(state, config)
+        except Exception as e:
+            if _caused_by_deadline(e, state) or _client_error(e):
+                circuit.release_probe()
+            else:
+                circuit.record(False)
+            raise
+        except asyncio.CancelledError:
+            # 取消（包括截止时间到达）不代表agent出错，但半开状态下需要让出探测名额
+            circuit.release_probe()
+            raise
+        circuit.record(True)
+        return result
+
+    return RunnableLambda(run, afunc=arun)
@@ -0,0 +1,170 @@
+"""
+路由决策缓存
+
+以归一化后的用户输入为键缓存路由决策，命中时直接跳过LLM路由器。
+缓存为带TTL的有界LRU，可选使用SQLite持久化，API重启后依然有效。
+查询只读内存，SQLite的写入交给后台线程批量提交，不在事件循环上等待磁盘。
+
+配置（环境变量）:
+- SCIAGENT_ROUTE_CACHE_SIZE: 最大条目数，默认10000，设为0关闭缓存
+- SCIAGENT_ROUTE_CACHE_TTL: 过期时间（秒），默认86400
+- SCIAGENT_ROUTE_CACHE_DB: SQLite文件路径，不设置时只使用内存缓存
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 匹配中文等非ASCII字符及其两侧的空白
+_CJK_SPACE = re.compile(r"\s*([^\x00-\x7f])\s*")
+
+
+def normalize_query(text: str) -> str:
+    """归一化查询：全半角统一、大小写折叠、去除标点、合并空白"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    text = " ".join(text.split())
+    # 中文字符两侧的空白没有分词意义，直接去掉
+    return _CJK_SPACE.sub(r"\1", text)
+
+
+class RouteCache:
+    """带TTL的有界LRU路由缓存，可选SQLite持久化"""
+
+    def __init__(self, max_size: int = 10000, ttl: float = 86400, db_path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (decision, expires_at)
+        self._lock = threading.Lock()
+        self._db = None
+        self._writer = None
+        # 等待后台线程写入SQLite的语句
+        self._pending_writes: List[Tuple[str, tuple]] = []
+        self._write_scheduled = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS route_cache ("
+                "key TEXT PRIMARY KEY, decision TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._db.commit()
+            self._load()
+            # 单个线程按提交顺序执行写入
+            self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="route-cache")
+
+    def _load(self) -> None:
+        """启动时从SQLite加载未过期的条目，按过期时间排序以近似恢复LRU顺序"""
+        now = time.time()
+        self._db.execute("DELETE FROM route_cache WHERE expires_at <= ?", (now,))
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT key, decision, expires_at FROM route_cache ORDER BY expires_at DESC LIMIT ?",
+            (self.max_size,),
+        ).fetchall()
+        for key, decision, expires_at in reversed(rows):
+            self._entries[key] = (decision, expires_at)
+
+    def get(self, query: str) -> Optional[str]:
+        """查询缓存，命中时返回路由决策"""
+        if self.max_size <= 0:
+            return None
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            decision, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self._delete(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return decision
+
+    def put(self, query: str, decision: str) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        if self.max_size <= 0:
+            return
+        key = normalize_query(query)
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (decision, expires_at)
+            self._entries.move_to_end(key)
+            self._write(
+                "INSERT OR REPLACE INTO route_cache (key, decision, expires_at) VALUES (?, ?, ?)",
+                (key, decision, expires_at),
+            )
+            while len(self._entries) > self.max_size:
+                evicted, _ = self._entries.popitem(last=False)
+                self._delete(evicted)
+                self.evictions += 1
+
+    def _delete(self, key: str) -> None:
+        self._write("DELETE FROM route_cache WHERE key = ?", (key,))
+
+    def _write(self, sql: str, params: tuple) -> None:
+        """在持有self._lock时调用：记下写入语句，由后台线程执行并提交"""
+        if self._db is None:
+            return
+        self._pending_writes.append((sql, params))
+        if not self._write_scheduled:
+            self._write_scheduled = True
+            self._writer.submit(self._write_pending)
+
+    def _write_pending(self) -> None:
+        """后台线程：一次事务写入目前积累的所有语句"""
+        with self._lock:
+            writes, self._pending_writes = self._pending_writes, []
+            self._write_scheduled = False
+        try:
+            for sql, params in writes:
+                self._db.execute(sql, params)
+            self._db.commit()
+        except sqlite3.Error as e:
+            # 持久化失败不影响内存中的缓存
+            logger.warning("路由缓存写入SQLite失败: %s", e)
+
+    def flush(self) -> None:
+        """等待已提交的写入完成"""
+        if self._writer is not None:
+            self._writer.submit(lambda: None).result()
+
+    def stats(self) -> Dict[str, float]:
+        """获取命中/未命中/淘汰统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# 全局路由缓存
+route_cache = RouteCache(
+    max_size=int(os.getenv("SCIAGENT_ROUTE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("SCIAGENT_ROUTE_CACHE_TTL", "86400")),
+    db_path=os.getenv("SCIAGENT_ROUTE_CACHE_DB"),
+)
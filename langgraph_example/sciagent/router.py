@@ -1,57 +1,128 @@
+import logging
+import os
+import threading
+from typing import List, Optional
+
 from typing_extensions import Literal
 from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from pydantic import BaseModel, Field
-from langgraph.graph import StateGraph, START, END
 from dotenv import load_dotenv
 load_dotenv("/mnt/shared_disk/.env")
 
-from langchain_openai import ChatOpenAI
-
-# 导入所有专业agent
-from agents import (
-    chat_agent,
-    bioinformatics_agent,
-    bioinfo_interpret_agent,
-    literature_agent,
-    research_image_agent,
-    deep_research_agent
-)
+# 专业agent的注册表，agent模块在第一次使用时才导入
+from agents.registry import agent_registry
 
 # 导入State类型
 from agents.base_agent import State
 
-# 创建LLM实例
-llm = ChatOpenAI(model="gpt-4o")
+# 关键词路由规则
+from keyword_router import keyword_router
+
+# 本地快速路由分类器
+from fast_router import fast_route, log_decision
+
+# 路由决策缓存
+from route_cache import route_cache
+
+# 推测并行执行
+from speculation import ENABLED as SPECULATIVE, speculator, with_speculation
+
+# 截止时间和熔断
+from resilience import with_breaker, with_deadline
+
+# Prometheus指标、单个请求的耗时分解和追踪
+import metrics
+from timing import timed
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# 多agent模式下单个请求最多同时调用的agent数
+MAX_FANOUT = int(os.getenv("SCIAGENT_MAX_FANOUT", "3"))
+
+# 交给LLM路由器的输入最多保留的字符数
+ROUTER_INPUT_CHARS = int(os.getenv("SCIAGENT_ROUTER_INPUT_CHARS", "2000"))
+
+RouteStep = Literal[
+    "chat",                # 简单聊天agent
+    "bioinformatics",      # 生信分析agent
+    "bioinfo_interpret",   # 生信解读agent
+    "literature",          # 文献辅助agent
+    "research_image",      # 科研图片助手agent
+    "deep_research"        # deepresearchagent
+]
 
 # Schema for structured output to use as routing logic
 class Route(BaseModel):
-    step: Literal[
-        "chat",                # 简单聊天agent
-        "bioinformatics",      # 生信分析agent
-        "bioinfo_interpret",   # 生信解读agent
-        "literature",          # 文献辅助agent
-        "research_image",      # 科研图片助手agent
-        "deep_research"        # deepresearchagent
-    ] = Field(
+    step: RouteStep = Field(
         None, description="The next step in the routing process"
     )
 
 
-# Augment the LLM with schema for structured output
-router = llm.with_structured_output(Route)
+# 多agent模式的路由结果
+class MultiRoute(BaseModel):
+    steps: List[RouteStep] = Field(
+        default_factory=list,
+        description="All agents needed to answer the request, ordered by relevance"
+    )
+
+
+# LLM实例和路由器在第一次路由时才创建（导入langchain_openai较慢）；测试时可以直接赋值替换
+llm = None
+router = None
+multi_router = None
+_init_lock = threading.Lock()
 
 
-# 路由器节点
+def get_llm():
+    """创建LLM实例，与各个agent共用llm_client.py中的连接池；设置BASE_URL时改为请求对应的OpenAI兼容服务（例如本地的mock_openai_server.py）"""
+    global llm
+    if llm is None:
+        with _init_lock:
+            if llm is None:
+                from llm_client import chat_model
+                llm = chat_model("gpt-4o")
+    return llm
 
 
-def llm_call_router(state: State):
-    """Route the input to the appropriate node based on the query content"""
+def get_router():
+    # Augment the LLM with schema for structured output
+    # 路由结果不需要逐token推送给客户端
+    global router
+    if router is None:
+        from langgraph.constants import TAG_NOSTREAM
+        router = get_llm().with_structured_output(Route).with_config(tags=[TAG_NOSTREAM])
+    return router
 
-    # Run the augmented LLM with structured output to serve as routing logic
-    decision = router.invoke(
-        [
-            SystemMessage(
-                content="""根据用户的输入，将请求路由到最合适的专业agent处理。可选的agent有：
+
+def get_multi_router():
+    global multi_router
+    if multi_router is None:
+        from langgraph.constants import TAG_NOSTREAM
+        multi_router = get_llm().with_structured_output(MultiRoute).with_config(tags=[TAG_NOSTREAM])
+    return multi_router
+
+
+# 路由结果到agent的映射
+AGENT_FUNCTIONS = agent_registry
+
+# agent节点名称，流式输出时只转发这些节点的token
+AGENT_NODES = {f"{route}_agent" for route in AGENT_FUNCTIONS}
+
+# 多agent模式合并回答时使用的标题
+AGENT_TITLES = {
+    "chat": "简单聊天助手",
+    "bioinformatics": "生信分析助手",
+    "bioinfo_interpret": "生信解读助手",
+    "literature": "文献辅助助手",
+    "research_image": "科研图片助手",
+    "deep_research": "深度科研助手",
+}
+
+
+# 路由器的系统提示
+ROUTER_PROMPT = """根据用户的输入，将请求路由到最合适的专业agent处理。可选的agent有：
                 - chat: 简单聊天agent，处理一般性对话和问题
                 - bioinformatics: 生信分析agent，处理生物信息学分析请求
                 - bioinfo_interpret: 生信解读agent，解释生物信息学分析结果
@@ -61,17 +132,140 @@ def llm_call_router(state: State):
 
                 请根据用户输入的内容和意图，选择最合适的agent。
                 """
-            ),
-            HumanMessage(content=state["input"]),
-        ]
-    )
-    print(decision)
 
-    return {"decision": decision.step}
+MULTI_ROUTER_PROMPT = ROUTER_PROMPT + """
+                如果问题同时涉及多个领域，可以选择多个agent，按相关性从高到低排列；只涉及一个领域时只选择一个。
+                """
+
+
+# 路由器节点
+
+
+def local_decision(state: State):
+    """不调用LLM的路由阶段：依次尝试指定的agent、关键词规则、路由缓存和本地快速路由，都未命中时返回None"""
+
+    # 请求直接指定了agent
+    if state.get("agent") in AGENT_FUNCTIONS:
+        return state["agent"]
+
+    # 关键词规则足够确定时直接路由
+    if keyword_router is not None:
+        rule_decision = keyword_router.route(state["input"])
+        if rule_decision is not None:
+            return rule_decision
+
+    # 缓存命中时直接返回，跳过路由LLM调用
+    cached_decision = None if state.get("bypass_cache") else route_cache.get(state["input"])
+    if cached_decision is not None:
+        return cached_decision
+
+    # 尝试本地快速路由，置信度足够时跳过LLM调用；快速路由的决策不写入缓存，
+    # 否则一次误判会在整个TTL内生效，而分类器更新后本来就能直接给出新的决策
+    fast_decision = fast_route(state["input"])
+    if fast_decision is not None:
+        return fast_decision
+
+    return None
+
+
+def routing_input(state: State) -> str:
+    """粘贴的长文本只取开头和结尾交给路由器，问题通常写在这两处"""
+    text = state["input"]
+    if len(text) <= ROUTER_INPUT_CHARS:
+        return text
+    half = ROUTER_INPUT_CHARS // 2
+    return f"{text[:half]}\n……（中间省略{len(text) - 2 * half}字）……\n{text[-half:]}"
+
+
+def router_messages(state: State):
+    return [
+        SystemMessage(content=ROUTER_PROMPT),
+        HumanMessage(content=routing_input(state)),
+    ]
+
+
+def finish_routing(state: State, decision: Route, speculation):
+    """记录LLM路由器的决策，并确认推测执行是否命中"""
+    logger.debug("LLM路由决策: %s", decision.step)
+    log_decision(state["input"], decision.step)
+    if keyword_router is not None:
+        keyword_router.check(state["input"], decision.step)
+    route_cache.put(state["input"], decision.step)
+
+    speculation_id = speculator.resolve(speculation, decision.step) if speculation is not None else None
+    return {"decision": decision.step, "speculation_id": speculation_id}
+
+
+def multi_router_messages(state: State):
+    return [
+        SystemMessage(content=MULTI_ROUTER_PROMPT),
+        HumanMessage(content=routing_input(state)),
+    ]
+
+
+def finish_multi_routing(state: State, route: MultiRoute):
+    """去重并按请求的上限截断多agent路由结果"""
+    max_agents = min(state.get("max_agents") or MAX_FANOUT, MAX_FANOUT)
+    decisions = list(dict.fromkeys(route.steps))[:max_agents] or ["chat"]
+    logger.debug("多agent路由决策: %s（保留 %s）", route.steps, decisions)
+    return {"decision": decisions[0], "decisions": decisions, "speculation_id": None}
+
+
+def llm_call_router(state: State, config: Optional[RunnableConfig] = None):
+    """Route the input to the appropriate node based on the query content"""
+
+    # 多agent模式由LLM选择所有相关的agent
+    if state.get("multi_agent") and not state.get("agent"):
+        return finish_multi_routing(state, get_multi_router().invoke(multi_router_messages(state)))
+
+    decision = local_decision(state)
+    if decision is not None:
+        return {"decision": decision, "speculation_id": None}
+
+    # 推测执行：路由LLM运行的同时提前启动预测的agent
+    speculation = speculator.start(state["input"], guarded_agent, state, config) if SPECULATIVE else None
+
+    # Run the augmented LLM with structured output to serve as routing logic
+    try:
+        decision = get_router().invoke(router_messages(state))
+    except Exception:
+        if speculation is not None:
+            speculator.discard(speculation)
+        raise
+    return finish_routing(state, decision, speculation)
+
+
+async def allm_call_router(state: State, config: Optional[RunnableConfig] = None):
+    """llm_call_router的异步版本"""
+
+    if state.get("multi_agent") and not state.get("agent"):
+        return finish_multi_routing(state, await get_multi_router().ainvoke(multi_router_messages(state)))
+
+    decision = local_decision(state)
+    if decision is not None:
+        return {"decision": decision, "speculation_id": None}
+
+    speculation = speculator.astart(state["input"], guarded_agent, state, config) if SPECULATIVE else None
+
+    try:
+        decision = await get_router().ainvoke(router_messages(state))
+    except BaseException:
+        # 包括请求被取消的情况，推测任务也需要一并取消
+        if speculation is not None:
+            speculator.discard(speculation)
+        raise
+    return finish_routing(state, decision, speculation)
 
 
 # Conditional edge function to route to the appropriate node
 def route_decision(state: State):
+    # 多agent模式：用Send并行调用每个agent，结果由merge_outputs合并
+    decisions = state.get("decisions") or []
+    metrics.record_routes(decisions or [state["decision"]])
+    if len(decisions) > 1:
+        from langgraph.types import Send
+        return [Send("fanout_agent", {**state, "decision": decision}) for decision in decisions]
+
     # Return the node name you want to visit next
     if state["decision"] == "chat":
         return "chat_agent"
@@ -90,41 +284,148 @@ def route_decision(state: State):
         return "chat_agent"
 
 
-# Build workflow
-router_builder = StateGraph(State)
-
-# Add nodes
-router_builder.add_node("chat_agent", chat_agent)
-router_builder.add_node("bioinformatics_agent", bioinformatics_agent)
-router_builder.add_node("bioinfo_interpret_agent", bioinfo_interpret_agent)
-router_builder.add_node("literature_agent", literature_agent)
-router_builder.add_node("research_image_agent", research_image_agent)
-router_builder.add_node("deep_research_agent", deep_research_agent)
-router_builder.add_node("llm_call_router", llm_call_router)
-
-# Add edges to connect nodes
-router_builder.add_edge(START, "llm_call_router")
-router_builder.add_conditional_edges(
-    "llm_call_router",
-    route_decision,
-    {  # Name returned by route_decision : Name of next node to visit
-        "chat_agent": "chat_agent",
-        "bioinformatics_agent": "bioinformatics_agent",
-        "bioinfo_interpret_agent": "bioinfo_interpret_agent",
-        "literature_agent": "literature_agent",
-        "research_image_agent": "research_image_agent",
-        "deep_research_agent": "deep_research_agent",
-    },
-)
-router_builder.add_edge("chat_agent", END)
-router_builder.add_edge("bioinformatics_agent", END)
-router_builder.add_edge("bioinfo_interpret_agent", END)
-router_builder.add_edge("literature_agent", END)
-router_builder.add_edge("research_image_agent", END)
-router_builder.add_edge("deep_research_agent", END)
-
-# Compile workflow
-router_workflow = router_builder.compile()
+# 带熔断的agent，熔断时改由聊天agent回答
+_guarded_agents = {}
+
+
+def guarded_agent(route: str):
+    if route not in _guarded_agents:
+        fallback = None if route == "chat" else guarded_agent("chat")
+        _guarded_agents[route] = with_breaker(route, agent_registry.lazy(route), fallback)
+    return _guarded_agents[route]
+
+
+def observed(node: str, runnable: RunnableLambda, phase: str, agent: Optional[str] = None,
+             parallel: bool = False) -> RunnableLambda:
+    """节点的Prometheus指标、耗时分解和追踪span，都直接包装节点的函数，不增加调用层级"""
+    return metrics.instrument(node, timed(phase, traced(node, runnable), parallel=parallel), agent=agent)
+
+
+def agent_node(route: str):
+    """图中的agent节点：推测执行 -> 熔断 -> agent，整个节点受请求截止时间限制
+
+    推测执行同样通过带熔断的agent运行，熔断器打开时改由聊天agent回答的结果也可以直接使用
+    """
+    return observed(
+        f"{route}_agent",
+        with_deadline(with_speculation(route, guarded_agent(route))),
+        "agent",
+        agent=route,
+    )
+
+
+# 多agent模式中的单个agent调用
+def fanout_agent(state: State, config=None):
+    result = guarded_agent(state["decision"]).invoke(state, config)
+    metrics.record_usage(state["decision"], result.get("usage"))
+    return {"partial_outputs": [{"agent": state["decision"], "output": result["output"]}]}
+
+
+async def afanout_agent(state: State, config=None):
+    result = await guarded_agent(state["decision"]).ainvoke(state, config)
+    metrics.record_usage(state["decision"], result.get("usage"))
+    return {"partial_outputs": [{"agent": state["decision"], "output": result["output"]}]}
+
+
+# 合并多个agent的回答，按路由结果的顺序排列
+def merge_outputs(state: State):
+    outputs = {partial["agent"]: partial["output"] for partial in state["partial_outputs"]}
+    sections = [
+        f"## {AGENT_TITLES[decision]}\n\n{outputs[decision]}"
+        for decision in state["decisions"] if decision in outputs
+    ]
+    return {"output": "\n\n".join(sections)}
+
+
+def build_workflow(memory: bool = False):
+    """构建并编译路由工作流，agent节点在第一次执行时才加载对应的agent
+
+    memory为True时，回答之后经过update_memory节点更新对话历史，并使用检查点按thread_id保存状态
+    """
+    from langgraph.graph import StateGraph, START, END
+
+    # Build workflow
+    router_builder = StateGraph(State)
+
+    # Add nodes
+    router_builder.add_node("chat_agent", agent_node("chat"))
+    router_builder.add_node("bioinformatics_agent", agent_node("bioinformatics"))
+    router_builder.add_node("bioinfo_interpret_agent", agent_node("bioinfo_interpret"))
+    router_builder.add_node("literature_agent", agent_node("literature"))
+    router_builder.add_node("research_image_agent", agent_node("research_image"))
+    router_builder.add_node("deep_research_agent", agent_node("deep_research"))
+    # 内层Runnable的名称与节点名区分开，避免按节点名统计耗时时重复计数
+    router_builder.add_node("llm_call_router", observed("llm_call_router", with_deadline(
+        RunnableLambda(llm_call_router, afunc=allm_call_router, name="route"), caller="router"
+    ), "router"))
+    router_builder.add_node("fanout_agent", observed("fanout_agent", with_deadline(
+        RunnableLambda(fanout_agent, afunc=afanout_agent, name="fanout")
+    ), "agent", parallel=True))
+    router_builder.add_node("merge_outputs", merge_outputs)
+
+    # 多轮对话模式下回答完成后更新历史和摘要
+    finish = END
+    if memory:
+        from memory import update_memory, aupdate_memory
+        router_builder.add_node("update_memory", timed("memory", RunnableLambda(update_memory, afunc=aupdate_memory)))
+        router_builder.add_edge("update_memory", END)
+        finish = "update_memory"
+
+    # Add edges to connect nodes
+    router_builder.add_edge(START, "llm_call_router")
+    router_builder.add_conditional_edges(
+        "llm_call_router",
+        route_decision,
+        {  # Name returned by route_decision : Name of next node to visit
+            "chat_agent": "chat_agent",
+            "bioinformatics_agent": "bioinformatics_agent",
+            "bioinfo_interpret_agent": "bioinfo_interpret_agent",
+            "literature_agent": "literature_agent",
+            "research_image_agent": "research_image_agent",
+            "deep_research_agent": "deep_research_agent",
+            "fanout_agent": "fanout_agent",
+        },
+    )
+    router_builder.add_edge("chat_agent", finish)
+    router_builder.add_edge("bioinformatics_agent", finish)
+    router_builder.add_edge("bioinfo_interpret_agent", finish)
+    router_builder.add_edge("literature_agent", finish)
+    router_builder.add_edge("research_image_agent", finish)
+    router_builder.add_edge("deep_research_agent", finish)
+    router_builder.add_edge("fanout_agent", "merge_outputs")
+    router_builder.add_edge("merge_outputs", finish)
+
+    # Compile workflow
+    if memory:
+        from memory import create_checkpointer
+        router_workflow = router_builder.compile(checkpointer=create_checkpointer())
+    else:
+        router_workflow = router_builder.compile()
+    return router_workflow
+
+
+# 无状态的工作流和带对话记忆的工作流分别编译
+_workflows = {}
+
+
+def get_workflow(memory: bool = False):
+    """返回编译好的路由工作流，第一次调用时才构建
+
+    memory为True时返回带检查点的工作流，调用时需要在config中指定thread_id（见memory.thread_config）
+    """
+    if memory not in _workflows:
+        with _init_lock:
+            if memory not in _workflows:
+                _workflows[memory] = build_workflow(memory)
+    return _workflows[memory]
+
+
+def __getattr__(name):
+    # 兼容 from router import router_workflow 的用法，同时把构建推迟到第一次访问
+    if name == "router_workflow":
+        return get_workflow()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # 如果需要可视化工作流，取消下面的注释
 # from IPython.display import Image
@@ -133,6 +434,7 @@ router_workflow = router_builder.compile()
 # 仅在直接运行此文件时执行测试
 if __name__ == "__main__":
     # 简单聊天测试
+    router_workflow = get_workflow()
     state = router_workflow.invoke({"input": "你好，今天天气怎么样？"})
     print("简单聊天示例输出:")
     print(state["output"])
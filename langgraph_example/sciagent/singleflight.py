@@ -0,0 +1,147 @@
+"""
+相同查询的请求合并（single-flight）
+
+同一时刻到达的相同查询（归一化后的输入相同、指定的agent相同）只执行一次工作流，
+所有请求共享同一个结果；流式请求共享同一个事件流，后加入的订阅者会先收到已经产生的事件。
+
+执行按等待者计数：某个请求的客户端断开只让它自己退出，其他请求照常等待；
+最后一个等待者也离开时取消工作流，正在进行的LLM调用随之中止，不再为没人读取的token付费。
+"""
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class _Flight:
+    """一次正在进行的执行及其等待者数量"""
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.waiters = 0
+
+
+class _Coalescer:
+    """记录执行次数、合并次数和取消次数"""
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, Any] = {}
+        self.executions = 0
+        self.coalesced = 0
+        # 中途离开的等待者，以及因为没有等待者而取消的执行
+        self.abandoned = 0
+        self.cancelled = 0
+
+    def _leave(self, key: Hashable, flight, finished: bool) -> None:
+        """等待者离开；finished为False（中途离开）且没有其他等待者时取消执行"""
+        flight.waiters -= 1
+        if finished:
+            return
+        self.abandoned += 1
+        if flight.waiters == 0:
+            # 先移出，之后到达的相同请求重新执行，而不是等待一个正在取消的执行
+            if self._in_flight.get(key) is flight:
+                del self._in_flight[key]
+            flight.task.cancel()
+            self.cancelled += 1
+
+    def _done(self, key: Hashable, flight) -> None:
+        if self._in_flight.get(key) is flight:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, float]:
+        total = self.executions + self.coalesced
+        return {
+            "in_flight": len(self._in_flight),
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "coalesce_rate": self.coalesced / total if total else 0.0,
+            "abandoned": self.abandoned,
+            "cancelled": self.cancelled,
+        }
+
+
+class SingleFlight(_Coalescer):
+    """合并相同key的并发调用"""
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行fn，如果相同key的调用正在进行，则等待它的结果"""
+        flight = self._in_flight.get(key)
+        if flight is None:
+            # 工作流在独立的任务中运行，一个等待者被取消不会直接取消其他等待者共享的执行
+            flight = _Flight()
+            flight.task = asyncio.create_task(fn())
+            self._in_flight[key] = flight
+            flight.task.add_done_callback(lambda _: self._done(key, flight))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(key, flight, flight.task.done())
+
+
+class _Broadcast(_Flight):
+    """把一个事件流扇出给多个订阅者"""
+
+    def __init__(self):
+        super().__init__()
+        self.events: List[Any] = []
+        self.done = False
+        self._changed = asyncio.Condition()
+
+    async def publish(self, event: Any) -> None:
+        async with self._changed:
+            self.events.append(event)
+            self._changed.notify_all()
+
+    async def finish(self) -> None:
+        async with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+    async def subscribe(self) -> AsyncIterator[Any]:
+        cursor = 0
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: cursor < len(self.events) or self.done)
+                batch = self.events[cursor:]
+                finished = self.done
+            cursor += len(batch)
+            for event in batch:
+                yield event
+            if finished and cursor >= len(self.events):
+                return
+
+
+class StreamSingleFlight(_Coalescer):
+    """合并相同key的并发流式调用"""
+
+    async def subscribe(self, key: Hashable, factory: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """订阅key对应的事件流，不存在时用factory创建并在后台运行"""
+        broadcast = self._in_flight.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._in_flight[key] = broadcast
+            self.executions += 1
+
+            async def produce():
+                try:
+                    async for event in factory():
+                        await broadcast.publish(event)
+                finally:
+                    self._done(key, broadcast)
+                    await broadcast.finish()
+
+            broadcast.task = asyncio.create_task(produce())
+        else:
+            self.coalesced += 1
+
+        broadcast.waiters += 1
+        try:
+            async for event in broadcast.subscribe():
+                yield event
+        finally:
+            # 订阅者读完全部事件时broadcast.done已为True，不会取消
+            self._leave(key, broadcast, broadcast.done)
@@ -0,0 +1,261 @@
+"""
+路由器与agent的推测并行执行
+
+LLM路由器运行的同时，提前启动预测的agent（本地分类器的猜测，或最近路由结果中最常见的agent）。
+路由结果与预测一致时保留推测结果，agent节点直接使用；不一致时丢弃并统计浪费的token数，用于权衡延迟和成本。
+异步执行时推测任务会被直接取消；同步执行时只能取消尚未开始的任务。
+
+推测执行使用与agent节点相同的带熔断的agent，并继承路由节点的配置（回调、追踪）和上下文变量（截止时间），
+LLM调用的元数据中带有 speculation 字段（预测的路由），流式接口在路由结果确定后只转发命中的token。
+命中但agent节点没有取用的结果（例如图在路由之后被取消）在 SCIAGENT_SPECULATION_TTL 秒后丢弃并取消。
+
+配置（环境变量）:
+- SCIAGENT_SPECULATIVE: 设为1启用推测执行，默认关闭
+- SCIAGENT_SPECULATION_WORKERS: 推测执行的线程数，默认16
+- SCIAGENT_SPECULATION_TTL: 命中的推测结果最多保留的秒数，默认30
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Union
+
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from langchain_core.runnables.config import ensure_config, patch_config
+
+from fast_router import guess_route
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.getenv("SCIAGENT_SPECULATIVE", "0") == "1"
+MAX_WORKERS = int(os.getenv("SCIAGENT_SPECULATION_WORKERS", "16"))
+TTL = float(os.getenv("SCIAGENT_SPECULATION_TTL", "30"))
+DEFAULT_ROUTE = "chat"
+
+# LLM调用元数据中标记推测执行的字段，值为预测的路由
+METADATA_KEY = "speculation"
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """统计一次执行中所有LLM调用消耗的token数"""
+
+    def __init__(self):
+        self.total_tokens = 0
+        # 被取消的流式调用拿不到usage，用已生成的chunk数近似
+        self.streamed_chunks = 0
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.streamed_chunks += 1
+
+    def on_llm_end(self, response, **kwargs) -> None:
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.total_tokens += usage.get("total_tokens", 0)
+        self.streamed_chunks = 0
+
+    @property
+    def tokens(self) -> int:
+        return self.total_tokens + self.streamed_chunks
+
+
+class Speculation:
+    """一次推测执行"""
+
+    def __init__(self, route: str, future: Union[Future, asyncio.Task], usage: TokenUsageHandler):
+        self.id = uuid.uuid4().hex
+        self.route = route
+        self.future = future
+        self.usage = usage
+        # 命中后等待agent节点取用的截止时间（time.monotonic()）
+        self.expires = 0.0
+
+
+def speculation_config(config: Optional[RunnableConfig], route: str, usage: TokenUsageHandler) -> RunnableConfig:
+    """推测执行的配置：继承路由节点的回调和元数据，加上token统计，去掉run_id"""
+    config = ensure_config(config)
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(usage, inherit=True)
+    else:
+        callbacks = [*(callbacks or []), usage]
+    config = patch_config(config, callbacks=callbacks)
+    config["metadata"] = {**config.get("metadata", {}), METADATA_KEY: route}
+    return config
+
+
+class Speculator:
+    """管理推测执行的启动、确认和丢弃"""
+
+    def __init__(self, max_workers: int = MAX_WORKERS, history_size: int = 200, ttl: float = TTL):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculation")
+        self._history = deque(maxlen=history_size)
+        self._pending: Dict[str, Speculation] = {}
+        self._lock = threading.Lock()
+        self.ttl = ttl
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.wasted_tokens = 0
+
+    def predict(self, query: str) -> str:
+        """预测最可能的路由：优先使用本地分类器，其次使用最近的路由分布"""
+        route = guess_route(query)
+        if route is not None:
+            return route
+        with self._lock:
+            if self._history:
+                return Counter(self._history).most_common(1)[0][0]
+        return DEFAULT_ROUTE
+
+    def start(self, query: str, agent: Callable[[str], Runnable], state: dict,
+              config: Optional[RunnableConfig] = None) -> Speculation:
+        """在后台线程中启动预测的agent，agent(route)返回该路由的agent；上下文变量复制到线程中"""
+        route = self.predict(query)
+        usage = TokenUsageHandler()
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, agent(route).invoke, state,
+                                       speculation_config(config, route, usage))
+        return self._started(route, future, usage)
+
+    def astart(self, query: str, agent: Callable[[str], Runnable], state: dict,
+               config: Optional[RunnableConfig] = None) -> Speculation:
+        """在当前事件循环中以任务的形式启动预测的agent（任务自动复制当前的上下文变量）"""
+        route = self.predict(query)
+        usage = TokenUsageHandler()
+        task = asyncio.create_task(agent(route).ainvoke(state, speculation_config(config, route, usage)))
+        return self._started(route, task, usage)
+
+    def _started(self, route: str, future, usage: TokenUsageHandler) -> Speculation:
+        with self._lock:
+            self.started += 1
+        return Speculation(route, future, usage)
+
+    def resolve(self, speculation: Speculation, decision: str) -> Optional[str]:
+        """路由结果确定后调用；命中时返回推测执行的id，供agent节点取用结果"""
+        self.evict_expired()
+        with self._lock:
+            self._history.append(decision)
+            if decision == speculation.route:
+                self.hits += 1
+                speculation.expires = time.monotonic() + self.ttl
+                self._pending[speculation.id] = speculation
+                hit = True
+            else:
+                self.misses += 1
+                hit = False
+        if not hit:
+            self.discard(speculation)
+            return None
+        if isinstance(speculation.future, asyncio.Task):
+            # 异步执行时不必等到下一次路由，到期后直接清理
+            asyncio.get_running_loop().call_later(self.ttl, self.evict_expired)
+        return speculation.id
+
+    def evict_expired(self) -> None:
+        """丢弃超过TTL仍未被agent节点取用的推测结果（例如图在路由之后被取消），取消仍在运行的调用"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [speculation for speculation in self._pending.values() if speculation.expires <= now]
+            for speculation in expired:
+                del self._pending[speculation.id]
+            self.expired += len(expired)
+        for speculation in expired:
+            logger.debug("推测结果 %s 未被取用，已丢弃", speculation.id)
+            self.discard(speculation)
+
+    def discard(self, speculation: Speculation) -> None:
+        """丢弃推测结果，尽可能取消仍在运行的调用"""
+        if isinstance(speculation.future, asyncio.Task):
+            # 异步任务可以在任意await点取消，上游的HTTP请求也会随之中断
+            speculation.future.cancel()
+            speculation.future.add_done_callback(lambda _: self._count_wasted(speculation))
+        elif speculation.future.cancel():
+            with self._lock:
+                self.cancelled += 1
+        else:
+            # 已经在线程中运行的调用无法中断，结束后统计浪费的token
+            speculation.future.add_done_callback(lambda _: self._count_wasted(speculation))
+
+    def _pop(self, speculation_id: Optional[str], route: str) -> Optional[Speculation]:
+        if not speculation_id:
+            return None
+        with self._lock:
+            speculation = self._pending.get(speculation_id)
+            if speculation is None or speculation.route != route:
+                return None
+            del self._pending[speculation_id]
+        return speculation
+
+    def take(self, speculation_id: Optional[str], route: str) -> Optional[dict]:
+        """agent节点取用推测结果，推测失败时返回None，由agent正常执行"""
+        speculation = self._pop(speculation_id, route)
+        if speculation is None:
+            return None
+        try:
+            return speculation.future.result()
+        except Exception as e:
+            logger.warning("推测执行失败，重新执行agent: %s", e)
+            return None
+
+    async def atake(self, speculation_id: Optional[str], route: str) -> Optional[dict]:
+        """take的异步版本"""
+        speculation = self._pop(speculation_id, route)
+        if speculation is None:
+            return None
+        try:
+            return await speculation.future
+        except Exception as e:
+            logger.warning("推测执行失败，重新执行agent: %s", e)
+            return None
+
+    def _count_wasted(self, speculation: Speculation) -> None:
+        with self._lock:
+            self.wasted_tokens += speculation.usage.tokens
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            resolved = self.hits + self.misses
+            return {
+                "enabled": ENABLED,
+                "started": self.started,
+                "hits": self.hits,
+                "misses": self.misses,
+                "cancelled_before_start": self.cancelled,
+                "expired": self.expired,
+                "pending": len(self._pending),
+                "wasted_tokens": self.wasted_tokens,
+                "hit_rate": self.hits / resolved if resolved else 0.0,
+            }
+
+
+speculator = Speculator()
+
+
+def with_speculation(route: str, agent: Runnable) -> Runnable:
+    """包装agent节点：推测执行命中时直接使用推测结果"""
+
+    def agent_node(state: dict, config=None):
+        result = speculator.take(state.get("speculation_id"), route)
+        if result is not None:
+            return result
+        return agent.invoke(state, config)
+
+    async def aagent_node(state: dict, config=None):
+        result = await speculator.atake(state.get("speculation_id"), route)
+        if result is not None:
+            return result
+        return await agent.ainvoke(state, config)
+
+    return RunnableLambda(agent_node, afunc=aagent_node)
@@ -0,0 +1,127 @@
+"""
+冷启动耗时报告
+
+在新的解释器中用 python -X importtime 导入指定模块（默认api），汇总:
+- 本项目各模块的导入耗时（自身耗时和包含依赖的累计耗时）
+- 累计耗时最多的第三方顶层包
+- 总的导入耗时，以及可选的首个请求前的准备耗时（构建工作流、加载所有agent）
+
+超过 --budget-ms 时以非零状态退出，可以放在CI中防止冷启动时间回退。
+单次测量受磁盘缓存等影响波动较大（同一台机器上1.3到2.1 s），默认测量3次，按导入耗时的中位数判断。
+
+使用方法:
+    python startup_report.py --budget-ms 2000 --repeat 5
+    python startup_report.py --first-request --output startup.json
+"""
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List
+
+HERE = Path(__file__).parent
+PROJECT_MODULES = {path.stem for path in HERE.glob("*.py")} | {"agents"}
+DEFAULT_BUDGET_MS = float(os.getenv("SCIAGENT_COLD_START_BUDGET_MS", "2000"))
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+# 在子进程中执行，统计导入和首个请求前的准备耗时
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+result = {{"import_ms": (time.perf_counter() - start) * 1000}}
+if {first_request}:
+    from router import get_workflow
+    from agents.registry import agent_registry
+    start = time.perf_counter()
+    get_workflow()
+    result["build_workflow_ms"] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    agent_registry.load_all()
+    result["load_agents_ms"] = (time.perf_counter() - start) * 1000
+print(json.dumps(result))
+"""
+
+
+def parse_importtime(stderr: str) -> List[dict]:
+    """解析 -X importtime 的输出，时间单位为微秒"""
+    records = []
+    for line in stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            records.append({
+                "module": match.group(4),
+                "self_us": int(match.group(1)),
+                "cumulative_us": int(match.group(2)),
+                "depth": len(match.group(3)) // 2,
+            })
+    return records
+
+
+def summarize(records: List[dict], top: int) -> Dict[str, dict]:
+    project = {}
+    packages: Dict[str, int] = {}
+    for record in records:
+        root = record["module"].split(".")[0]
+        if root in PROJECT_MODULES:
+            project[record["module"]] = {
+                "self_ms": round(record["self_us"] / 1000, 1),
+                "cumulative_ms": round(record["cumulative_us"] / 1000, 1),
+            }
+        elif root == record["module"]:
+            # 顶层包只统计第一次导入（累计耗时已包含其子模块）
+            packages.setdefault(root, record["cumulative_us"])
+    heaviest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "project_modules": dict(sorted(project.items(), key=lambda item: item[1]["cumulative_ms"], reverse=True)),
+        "third_party": {name: round(us / 1000, 1) for name, us in heaviest},
+    }
+
+
+def run_probe(module: str, first_request: bool) -> dict:
+    env = {**os.environ, "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-fake")}
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module, first_request=first_request)],
+        capture_output=True, text=True, cwd=HERE, env=env,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr[-2000:])
+    timings = json.loads(completed.stdout.strip().splitlines()[-1])
+    return {**{key: round(value, 1) for key, value in timings.items()}, **summarize(parse_importtime(completed.stderr), 15)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="冷启动耗时报告")
+    parser.add_argument("--module", default="api", help="要导入的模块")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="导入耗时的上限（毫秒）")
+    parser.add_argument("--first-request", action="store_true", help="同时统计构建工作流和加载agent的耗时")
+    parser.add_argument("--repeat", type=int, default=3, help="测量次数，报告导入耗时为中位数的那一次")
+    parser.add_argument("--output", help="结果JSON的保存路径")
+    args = parser.parse_args()
+
+    runs = sorted((run_probe(args.module, args.first_request) for _ in range(max(1, args.repeat))),
+                  key=lambda run: run["import_ms"])
+    report = {
+        "module": args.module,
+        "budget_ms": args.budget_ms,
+        "import_ms_runs": [run["import_ms"] for run in runs],
+        **runs[len(runs) // 2],
+    }
+    report["within_budget"] = report["import_ms"] <= args.budget_ms
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if not report["within_budget"]:
+        print(f"导入耗时 {report['import_ms']} ms 超过预算 {args.budget_ms} ms", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
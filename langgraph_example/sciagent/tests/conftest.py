@@ -0,0 +1,11 @@
+"""
+sciagent的单元测试
+
+模块按 sciagent 目录下的扁平结构导入（与 python api.py 的运行方式一致），不访问网络、不调用LLM。
+运行: 在仓库根目录执行 python -m pytest -q（需要 pip install pytest）
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,216 @@
+import asyncio
+
+import pytest
+
+import admission as admission_module
+from admission import AdmissionController, Overloaded, parse_weights
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_parse_weights():
+    assert parse_weights("alice=4, ip:10.0.0.8=0.5,") == {"alice": 4.0, "ip:10.0.0.8": 0.5}
+    with pytest.raises(ValueError):
+        parse_weights("bob=0")
+
+
+def test_admits_up_to_limit_then_queues():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=2, queue_size=4, queue_timeout=5, weights={})
+        first = await controller.acquire("a")
+        second = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("a"))
+        await asyncio.sleep(0)
+        assert controller.stats()["queue_depth"] == 1
+        first.release()
+        third = await waiting
+        assert controller.in_flight == 2
+        second.release()
+        third.release()
+        assert controller.in_flight == 0
+
+    run(scenario())
+
+
+def test_rejects_when_queue_full():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, queue_size=1, tenant_queue_size=1, queue_timeout=5,
+                                         weights={})
+        permit = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("a"))
+        await asyncio.sleep(0)
+        # 队列已满
+        with pytest.raises(Overloaded):
+            await controller.acquire("b")
+        permit.release()
+        (await waiting).release()
+        assert controller.rejected == 1
+
+    run(scenario())
+
+
+def test_rejects_when_tenant_queue_full():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, queue_size=10, tenant_queue_size=1, queue_timeout=5,
+                                         weights={})
+        permit = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded):
+            await controller.acquire("a")
+        # 其他租户不受影响
+        other = asyncio.ensure_future(controller.acquire("b"))
+        await asyncio.sleep(0)
+        assert controller.stats()["queue_depth"] == 2
+        permit.release()
+        # b的第一个请求排在a的第二个请求之前
+        (await other).release()
+        (await waiting).release()
+
+    run(scenario())
+
+
+async def admission_order(controller: AdmissionController, arrivals):
+    """holder占住唯一的空位，其余请求按arrivals的顺序排队，返回逐个释放时的准入顺序"""
+    order = []
+    permits = asyncio.Queue()
+
+    async def request(name):
+        permit = await controller.acquire(name.split("-")[0])
+        order.append(name)
+        await permits.put(permit)
+
+    holder = await controller.acquire("holder")
+    tasks = []
+    for name in arrivals:
+        tasks.append(asyncio.ensure_future(request(name)))
+        await asyncio.sleep(0)
+    holder.release()
+    for _ in arrivals:
+        (await permits.get()).release()
+    await asyncio.gather(*tasks)
+    return order
+
+
+def test_fair_queuing_interleaves_tenants():
+    controller = AdmissionController(max_in_flight=1, queue_size=10, tenant_queue_size=10, queue_timeout=5,
+                                     weights={})
+    order = run(admission_order(controller, ["a-1", "a-2", "a-3", "b-1"]))
+    # b到达得最晚，但只排在a的第一个请求之后
+    assert order == ["a-1", "b-1", "a-2", "a-3"]
+
+
+def test_weighted_fair_queuing():
+    controller = AdmissionController(max_in_flight=1, queue_size=10, tenant_queue_size=10, queue_timeout=5,
+                                     weights={"b": 2})
+    order = run(admission_order(controller, ["a-1", "a-2", "b-1", "b-2", "b-3", "b-4"]))
+    # 权重为2的b每轮得到两个空位
+    assert order == ["b-1", "a-1", "b-2", "b-3", "a-2", "b-4"]
+
+
+def test_queue_timeout():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, queue_size=4, queue_timeout=0.01, weights={})
+        permit = await controller.acquire("a")
+        with pytest.raises(Overloaded):
+            await controller.acquire("b")
+        stats = controller.stats()
+        assert (stats["queue_depth"], stats["timed_out"]) == (0, 1)
+        permit.release()
+        assert controller.in_flight == 0
+
+    run(scenario())
+
+
+def test_timeout_after_slot_handed_over(monkeypatch):
+    """超时与_release转交空位同时发生：空位交给下一个请求，计数不重复减少"""
+
+    async def wait_then_timeout(future, timeout):
+        await asyncio.shield(future)
+        raise asyncio.TimeoutError()
+
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, queue_size=4, queue_timeout=5, weights={})
+        permit = await controller.acquire("a")
+        monkeypatch.setattr(admission_module.asyncio, "wait_for", wait_then_timeout)
+        waiting = asyncio.ensure_future(controller.acquire("b"))
+        await asyncio.sleep(0)
+        permit.release()
+        with pytest.raises(Overloaded):
+            await waiting
+        monkeypatch.undo()
+        assert controller.in_flight == 0
+        assert controller.stats()["queue_depth"] == 0
+        assert controller._tenants["b"].queued == 0
+        # 空位没有泄漏
+        (await controller.acquire("c")).release()
+        assert controller.in_flight == 0
+
+    run(scenario())
+
+
+def test_cancel_after_slot_handed_over():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, queue_size=4, queue_timeout=5, weights={})
+        permit = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("b"))
+        queued = asyncio.ensure_future(controller.acquire("c"))
+        await asyncio.sleep(0)
+        # 空位已经转交给b，b在恢复执行之前被取消，空位应转交给c
+        permit.release()
+        waiting.cancel()
+        try:
+            # Python 3.11的wait_for在future已经完成时会吞掉取消并返回结果
+            (await waiting).release()
+        except asyncio.CancelledError:
+            pass
+        (await queued).release()
+        assert controller.in_flight == 0
+        assert controller.stats()["queue_depth"] == 0
+        assert controller._tenants["b"].queued == 0
+
+    run(scenario())
+
+
+def test_cancel_while_queued():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, queue_size=4, queue_timeout=5, weights={})
+        permit = await controller.acquire("a")
+        waiting = asyncio.ensure_future(controller.acquire("b"))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert controller.stats()["queue_depth"] == 0
+        permit.release()
+        assert controller.in_flight == 0
+
+    run(scenario())
+
+
+def test_disabled_controller_keeps_in_flight_at_zero():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=0)
+        permits = [await controller.acquire("a") for _ in range(3)]
+        for permit in permits:
+            permit.release()
+        permits[0].release()
+        assert controller.stats()["in_flight"] == 0
+        assert controller.admitted == 3
+
+    run(scenario())
+
+
+def test_cancelled_request_is_not_a_latency_sample():
+    async def scenario():
+        controller = AdmissionController(max_in_flight=2, weights={})
+        permit = await controller.acquire("a")
+        permit.release(asyncio.CancelledError())
+        assert controller.latency_ewma is None
+        permit = await controller.acquire("a")
+        permit.release()
+        assert controller.latency_ewma is not None
+
+    run(scenario())
@@ -0,0 +1,58 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import api
+import resilience
+from resilience import DeadlineExceeded
+
+
+@pytest.fixture
+def slow_workflow(monkeypatch):
+    """0.3秒完成的工作流，超过状态中的截止时间时抛出DeadlineExceeded"""
+    calls = []
+
+    async def run_workflow(inputs, user_id=None, timings=None):
+        calls.append(inputs["deadline"])
+        finish = time.time() + 0.3
+        await asyncio.sleep(max(0.0, min(finish, inputs["deadline"]) - time.time()))
+        if time.time() < finish:
+            raise DeadlineExceeded("请求已超过截止时间")
+        return {"output": "回答", "decision": "chat"}
+
+    monkeypatch.setattr(api, "run_workflow", run_workflow)
+    monkeypatch.setattr(resilience, "MIN_TIMEOUT", 0.05)
+    return calls
+
+
+def post(client, timeout=None):
+    headers = {"X-Request-Timeout": timeout} if timeout else {}
+    return client.post("/api/query", json={"query": "相同的问题"}, headers=headers)
+
+
+def test_short_timeout_does_not_fail_identical_requests(slow_workflow):
+    async def main():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            short = asyncio.create_task(post(client, "0.1"))
+            await asyncio.sleep(0.01)
+            default = asyncio.create_task(post(client))
+            return await short, await default
+
+    short, default = asyncio.run(main())
+    assert short.status_code == 504
+    assert default.status_code == 200
+    assert len(slow_workflow) == 2
+
+
+def test_identical_timeouts_are_coalesced(slow_workflow):
+    async def main():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(post(client, "5"), post(client, "5"))
+
+    responses = asyncio.run(main())
+    assert [response.status_code for response in responses] == [200, 200]
+    assert len(slow_workflow) == 1
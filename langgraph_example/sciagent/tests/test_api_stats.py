@@ -0,0 +1,29 @@
+import asyncio
+import sys
+
+import httpx
+
+import api
+
+
+def get_stats():
+    async def main():
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return (await client.get("/api/stats")).json()
+
+    return asyncio.run(main())
+
+
+def test_stats_do_not_import_llm_client(monkeypatch):
+    monkeypatch.delitem(sys.modules, "llm_client", raising=False)
+    stats = get_stats()
+    assert stats["llm_pool"] == "未初始化"
+    assert stats["cancellation"]["llm_calls"] == "未初始化"
+    assert "llm_client" not in sys.modules
+
+
+def test_stats_report_the_pool_once_llm_client_is_imported():
+    import llm_client  # noqa: F401
+    stats = get_stats()
+    assert stats["llm_pool"]["max_connections"] == llm_client.MAX_CONNECTIONS
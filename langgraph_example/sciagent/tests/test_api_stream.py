@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+from sse_starlette.sse import AppStatus
+
+from admission import AdmissionController
+from api import PermitEventSourceResponse
+
+
+@pytest.fixture(autouse=True)
+def reset_app_status():
+    # sse_starlette的退出事件绑定在第一次使用它的事件循环上，每个测试使用新的事件循环
+    AppStatus.should_exit_event = None
+
+
+async def events(started: list):
+    started.append(True)
+    yield {"event": "response", "data": "{}"}
+
+
+def run_response(send, receive):
+    """用给定的send/receive执行一个事件流响应，返回 (准入控制器, 生成器是否开始迭代)"""
+    async def scenario():
+        controller = AdmissionController(max_in_flight=1, weights={})
+        permit = await controller.acquire("a")
+        started = []
+        response = PermitEventSourceResponse(events(started), permit, sep="\n")
+        try:
+            await response({"type": "http"}, receive, send)
+        except Exception:
+            # 发送失败时task group抛出ExceptionGroup
+            pass
+        return controller, started
+
+    return asyncio.run(scenario())
+
+
+def test_permit_released_when_client_disconnects_before_first_send():
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        # 响应头一直发送不出去，生成器还没有开始迭代客户端就断开了
+        await asyncio.sleep(10)
+
+    controller, started = run_response(send, receive)
+    assert not started
+    assert controller.in_flight == 0
+    assert controller.latency_ewma is None
+
+
+def test_permit_released_when_response_setup_fails():
+    async def receive():
+        await asyncio.sleep(10)
+
+    async def send(message):
+        raise RuntimeError("连接已关闭")
+
+    controller, started = run_response(send, receive)
+    assert not started
+    assert controller.in_flight == 0
+
+
+def test_permit_released_after_stream_completes():
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(10)
+
+    async def send(message):
+        sent.append(message)
+
+    controller, started = run_response(send, receive)
+    assert started
+    assert controller.in_flight == 0
+    assert any(message.get("body", b"").startswith(b"event: response") for message in sent)
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from agents.cascade import Cascade, parse_confidence, parse_score
+from fake_llm import FakeChatModel
+from langchain_core.messages import HumanMessage, SystemMessage
+
+
+@pytest.mark.parametrize("content, answer, confidence", [
+    ("回答。\n置信度: 0.9", "回答。", 0.9),
+    ("回答。\n置信度：0.85", "回答。", 0.85),
+    ("回答。\n**置信度**：0.8", "回答。", 0.8),
+    ("回答。\n**置信度：0.8**", "回答。", 0.8),
+    ("回答。\n（置信度：0.75）", "回答。", 0.75),
+    ("回答。\n置信度: 85%", "回答。", 0.85),
+    ("回答。\n置信度: 0.6。", "回答。", 0.6),
+    ("Answer.\nConfidence: .7\n", "Answer.", 0.7),
+    ("Answer.\nconfidence 1", "Answer.", 1.0),
+])
+def test_parse_confidence(content, answer, confidence):
+    assert parse_confidence(content) == (answer, pytest.approx(confidence))
+
+
+@pytest.mark.parametrize("content", [
+    "回答，没有置信度",
+    "置信度: 0.9\n之后还有正文",
+    "回答。\n置信度: 7",
+    "回答。\n置信度: 120%",
+])
+def test_parse_confidence_missing_or_invalid(content):
+    _, confidence = parse_confidence(content)
+    assert confidence is None
+
+
+def test_parse_score():
+    assert parse_score("0.8") == 0.8
+    assert parse_score("评分：90%") == pytest.approx(0.9)
+    assert parse_score("8") is None
+    assert parse_score("无法评估") is None
+
+
+class CountingModel(FakeChatModel):
+    calls: int = 0
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        return super()._generate(messages, stop, run_manager, **kwargs)
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        return await super()._agenerate(messages, stop, run_manager, **kwargs)
+
+
+MESSAGES = [SystemMessage(content="系统提示"), HumanMessage(content="问题")]
+
+
+def make(small_response: str, latency: float = 0.0):
+    small = CountingModel(response=small_response, latency=latency)
+    large = CountingModel(response="大模型的回答", latency=latency)
+    return Cascade("test", threshold=0.7, llm=small), small, large
+
+
+def test_accepts_confident_small_answer():
+    cascade, small, large = make("小模型的回答\n置信度: 0.9")
+    result = cascade.run(large, MESSAGES)
+    assert result["output"] == "小模型的回答"
+    assert result["escalated"] is False
+    assert (small.calls, large.calls) == (1, 0)
+    assert cascade.stats()["accepted"] == 1
+
+
+def test_escalates_low_or_missing_confidence():
+    for response in ("小模型的回答\n置信度: 0.3", "小模型的回答"):
+        cascade, small, large = make(response)
+        result = cascade.run(large, MESSAGES)
+        assert result["output"] == "大模型的回答"
+        assert result["escalated"] is True
+        assert (small.calls, large.calls) == (1, 1)
+        # 用量为两次调用之和
+        assert result["usage"]["output_tokens"] == 40
+    assert cascade.stats()["unscored"] == 1
+
+
+def test_escalation_latency_is_small_plus_large():
+    cascade, small, large = make("小模型的回答\n置信度: 0.2", latency=0.05)
+    result = asyncio.run(cascade.arun(large, MESSAGES))
+    assert result["output"] == "大模型的回答"
+    stats = cascade.stats()
+    assert stats["escalations"] == 1
+    assert stats["avg_small_ms"] >= 50
+    assert stats["avg_large_ms"] >= 50
+    # 全部升级时级联只会更慢
+    assert stats["latency_saved_ms"] < 0
+
+
+def test_judge_verifier_scores_separately():
+    small = CountingModel(response="0.9", latency=0.0)
+    large = CountingModel(response="大模型的回答", latency=0.0)
+    cascade = Cascade("judge", verifier="judge", llm=small)
+    result = cascade.run(large, MESSAGES)
+    assert result["output"] == "0.9"
+    assert (small.calls, large.calls) == (2, 0)
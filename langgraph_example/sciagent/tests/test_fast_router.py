@@ -0,0 +1,41 @@
+import json
+import threading
+
+import pytest
+
+import fast_router
+import jsonl_log
+from fast_router import FastRouter
+
+
+def test_train_without_samples_raises_a_clear_error():
+    with pytest.raises(ValueError, match="没有训练样本"):
+        FastRouter.train([])
+
+
+def test_log_decision_is_written_by_the_background_thread(tmp_path, monkeypatch):
+    path = tmp_path / "route_log.jsonl"
+    monkeypatch.setattr(fast_router, "ROUTE_LOG_PATH", str(path))
+    writers = []
+    real_open = open
+
+    def recording_open(file, *args, **kwargs):
+        if str(file) == str(path):
+            writers.append(threading.current_thread().name)
+        return real_open(file, *args, **kwargs)
+
+    monkeypatch.setattr("builtins.open", recording_open)
+    fast_router.log_decision("RNA-seq差异表达分析", "bioinformatics")
+    fast_router.log_decision("你好", "chat")
+    jsonl_log.flush()
+
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [(r["query"], r["decision"]) for r in records] == [
+        ("RNA-seq差异表达分析", "bioinformatics"), ("你好", "chat")]
+    assert writers and set(writers) == {"jsonl-log"}
+
+
+def test_log_decision_is_disabled_without_a_path(monkeypatch):
+    monkeypatch.setattr(fast_router, "ROUTE_LOG_PATH", None)
+    monkeypatch.setattr(jsonl_log, "append", lambda *args: pytest.fail("不应写入"))
+    fast_router.log_decision("你好", "chat")
@@ -0,0 +1,70 @@
+import asyncio
+
+import httpx
+import pytest
+
+import hedging
+from hedging import HedgingTransport
+from resilience import caller_scope
+
+BASE_URL = "http://llm.test/v1"
+
+
+class SlowTransport(httpx.AsyncBaseTransport):
+    """按顺序使用给定的延迟返回响应"""
+
+    def __init__(self, *latencies: float):
+        self.latencies = list(latencies)
+        self.started = 0
+
+    async def handle_async_request(self, request):
+        latency = self.latencies[self.started]
+        self.started += 1
+        await asyncio.sleep(latency)
+        return httpx.Response(200, json={"latency": latency})
+
+
+def request(model: str = "gpt-4o") -> httpx.Request:
+    return httpx.Request("POST", f"{BASE_URL}/chat/completions", json={"model": model})
+
+
+@pytest.fixture(autouse=True)
+def few_samples(monkeypatch):
+    monkeypatch.setattr(hedging, "MIN_SAMPLES", 3)
+    monkeypatch.setattr(hedging, "MIN_DELAY", 0.01)
+
+
+def test_latency_is_tracked_per_caller():
+    transport = HedgingTransport(SlowTransport(*[0.0] * 4), BASE_URL)
+
+    async def main():
+        with caller_scope("router"):
+            for _ in range(3):
+                await transport.handle_async_request(request())
+        with caller_scope("deep_research"):
+            await transport.handle_async_request(request())
+
+    asyncio.run(main())
+    thresholds = transport.stats()["thresholds"]
+    assert thresholds["router/gpt-4o"]["samples"] == 3
+    assert thresholds["router/gpt-4o"]["threshold_ms"] is not None
+    # 其他agent的样本不足，不会使用路由器的阈值
+    assert thresholds["deep_research/gpt-4o"] == {"samples": 1, "threshold_ms": None}
+
+
+def test_primary_latency_is_recorded_when_hedge_wins():
+    slow = SlowTransport(1.0, 0.05)
+    transport = HedgingTransport(slow, BASE_URL)
+    window = transport._window((None, "gpt-4o", False))
+    for _ in range(3):
+        window.add(0.05)
+
+    async def main():
+        return await transport.handle_async_request(request())
+
+    response = asyncio.run(main())
+    assert response.json() == {"latency": 0.05}
+    assert transport.stats()["hedges_won"] == 1
+    # 记录的是原请求已等待的时间（约0.1秒），不是对冲请求的0.05秒
+    assert len(window.samples) == 4
+    assert window.samples[-1] >= 0.09
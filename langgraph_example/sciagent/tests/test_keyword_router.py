@@ -0,0 +1,90 @@
+import json
+import logging
+
+import pytest
+
+import jsonl_log
+import keyword_router
+from keyword_router import AhoCorasick, KeywordRouter
+
+ROUTES = {
+    "bioinformatics": {"DESeq2": 3, "RNA-seq": 2, "GO": 1},
+    "literature": {"文献": 2, "综述": 2},
+    "chat": {"你好": 3},
+}
+
+
+@pytest.fixture
+def router():
+    return KeywordRouter(ROUTES, min_score=3, min_margin=2)
+
+
+def test_aho_corasick_finds_overlapping_patterns():
+    automaton = AhoCorasick(["he", "she", "his", "hers"])
+    matches = {(automaton.patterns[index], end) for index, end in automaton.search("ushers")}
+    assert matches == {("she", 3), ("he", 3), ("hers", 5)}
+
+
+def test_match_scores_each_term_once(router):
+    result = router.match("用DESeq2分析RNA-seq数据，DESeq2的参数怎么设")
+    assert result.scores == {"bioinformatics": 5}
+    assert result.route == "bioinformatics"
+
+
+def test_english_terms_need_word_boundaries(router):
+    assert router.match("good morning").scores == {}
+    assert router.match("做GO富集").scores == {"bioinformatics": 1}
+
+
+def test_close_scores_are_ambiguous(router):
+    result = router.match("DESeq2相关的文献综述")
+    assert result.scores == {"bioinformatics": 3, "literature": 4}
+    assert result.best == "literature"
+    assert result.route is None
+
+
+def test_route_counts_hits_misses_and_ambiguous(router):
+    assert router.route("你好") == "chat"
+    assert router.route("今天吃什么") is None
+    assert router.route("DESeq2相关的文献综述") is None
+    stats = router.stats()
+    assert (stats["hits"], stats["misses"], stats["ambiguous"]) == (1, 1, 1)
+
+
+def test_shadow_mode_only_records(router, monkeypatch):
+    monkeypatch.setattr(keyword_router, "SHADOW", True)
+    assert router.route("你好") is None
+    assert router.stats()["hits"] == 1
+
+
+def test_logs_do_not_contain_the_query(router, caplog):
+    query = "患者张三的测序结果"
+    with caplog.at_level(logging.DEBUG, logger="keyword_router"):
+        router.route(query)
+        router.check("DESeq2的文献综述", "chat")
+    assert [record.levelno for record in caplog.records] == [logging.DEBUG, logging.WARNING]
+    assert query not in caplog.text
+    assert "DESeq2的文献综述" not in caplog.text
+    assert f"{len(query)}字符" in caplog.text
+
+
+def test_rules_log_goes_through_the_shared_writer(router, tmp_path, monkeypatch):
+    path = tmp_path / "rules_log.jsonl"
+    monkeypatch.setattr(keyword_router, "RULES_LOG_PATH", str(path))
+    appended = []
+    real_append = jsonl_log.append
+
+    def append(log_path, record):
+        appended.append(log_path)
+        real_append(log_path, record)
+
+    monkeypatch.setattr(jsonl_log, "append", append)
+
+    router.route("今天吃什么")
+    router.check("DESeq2的文献综述", "chat")
+    jsonl_log.flush()
+
+    assert appended == [str(path), str(path)]
+    records = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [(r["kind"], r["query"], r["llm_decision"]) for r in records] == [
+        ("miss", "今天吃什么", None), ("conflict", "DESeq2的文献综述", "chat")]
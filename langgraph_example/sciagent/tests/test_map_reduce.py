@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from agents import map_reduce
+from agents.map_reduce import MapReduce, split_text
+from fake_llm import FakeChatModel
+
+
+@pytest.fixture(autouse=True)
+def char_tokens(monkeypatch):
+    # 每个字符计1个token，结果不依赖tiktoken的编码文件
+    monkeypatch.setattr(map_reduce, "count_tokens", len)
+
+
+def lines(count: int, width: int = 9) -> str:
+    return "".join(f"{index:0{width}d}\n" for index in range(count))
+
+
+def test_chunks_respect_size_and_overlap():
+    text = lines(20)  # 每行10个token
+    chunks = split_text(text, chunk_tokens=50, overlap_tokens=20)
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    # 相邻片段重叠上一段的最后两行
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.startswith(previous[-20:])
+    # 所有行都出现，且在行边界处切分
+    assert set("".join(chunks).splitlines()) == set(text.splitlines())
+    assert all(chunk.endswith("\n") for chunk in chunks)
+
+
+def test_short_text_is_one_chunk():
+    text = lines(3)
+    assert split_text(text, chunk_tokens=50, overlap_tokens=20) == [text]
+
+
+def test_long_lines_are_split_by_characters():
+    text = "x" * 120
+    chunks = split_text(text, chunk_tokens=50, overlap_tokens=0)
+    assert all(len(chunk) <= 50 for chunk in chunks)
+    assert "".join(chunks) == text
+
+
+def test_applies_above_threshold():
+    reducer = MapReduce(threshold=100)
+    assert not reducer.applies("x" * 100)
+    assert reducer.applies("x" * 101)
+
+
+def test_arun_maps_each_chunk_then_reduces():
+    reducer = MapReduce(threshold=10, chunk_tokens=50, overlap_tokens=0, max_concurrency=2)
+    llm = FakeChatModel(response="要点", latency=0.0)
+    result = asyncio.run(reducer.arun(llm, "系统提示", lines(20), []))
+    report = result["long_input"]
+    assert report["chunks"] == 4
+    assert result["output"] == "要点"
+    # 4次map调用加1次reduce调用
+    assert result["usage"]["total_tokens"] == 5 * 70
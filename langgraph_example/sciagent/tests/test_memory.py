@@ -0,0 +1,106 @@
+import asyncio
+from typing import List, Optional
+
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import END, START, StateGraph
+from typing_extensions import TypedDict
+
+import memory
+from checkpointer import BoundedMemorySaver
+from fake_llm import FakeChatModel
+from memory import compact, history_messages, thread_config, update_memory
+
+
+class State(TypedDict):
+    input: str
+    output: str
+    decision: str
+    history: List[dict]
+    summary: str
+    usage: Optional[dict]
+    turn_tokens: Optional[dict]
+
+
+def answer(state: State):
+    return {"output": f"回答{state['input']}", "decision": "chat"}
+
+
+def build():
+    builder = StateGraph(State)
+    builder.add_node("agent", answer)
+    builder.add_node("update_memory", RunnableLambda(memory.update_memory, afunc=memory.aupdate_memory))
+    builder.add_edge(START, "agent")
+    builder.add_edge("agent", "update_memory")
+    builder.add_edge("update_memory", END)
+    return builder.compile(checkpointer=BoundedMemorySaver())
+
+
+def turn(i: int) -> dict:
+    return {"user": f"问题{i}", "assistant": f"回答{i}", "tokens": {"turn": 10}}
+
+
+def test_update_memory_does_not_call_llm(monkeypatch):
+    def fail():
+        raise AssertionError("更新记忆时不应调用LLM")
+
+    monkeypatch.setattr(memory, "get_summary_llm", fail)
+    history = [turn(i) for i in range(memory.MAX_TURNS)]
+    update = update_memory({"input": "新问题", "output": "新回答", "history": history, "decision": "chat"})
+    assert len(update["history"]) == memory.MAX_TURNS + 1
+    assert "summary" not in update
+
+
+def test_update_memory_caps_history_when_summaries_fail():
+    history = [turn(i) for i in range(2 * memory.MAX_TURNS)]
+    update = update_memory({"input": "新问题", "output": "新回答", "history": history, "decision": "chat"})
+    assert len(update["history"]) == 2 * memory.MAX_TURNS
+    assert update["history"][-1]["user"] == "新问题"
+
+
+def test_history_messages_respects_token_budget():
+    history = [turn(i) for i in range(5)]
+    messages = history_messages({"history": history, "summary": ""}, max_tokens=25)
+    # 每轮10个token，只放得下最近两轮
+    assert [message.content for message in messages] == ["问题3", "回答3", "问题4", "回答4"]
+
+
+def test_compaction_runs_after_turn(monkeypatch):
+    monkeypatch.setattr(memory, "summary_llm", FakeChatModel(response="摘要", latency=0))
+
+    async def scenario():
+        workflow = build()
+        user_id = "compaction-user"
+        for i in range(memory.MAX_TURNS + 2):
+            state = await workflow.ainvoke({"input": f"问题{i}"}, thread_config(user_id))
+        assert len(state["history"]) == memory.MAX_TURNS + 2
+        await compact(workflow, user_id)
+        values = (await workflow.aget_state(thread_config(user_id))).values
+        assert values["summary"] == "摘要"
+        assert [item["user"] for item in values["history"]] == [f"问题{i}" for i in range(2, memory.MAX_TURNS + 2)]
+        # 下一轮在摘要和保留的历史之上继续
+        state = await workflow.ainvoke({"input": "下一轮"}, thread_config(user_id))
+        assert state["summary"] == "摘要"
+        assert len(state["history"]) == memory.MAX_TURNS + 1
+
+    asyncio.run(scenario())
+
+
+def test_schedule_compaction_in_background(monkeypatch):
+    monkeypatch.setattr(memory, "summary_llm", FakeChatModel(response="后台摘要", latency=0.01))
+
+    async def scenario():
+        workflow = build()
+        user_id = "background-user"
+        for i in range(memory.MAX_TURNS + 1):
+            state = await workflow.ainvoke({"input": f"问题{i}"}, thread_config(user_id))
+        memory.schedule_compaction(workflow, user_id, state["history"])
+        assert memory._compactions
+        # 下一轮等待摘要完成（同一用户的锁）
+        async with memory.user_lock(user_id):
+            pass
+        await asyncio.gather(*memory._compactions)
+        values = (await workflow.aget_state(thread_config(user_id))).values
+        assert values["summary"] == "后台摘要"
+        assert len(values["history"]) == memory.MAX_TURNS
+
+    asyncio.run(scenario())
@@ -0,0 +1,208 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+from langchain_core.runnables import RunnableLambda
+
+from llm_client import AsyncRetryTransport, RetryTransport
+from resilience import CircuitBreaker, CircuitOpen, DeadlineExceeded, deadline_scope, with_breaker
+
+
+def test_breaker_opens_after_failure_rate():
+    breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=4, cooldown=60)
+    for success in (True, False, True):
+        breaker.record(success)
+    assert breaker.state == "closed"
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_breaker_half_open_allows_one_probe():
+    breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=1, cooldown=0)
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=1, cooldown=0)
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+
+
+def test_breaker_released_probe_is_not_counted():
+    breaker = CircuitBreaker("test", failure_rate=0.5, min_calls=1, cooldown=0)
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.allow()
+    assert breaker.calls == 1
+
+
+def failing(error: Exception) -> RunnableLambda:
+    def run(state, config=None):
+        raise error
+
+    async def arun(state, config=None):
+        raise error
+
+    return RunnableLambda(run, afunc=arun)
+
+
+def guarded(route: str, error: Exception):
+    from resilience import breaker
+    return with_breaker(route, failing(error)), breaker(route)
+
+
+def test_with_breaker_counts_upstream_failures():
+    agent, breaker = guarded("upstream_failure", RuntimeError("500"))
+    with pytest.raises(RuntimeError):
+        agent.invoke({"input": "x"})
+    assert breaker.failures == 1
+
+
+def test_with_breaker_ignores_deadline_failures():
+    # 调用方自己的截止时间导致的失败（包括被OpenAI客户端包装后的DeadlineExceeded）不计入熔断器
+    wrapped = ConnectionError("Connection error.")
+    wrapped.__cause__ = DeadlineExceeded("请求已超过截止时间")
+    for error in (DeadlineExceeded("请求已超过截止时间"), wrapped):
+        agent, breaker = guarded(f"deadline_{id(error)}", error)
+        with pytest.raises(type(error)):
+            agent.invoke({"input": "x"})
+        with pytest.raises(type(error)):
+            asyncio.run(agent.ainvoke({"input": "x"}))
+        assert breaker.calls == 0
+
+
+def test_with_breaker_ignores_failures_after_deadline():
+    agent, breaker = guarded("expired", httpx.ReadTimeout("timed out"))
+    with pytest.raises(httpx.ReadTimeout):
+        agent.invoke({"input": "x", "deadline": time.time() - 1})
+    assert breaker.calls == 0
+
+
+def test_with_breaker_open_without_fallback():
+    agent, breaker = guarded("no_fallback", RuntimeError("500"))
+    breaker.min_calls = 1
+    with pytest.raises(RuntimeError):
+        agent.invoke({"input": "x"})
+    with pytest.raises(CircuitOpen):
+        agent.invoke({"input": "x"})
+
+
+def timeout_handler(request: httpx.Request):
+    raise httpx.ReadTimeout("timed out", request=request)
+
+
+def test_clamped_timeout_raises_deadline_exceeded():
+    transport = RetryTransport(httpx.MockTransport(timeout_handler), max_retries=2, backoff=0)
+    request = httpx.Request("POST", "http://llm/v1/chat/completions",
+                            extensions={"timeout": {"connect": 5, "read": 60, "write": 60, "pool": 10}})
+    with deadline_scope(time.time() + 1):
+        with pytest.raises(DeadlineExceeded):
+            transport.handle_request(request)
+    assert request.extensions["timeout"]["read"] <= 1
+    stats = transport.policy.stats.snapshot()
+    assert stats["deadline_exceeded"] == 1
+    assert stats["retries"] == 0
+
+
+def test_unclamped_timeout_is_retried():
+    transport = AsyncRetryTransport(httpx.MockTransport(timeout_handler), max_retries=2, backoff=0)
+    request = httpx.Request("POST", "http://llm/v1/chat/completions",
+                            extensions={"timeout": {"connect": 5, "read": 60, "write": 60, "pool": 10}})
+    with pytest.raises(httpx.ReadTimeout):
+        asyncio.run(transport.handle_async_request(request))
+    stats = transport.policy.stats.snapshot()
+    assert (stats["retries"], stats["gave_up"], stats["deadline_exceeded"]) == (2, 1, 0)
+
+
+def connect_timeout_handler(request: httpx.Request):
+    raise httpx.ConnectTimeout("connect timed out", request=request)
+
+
+def test_upstream_timeout_with_time_left_is_retried():
+    # 默认设置下读超时（60秒）总会被截止时间略微缩短，但5秒的连接超时与截止时间无关
+    transport = AsyncRetryTransport(httpx.MockTransport(connect_timeout_handler), max_retries=2, backoff=0)
+    request = httpx.Request("POST", "http://llm/v1/chat/completions",
+                            extensions={"timeout": {"connect": 5, "read": 60, "write": 60, "pool": 10}})
+
+    async def main():
+        with deadline_scope(time.time() + 60):
+            await transport.handle_async_request(request)
+
+    with pytest.raises(httpx.ConnectTimeout):
+        asyncio.run(main())
+    stats = transport.policy.stats.snapshot()
+    assert (stats["retries"], stats["gave_up"], stats["deadline_exceeded"]) == (2, 1, 0)
+
+
+def test_timeout_after_deadline_passed_raises_deadline_exceeded():
+    def handler(request: httpx.Request):
+        time.sleep(0.05)
+        raise httpx.ConnectTimeout("connect timed out", request=request)
+
+    transport = RetryTransport(httpx.MockTransport(handler), max_retries=2, backoff=0)
+    request = httpx.Request("POST", "http://llm/v1/chat/completions",
+                            extensions={"timeout": {"connect": 5, "read": 60, "write": 60, "pool": 10}})
+    with deadline_scope(time.time() + 0.02):
+        with pytest.raises(DeadlineExceeded):
+            transport.handle_request(request)
+
+
+def test_with_breaker_counts_upstream_timeouts():
+    agent, breaker = guarded("upstream_timeout", httpx.ConnectTimeout("connect timed out"))
+    with deadline_scope(time.time() + 60):
+        with pytest.raises(httpx.ConnectTimeout):
+            agent.invoke({"input": "x", "deadline": time.time() + 60})
+    assert breaker.failures == 1
+
+
+def test_retry_on_status_then_success():
+    responses = iter([503, 200])
+    transport = RetryTransport(httpx.MockTransport(lambda request: httpx.Response(next(responses))),
+                               max_retries=2, backoff=0)
+    response = transport.handle_request(httpx.Request("POST", "http://llm/v1/chat/completions"))
+    assert response.status_code == 200
+    assert transport.policy.stats.retries == 1
+
+
+def status_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "http://llm/v1/chat/completions")
+    return httpx.HTTPStatusError(f"{status}", request=request, response=httpx.Response(status, request=request))
+
+
+@pytest.mark.parametrize("status, counted", [(400, False), (401, False), (413, False),
+                                             (429, True), (500, True), (503, True)])
+def test_with_breaker_counts_only_upstream_status_errors(status, counted):
+    agent, breaker = guarded(f"status_{status}", status_error(status))
+    with pytest.raises(httpx.HTTPStatusError):
+        agent.invoke({"input": "x"})
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(agent.ainvoke({"input": "x"}))
+    assert breaker.failures == (2 if counted else 0)
+
+
+def test_with_breaker_ignores_wrapped_client_errors():
+    # OpenAI客户端的APIStatusError带status_code
+    class BadRequestError(Exception):
+        status_code = 400
+
+    wrapped = RuntimeError("agent失败")
+    wrapped.__cause__ = BadRequestError("context_length_exceeded")
+    agent, breaker = guarded("wrapped_400", wrapped)
+    breaker.min_calls = 1
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            agent.invoke({"input": "x"})
+    assert (breaker.calls, breaker.state) == (0, "closed")
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+
+import route_cache
+import router
+from route_cache import RouteCache, normalize_query
+
+
+@pytest.mark.parametrize("a, b", [
+    ("运行 DESeq2？", "运行DESeq2"),
+    ("ＤＥＳｅｑ２ 分析", "deseq2分析"),
+    ("How  to run DESeq2?", "how to run deseq2"),
+])
+def test_normalize_query(a, b):
+    assert normalize_query(a) == normalize_query(b)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(route_cache.time, "time", clock.time)
+    return clock
+
+
+def test_lru_eviction(clock):
+    cache = RouteCache(max_size=2)
+    cache.put("a", "chat")
+    cache.put("b", "literature")
+    assert cache.get("a") == "chat"
+    cache.put("c", "bioinformatics")
+    assert cache.get("b") is None
+    assert cache.get("a") == "chat"
+    assert cache.get("c") == "bioinformatics"
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ttl_expiry(clock):
+    cache = RouteCache(ttl=60)
+    cache.put("问题", "chat")
+    clock.now += 59
+    assert cache.get("问题") == "chat"
+    clock.now += 1
+    assert cache.get("问题") is None
+    stats = cache.stats()
+    assert (stats["expirations"], stats["size"]) == (1, 0)
+
+
+def test_disabled_cache():
+    cache = RouteCache(max_size=0)
+    cache.put("问题", "chat")
+    assert cache.get("问题") is None
+
+
+def test_sqlite_persistence(tmp_path):
+    path = str(tmp_path / "routes.db")
+    cache = RouteCache(max_size=2, db_path=path)
+    cache.put("a", "chat")
+    cache.put("b", "literature")
+    cache.put("c", "bioinformatics")
+    cache.flush()
+
+    reloaded = RouteCache(max_size=2, db_path=path)
+    assert reloaded.get("a") is None
+    assert reloaded.get("b") == "literature"
+    assert reloaded.get("c") == "bioinformatics"
+
+
+def test_sqlite_writes_run_off_the_calling_thread(tmp_path, monkeypatch):
+    cache = RouteCache(db_path=str(tmp_path / "routes.db"))
+    threads = []
+    write_pending = cache._write_pending
+
+    def record():
+        threads.append(threading.current_thread())
+        write_pending()
+
+    monkeypatch.setattr(cache, "_write_pending", record)
+    cache.put("a", "chat")
+    cache.flush()
+    assert threads and threading.current_thread() not in threads
+
+
+def test_fast_router_decisions_are_not_cached(monkeypatch):
+    cache = RouteCache()
+    monkeypatch.setattr(router, "route_cache", cache)
+    monkeypatch.setattr(router, "keyword_router", None)
+    monkeypatch.setattr(router, "fast_route", lambda query: "chat")
+    assert router.local_decision({"input": "你好"}) == "chat"
+    assert cache.stats()["size"] == 0
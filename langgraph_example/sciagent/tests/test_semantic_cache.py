@@ -0,0 +1,137 @@
+import numpy as np
+import pytest
+from langchain_core.callbacks import BaseCallbackHandler
+
+from agents import base_agent, semantic_cache
+from agents.cascade import Cascade
+from agents.semantic_cache import SemanticCache
+from fake_llm import FakeChatModel
+
+
+def unit(*values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(semantic_cache.time, "time", clock.time)
+    return clock
+
+
+def test_lookup_uses_threshold(clock):
+    cache = SemanticCache("test", threshold=0.95)
+    assert cache.lookup(unit(1, 0)) is None
+    cache.store(unit(1, 0), "回答")
+    # cos = 0.98
+    assert cache.lookup(unit(0.98, 0.199)) == "回答"
+    # cos = 0.9，低于阈值
+    assert cache.lookup(unit(0.9, 0.436)) is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 1)
+
+
+def test_similar_entry_is_overwritten(clock):
+    cache = SemanticCache("test", threshold=0.95)
+    cache.store(unit(1, 0), "旧回答")
+    cache.store(unit(0.99, 0.141), "新回答")
+    assert cache.stats()["size"] == 1
+    assert cache.lookup(unit(1, 0)) == "新回答"
+
+
+def test_expired_entries_miss(clock):
+    cache = SemanticCache("test", ttl=60)
+    cache.store(unit(1, 0), "回答")
+    clock.now += 59
+    assert cache.lookup(unit(1, 0)) == "回答"
+    clock.now += 1
+    assert cache.lookup(unit(1, 0)) is None
+
+
+def test_full_cache_replaces_expired_then_least_recently_used(clock):
+    cache = SemanticCache("test", ttl=100, max_size=2)
+    cache.store(unit(1, 0, 0), "a")
+    clock.now += 50
+    cache.store(unit(0, 1, 0), "b")
+    clock.now += 60
+    # a已过期，先替换a
+    cache.store(unit(0, 0, 1), "c")
+    assert cache.lookup(unit(0, 1, 0)) == "b"
+    assert cache.lookup(unit(0, 0, 1)) == "c"
+    # 都未过期时替换最久未使用的b
+    clock.now += 1
+    cache.lookup(unit(0, 0, 1))
+    cache.store(unit(1, 0, 0), "d")
+    assert cache.lookup(unit(0, 1, 0)) is None
+    assert cache.lookup(unit(1, 0, 0)) == "d"
+    assert cache.stats()["evictions"] == 2
+
+
+class FakeEmbeddings:
+    def embed_query(self, text):
+        return [1.0, 0.0]
+
+
+@pytest.mark.parametrize("small_response, cached", [
+    ("小模型的回答\n置信度: 0.9", False),
+    ("小模型的回答\n置信度: 0.2", True),
+])
+def test_cascade_only_caches_escalated_answers(monkeypatch, small_response, cached):
+    monkeypatch.setattr(base_agent, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(base_agent, "CASCADE_ENABLED", True)
+    monkeypatch.setattr(base_agent, "llm", FakeChatModel(response="大模型的回答", latency=0.0))
+    cache = SemanticCache("test", embeddings=FakeEmbeddings())
+    cascade = Cascade("test", llm=FakeChatModel(response=small_response, latency=0.0))
+    agent = base_agent.BaseAgent.create_agent("系统提示", semantic_cache=cache, cascade=cascade)
+
+    result = agent.invoke({"input": "问题"})
+    assert "escalated" not in result
+    assert cache.stats()["size"] == (1 if cached else 0)
+
+
+def test_disabled_cache_is_not_created():
+    from agents import bioinformatics_agent, chat_agent  # noqa: F401
+    assert not semantic_cache.ENABLED
+    assert {"chat", "bioinformatics"}.isdisjoint(semantic_cache.semantic_cache_stats())
+
+
+class RecordingEmbeddings(FakeEmbeddings):
+    def __init__(self, events):
+        self.events = events
+
+    def embed_query(self, text):
+        self.events.append("embed")
+        return super().embed_query(text)
+
+
+class RecordingHandler(BaseCallbackHandler):
+    def __init__(self, events):
+        self.events = events
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.events.append("llm")
+
+
+def test_bypass_skips_the_lookup_and_embeds_only_to_store(monkeypatch):
+    monkeypatch.setattr(base_agent, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(base_agent, "llm", FakeChatModel(response="新的回答", latency=0.0))
+    events = []
+    cache = SemanticCache("test", embeddings=RecordingEmbeddings(events))
+    cache.store(unit(1, 0), "旧的回答")
+    agent = base_agent.BaseAgent.create_agent("系统提示", semantic_cache=cache)
+
+    result = agent.invoke({"input": "问题", "bypass_cache": True}, {"callbacks": [RecordingHandler(events)]})
+    assert result["output"] == "新的回答"
+    # 回答之前不等待embedding
+    assert events == ["llm", "embed"]
+    assert cache.stats()["hits"] + cache.stats()["misses"] == 0
+    assert cache.lookup(unit(1, 0)) == "新的回答"
@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, StreamSingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "结果"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["结果"] * 5
+    assert len(calls) == 1
+    stats = flight.stats()
+    assert (stats["executions"], stats["coalesced"], stats["in_flight"]) == (1, 4, 0)
+
+
+def test_errors_reach_every_waiter():
+    flight = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("上游出错")
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_one_waiter_leaving_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def main():
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "结果"
+
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        return await second, first.cancelled()
+
+    assert asyncio.run(main()) == ("结果", True)
+    stats = flight.stats()
+    assert (stats["abandoned"], stats["cancelled"]) == (1, 0)
+
+
+def test_last_waiter_leaving_cancels_the_execution():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def work():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def main():
+        waiter = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert cancelled == [True]
+    stats = flight.stats()
+    assert (stats["cancelled"], stats["in_flight"]) == (1, 0)
+
+
+def test_late_stream_subscriber_replays_earlier_events():
+    flight = StreamSingleFlight()
+
+    async def main():
+        produced = asyncio.Event()
+        release = asyncio.Event()
+
+        async def events():
+            yield 1
+            yield 2
+            produced.set()
+            await release.wait()
+            yield 3
+
+        async def collect():
+            return [event async for event in flight.subscribe("key", events)]
+
+        early = asyncio.create_task(collect())
+        await produced.wait()
+        late = asyncio.create_task(collect())
+        await asyncio.sleep(0)
+        release.set()
+        return await early, await late
+
+    assert asyncio.run(main()) == ([1, 2, 3], [1, 2, 3])
+    stats = flight.stats()
+    assert (stats["executions"], stats["coalesced"]) == (1, 1)
+
+
+def test_stream_is_cancelled_when_every_subscriber_leaves():
+    flight = StreamSingleFlight()
+    cancelled = []
+
+    async def events():
+        yield "首个事件"
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+        yield "不会产生"
+
+    async def main():
+        stream = flight.subscribe("key", events)
+        assert await stream.__anext__() == "首个事件"
+        await stream.aclose()
+        await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    assert cancelled == [True]
+    assert flight.stats()["cancelled"] == 1
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
+
+from resilience import deadline_scope, remaining
+from speculation import METADATA_KEY, Speculator, speculation_config, TokenUsageHandler
+
+
+def slow_agent(seconds: float, seen: list):
+    """记录收到的配置元数据和截止时间的agent"""
+
+    def run(state, config=None):
+        seen.append((config["metadata"].get(METADATA_KEY), remaining()))
+        time.sleep(seconds)
+        return {"output": state["input"]}
+
+    async def arun(state, config=None):
+        seen.append((config["metadata"].get(METADATA_KEY), remaining()))
+        await asyncio.sleep(seconds)
+        return {"output": state["input"]}
+
+    return RunnableLambda(run, afunc=arun)
+
+
+def make_speculator(ttl: float = 30) -> Speculator:
+    speculator = Speculator(max_workers=2, ttl=ttl)
+    speculator.predict = lambda query: "chat"
+    return speculator
+
+
+def test_hit_is_taken_once_with_parent_config_and_deadline():
+    seen = []
+    speculator = make_speculator()
+
+    async def scenario():
+        with deadline_scope(time.time() + 10):
+            speculation = speculator.astart("问题", lambda route: slow_agent(0.01, seen), {"input": "问题"},
+                                            {"metadata": {"langgraph_node": "llm_call_router"}})
+        speculation_id = speculator.resolve(speculation, "chat")
+        assert await speculator.atake(speculation_id, "chat") == {"output": "问题"}
+        assert await speculator.atake(speculation_id, "chat") is None
+
+    asyncio.run(scenario())
+    (route, left), = seen
+    assert route == "chat"
+    assert left is not None and left > 9
+    assert speculator.stats()["pending"] == 0
+
+
+def test_sync_start_copies_context():
+    seen = []
+    speculator = make_speculator()
+    with deadline_scope(time.time() + 10):
+        speculation = speculator.start("问题", lambda route: slow_agent(0, seen), {"input": "问题"})
+    speculation_id = speculator.resolve(speculation, "chat")
+    assert speculator.take(speculation_id, "chat") == {"output": "问题"}
+    assert seen[0][1] is not None
+
+
+def test_miss_cancels_task():
+    speculator = make_speculator()
+
+    async def scenario():
+        speculation = speculator.astart("问题", lambda route: slow_agent(10, []), {"input": "问题"})
+        await asyncio.sleep(0)
+        assert speculator.resolve(speculation, "literature") is None
+        await asyncio.gather(speculation.future, return_exceptions=True)
+        assert speculation.future.cancelled()
+
+    asyncio.run(scenario())
+    assert speculator.stats()["misses"] == 1
+
+
+def test_untaken_hit_expires_and_is_cancelled():
+    speculator = make_speculator(ttl=0.02)
+
+    async def scenario():
+        speculation = speculator.astart("问题", lambda route: slow_agent(10, []), {"input": "问题"})
+        assert speculator.resolve(speculation, "chat") is not None
+        # 图在路由之后被取消，agent节点没有取用
+        await asyncio.sleep(0.05)
+        await asyncio.gather(speculation.future, return_exceptions=True)
+        assert speculation.future.cancelled()
+
+    asyncio.run(scenario())
+    stats = speculator.stats()
+    assert (stats["expired"], stats["pending"]) == (1, 0)
+
+
+def test_speculation_config_keeps_parent_callbacks():
+    class Parent(BaseCallbackHandler):
+        pass
+
+    parent = Parent()
+    usage = TokenUsageHandler()
+    config = speculation_config({"callbacks": [parent], "run_id": "x", "metadata": {"a": 1}}, "chat", usage)
+    assert config["callbacks"] == [parent, usage]
+    assert "run_id" not in config
+    assert config["metadata"] == {"a": 1, METADATA_KEY: "chat"}
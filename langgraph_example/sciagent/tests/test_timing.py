@@ -0,0 +1,44 @@
+import asyncio
+
+from langchain_core.runnables import RunnableLambda
+from langgraph.constants import TAG_NOSTREAM
+
+from timing import FirstTokenHandler, Timings, timed, timings_scope
+
+
+def test_first_token_ignores_nostream_runs():
+    timings = Timings()
+    handler = FirstTokenHandler(timings)
+    handler.on_llm_new_token("小模型", tags=[TAG_NOSTREAM, "seq:step:1"])
+    handler.on_llm_new_token("", tags=[])
+    assert "ttft" not in timings.durations
+    handler.on_llm_new_token("回答", tags=["seq:step:1"])
+    first = timings.durations["ttft"]
+    handler.on_llm_new_token("之后的token")
+    assert timings.durations["ttft"] == first
+
+
+def node_function():
+    def run(state, config=None):
+        return state
+
+    async def arun(state, config=None):
+        return state
+
+    return RunnableLambda(run, afunc=arun)
+
+
+def test_timed_records_only_inside_scope():
+    node = timed("agent", node_function())
+    parallel = timed("agent", node_function(), parallel=True)
+    timings = Timings()
+    node.invoke({})
+    assert timings.durations == {}
+    with timings_scope(timings):
+        node.invoke({})
+        asyncio.run(node.ainvoke({}))
+        parallel.invoke({})
+    assert "agent" in timings.durations
+    timings.finish()
+    assert timings.header().startswith("agent;dur=")
+    assert list(timings.as_dict()) == ["agent", "total"]
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+import tokens
+
+
+@pytest.fixture
+def fresh_encoder(monkeypatch):
+    monkeypatch.setattr(tokens, "_encoder", None)
+    monkeypatch.setattr(tokens, "_encoder_loaded", False)
+    monkeypatch.setattr(tokens, "_loading_in_background", False)
+
+
+def test_estimate_while_loading_in_background(fresh_encoder, monkeypatch):
+    monkeypatch.setattr(tokens, "_loading_in_background", True)
+    # 中文每个字符1个token，ASCII按4个字符1个token
+    assert tokens.count_tokens("你好abcd") == 3
+    assert not tokens._encoder_loaded
+
+
+def test_start_loading_runs_off_the_event_loop(fresh_encoder, monkeypatch):
+    monkeypatch.setattr(tokens, "ENCODING", "no_such_encoding")
+
+    async def main():
+        future = tokens.start_loading()
+        # 加载完成之前不阻塞，使用估算值
+        assert tokens.count_tokens("abcdefgh") == 2
+        await future
+
+    asyncio.run(main())
+    assert tokens._encoder_loaded
+    assert tokens.count_tokens("abcdefgh") == 2
+
+
+def test_sync_callers_load_on_first_use(fresh_encoder, monkeypatch):
+    loaded = []
+    monkeypatch.setattr(tokens, "load_encoder", lambda: loaded.append(True))
+    tokens.count_tokens("文本")
+    assert loaded == [True]
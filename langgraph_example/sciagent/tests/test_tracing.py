@@ -0,0 +1,117 @@
+import asyncio
+import importlib
+import sys
+from typing import Optional
+
+import pytest
+from langchain_core.messages import HumanMessage
+from langchain_core.runnables import RunnableLambda
+from langgraph.graph import END, START, StateGraph
+from typing_extensions import TypedDict
+
+import tracing
+from fake_llm import FakeChatModel
+
+
+@pytest.fixture
+def reload_tracing(monkeypatch):
+    """按给定的环境变量重新导入tracing，测试结束后恢复为默认配置"""
+
+    def reload(exporter: str):
+        monkeypatch.setenv("SCIAGENT_TRACING", exporter)
+        return importlib.reload(tracing)
+
+    yield reload
+    monkeypatch.delenv("SCIAGENT_TRACING", raising=False)
+    monkeypatch.delitem(sys.modules, "opentelemetry", raising=False)
+    importlib.reload(tracing)
+
+
+class State(TypedDict):
+    input: str
+    decision: Optional[str]
+    output: str
+    usage: Optional[dict]
+
+
+def build_graph(module):
+    llm = FakeChatModel(response="回答", latency=0.0)
+
+    async def route(state, config=None):
+        return {"decision": "chat"}
+
+    async def agent_function(state, config=None):
+        result = await llm.ainvoke([HumanMessage(content=state["input"])], config=config)
+        return {"output": result.content, "usage": result.usage_metadata}
+
+    def node(name, afunc):
+        return module.traced(name, RunnableLambda(lambda state, config=None: None, afunc=afunc, name=name))
+
+    agent = module.traced("agent_function", RunnableLambda(lambda state, config=None: None, afunc=agent_function))
+
+    async def chat_agent(state, config=None):
+        return await agent.ainvoke(state, config)
+
+    builder = StateGraph(State)
+    builder.add_node("llm_call_router", node("llm_call_router", route))
+    builder.add_node("chat_agent", node("chat_agent", chat_agent))
+    builder.add_edge(START, "llm_call_router")
+    builder.add_edge("llm_call_router", "chat_agent")
+    builder.add_edge("chat_agent", END)
+    return builder.compile()
+
+
+def test_spans_nest_router_and_agent_under_the_request(reload_tracing, tmp_path, monkeypatch):
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+    monkeypatch.setenv("SCIAGENT_TRACE_FILE", str(tmp_path / "traces.jsonl"))
+    module = reload_tracing("jsonl")
+    assert module.ENABLED
+    exporter = InMemorySpanExporter()
+    provider = TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(exporter))
+    monkeypatch.setattr(module, "tracer", provider.get_tracer("test"))
+
+    graph = build_graph(module)
+
+    async def main():
+        with module.tracer.start_as_current_span("POST /api/query"):
+            config = {"callbacks": module.callbacks()}
+            return await graph.ainvoke({"input": "你好"}, config)
+
+    assert asyncio.run(main())["output"] == "回答"
+    spans = {span.name: span for span in exporter.get_finished_spans()}
+    parent = {name: span.parent.span_id if span.parent else None for name, span in spans.items()}
+    span_id = {name: span.context.span_id for name, span in spans.items()}
+
+    assert parent["POST /api/query"] is None
+    assert parent["llm_call_router"] == span_id["POST /api/query"]
+    assert parent["chat_agent"] == span_id["POST /api/query"]
+    assert parent["agent_function"] == span_id["chat_agent"]
+    llm_span = next(name for name in spans if name.startswith("chat "))
+    assert parent[llm_span] == span_id["agent_function"]
+    assert spans["llm_call_router"].attributes["sciagent.route"] == "chat"
+    assert spans["agent_function"].attributes["gen_ai.usage.output_tokens"] == 20
+    assert spans["agent_function"].attributes["sciagent.cached"] is False
+
+
+def test_unsampled_requests_create_no_spans(reload_tracing, tmp_path, monkeypatch):
+    monkeypatch.setenv("SCIAGENT_TRACE_FILE", str(tmp_path / "traces.jsonl"))
+    module = reload_tracing("jsonl")
+    # 没有根span（未采样）时不注册回调
+    assert module.callbacks() == []
+
+
+def test_tracing_is_a_noop_without_opentelemetry(reload_tracing, monkeypatch, caplog):
+    # sys.modules中为None的模块导入时抛出ImportError
+    monkeypatch.setitem(sys.modules, "opentelemetry", None)
+    module = reload_tracing("jsonl")
+    assert not module.ENABLED
+    assert "opentelemetry-sdk" in caplog.text
+
+    runnable = RunnableLambda(lambda state, config=None: state)
+    assert module.traced("chat_agent", runnable) is runnable
+    assert module.callbacks() == []
+    module.shutdown()
@@ -0,0 +1,124 @@
+"""
+单个请求的耗时分解，请求体中 debug 为 true 时返回（Server-Timing响应头和响应中的timings字段）
+
+- queue: 准入排队，以及等待同一用户上一轮对话完成的时间
+- router: 路由节点的耗时（路由缓存、关键词规则或快速路由命中时接近0）
+- agent: agent节点的耗时（多agent模式取最慢的一个）
+- ttft: 从收到请求到agent的LLM生成第一个推送给客户端的token（没有推送token时不记录）
+- memory: 更新对话记忆（只有带user_id的请求；摘要在回答发送之后生成，不计入）
+- serialize: 序列化响应的时间（流式接口为所有事件的序列化时间之和）
+- total: 从收到请求到生成响应
+
+耗时通过上下文变量传给图中的节点，没有开启debug的请求只多一次上下文变量读取。
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
+
+PHASES = ("queue", "router", "agent", "ttft", "memory", "serialize", "total")
+
+_current: contextvars.ContextVar[Optional["Timings"]] = contextvars.ContextVar("sciagent_timings", default=None)
+
+
+class Timings:
+    """一个请求各阶段的耗时（秒）"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+
+    def longest(self, phase: str, seconds: float) -> None:
+        """并行执行的阶段取最长的一个"""
+        self.durations[phase] = max(self.durations.get(phase, 0.0), seconds)
+
+    def mark(self, phase: str) -> None:
+        """记录从收到请求到现在的时间，只记录第一次"""
+        self.durations.setdefault(phase, time.perf_counter() - self.start)
+
+    def finish(self) -> None:
+        self.durations["total"] = time.perf_counter() - self.start
+
+    def as_dict(self) -> Dict[str, float]:
+        """各阶段的耗时（毫秒）"""
+        return {phase: round(self.durations[phase] * 1000, 2) for phase in PHASES if phase in self.durations}
+
+    def header(self) -> str:
+        """Server-Timing响应头"""
+        return ", ".join(f"{phase};dur={ms}" for phase, ms in self.as_dict().items())
+
+
+@contextmanager
+def timings_scope(timings: Optional[Timings]):
+    token = _current.set(timings)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+class FirstTokenHandler(BaseCallbackHandler):
+    """记录第一个推送给客户端的token的时间
+
+    流式工作流中所有LLM调用都会产生token回调，带TAG_NOSTREAM标签的调用（级联的小模型、map-reduce的map阶段、
+    对话摘要）的输出不推送给客户端，不计入；路由器使用结构化输出，不产生文本token
+    """
+
+    # 在事件循环中直接调用，不放到线程池
+    run_inline = True
+
+    def __init__(self, timings: Timings):
+        # 标签的值随langgraph版本变化（0.3为"langsmith:nostream"，1.x为"nostream"），从langgraph读取；
+        # 只有debug请求创建handler，此时工作流已经导入了langgraph
+        from langgraph.constants import TAG_NOSTREAM
+
+        self.timings = timings
+        self.nostream_tag = TAG_NOSTREAM
+
+    def on_llm_new_token(self, token: str, *, tags: Optional[List[str]] = None, **kwargs) -> None:
+        if token and not (tags and self.nostream_tag in tags):
+            self.timings.mark("ttft")
+
+
+def timed(phase: str, runnable: RunnableLambda, parallel: bool = False) -> RunnableLambda:
+    """记录节点的耗时；parallel为True时（多agent模式的并行分支）取最长的一个
+
+    与metrics.instrument一样直接包装RunnableLambda的函数，不增加调用层级
+    """
+    func, afunc = runnable.func, runnable.afunc
+
+    def record(timings: Timings, start: float) -> None:
+        seconds = time.perf_counter() - start
+        if parallel:
+            timings.longest(phase, seconds)
+        else:
+            timings.add(phase, seconds)
+
+    def run(state: dict, config=None):
+        timings = _current.get()
+        if timings is None:
+            return func(state, config)
+        start = time.perf_counter()
+        try:
+            return func(state, config)
+        finally:
+            record(timings, start)
+
+    async def arun(state: dict, config=None):
+        timings = _current.get()
+        if timings is None:
+            return await afunc(state, config)
+        start = time.perf_counter()
+        try:
+            return await afunc(state, config)
+        finally:
+            record(timings, start)
+
+    return RunnableLambda(run, afunc=arun, name=runnable.name)
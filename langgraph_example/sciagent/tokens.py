@@ -0,0 +1,78 @@
+"""
+token计数
+
+优先使用tiktoken（gpt-4o使用o200k_base编码）；tiktoken未安装或编码文件无法下载时退回到估算:
+非ASCII字符（中文等）每个字符计1个token，ASCII文本按每4个字符1个token计。
+估算值只用于控制提示长度，不用于计费。
+
+第一次加载编码时tiktoken可能要联网下载编码文件（离线时要等到连接失败）。API启动时调用start_loading()
+在线程池中加载，加载完成之前count_tokens使用估算值，不在事件循环上等待下载；
+脚本和测试中没有调用start_loading()时，第一次计数时同步加载。
+"""
+
+import asyncio
+import logging
+import os
+import threading
+from typing import Iterable
+
+logger = logging.getLogger(__name__)
+
+ENCODING = os.getenv("SCIAGENT_TOKEN_ENCODING", "o200k_base")
+# 每条消息的角色等格式开销
+MESSAGE_OVERHEAD = 4
+
+_encoder = None
+_encoder_loaded = False
+_encoder_lock = threading.Lock()
+# 已交给后台线程加载
+_loading_in_background = False
+
+
+def load_encoder():
+    """加载tiktoken编码，可能需要下载编码文件，不要在事件循环上调用"""
+    global _encoder, _encoder_loaded
+    if not _encoder_loaded:
+        with _encoder_lock:
+            if not _encoder_loaded:
+                try:
+                    import tiktoken
+                    _encoder = tiktoken.get_encoding(ENCODING)
+                except Exception as e:
+                    logger.warning("无法加载tiktoken编码 %s，使用估算的token数: %s", ENCODING, e)
+                _encoder_loaded = True
+    return _encoder
+
+
+def start_loading() -> "asyncio.Future":
+    """在默认线程池中加载编码（API启动时调用），返回可以等待的future"""
+    global _loading_in_background
+    _loading_in_background = True
+    return asyncio.get_running_loop().run_in_executor(None, load_encoder)
+
+
+def _get_encoder():
+    if _encoder_loaded:
+        return _encoder
+    if _loading_in_background:
+        # 后台还在加载（可能在下载编码文件），先使用估算值
+        return None
+    return load_encoder()
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoder = _get_encoder()
+    if encoder is not None:
+        return len(encoder.encode(text))
+    non_ascii = sum(1 for ch in text if not ch.isascii())
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+def count_message_tokens(messages: Iterable) -> int:
+    """消息列表的token数，消息可以是LangChain消息或字符串"""
+    return sum(
+        count_tokens(message if isinstance(message, str) else message.content) + MESSAGE_OVERHEAD
+        for message in messages
+    )
@@ -0,0 +1,229 @@
+"""
+OpenTelemetry追踪
+
+每个查询请求是一棵span树：HTTP请求 -> 路由节点 -> LLM调用 -> agent节点 -> agent函数 -> LLM调用。
+LLM调用的span带有模型名和token用量（gen_ai.* 属性），路由节点带有路由结果，agent函数带有是否命中缓存。
+
+- 采样在HTTP请求开始时决定（head-based）：按 SCIAGENT_TRACE_SAMPLE_RATE 的比例采样，
+  请求头带有W3C traceparent时沿用上游的采样决定。未采样的请求不创建span，节点只多一次上下文变量读取
+- 导出: jsonl写入本地文件（离线可用，每行一个span），otlp发送到 OTEL_EXPORTER_OTLP_ENDPOINT
+  （需要安装opentelemetry-exporter-otlp-proto-http）
+- 只追踪API请求；命令行交互和离线基准测试没有HTTP请求，不产生span
+
+配置（环境变量）:
+- SCIAGENT_TRACING: jsonl 或 otlp，默认不开启（需要安装opentelemetry-sdk，未安装时记录警告，不开启追踪）
+- SCIAGENT_TRACE_FILE: jsonl文件的路径，默认traces.jsonl
+- SCIAGENT_TRACE_SAMPLE_RATE: 采样比例，默认0.1
+"""
+
+import logging
+import os
+import threading
+from typing import Dict
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.runnables import RunnableLambda
+
+logger = logging.getLogger(__name__)
+
+EXPORTER = os.getenv("SCIAGENT_TRACING", "").lower()
+TRACE_FILE = os.getenv("SCIAGENT_TRACE_FILE", "traces.jsonl")
+SAMPLE_RATE = float(os.getenv("SCIAGENT_TRACE_SAMPLE_RATE", "0.1"))
+ENABLED = EXPORTER in ("jsonl", "otlp")
+
+# 追踪的HTTP接口
+PATHS = ("/api/query", "/api/query/stream", "/api/query/batch")
+
+if ENABLED:
+    try:
+        from opentelemetry import propagate, trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+        from opentelemetry.trace import SpanKind, Status, StatusCode
+    except ImportError:
+        # 追踪是可选的，缺少依赖时不影响服务启动
+        logger.warning("SCIAGENT_TRACING=%s 需要安装opentelemetry-sdk（pip install opentelemetry-sdk），追踪未开启",
+                       EXPORTER)
+        ENABLED = False
+
+if ENABLED:
+    class JsonlSpanExporter(SpanExporter):
+        """把span逐行写入本地JSONL文件"""
+
+        def __init__(self, path: str):
+            self._file = open(path, "a", encoding="utf-8")
+            self._lock = threading.Lock()
+
+        def export(self, spans):
+            lines = "".join(span.to_json(indent=None) + "\n" for span in spans)
+            with self._lock:
+                self._file.write(lines)
+                self._file.flush()
+            return SpanExportResult.SUCCESS
+
+        def shutdown(self) -> None:
+            with self._lock:
+                self._file.close()
+
+    def _exporter() -> SpanExporter:
+        if EXPORTER == "jsonl":
+            return JsonlSpanExporter(TRACE_FILE)
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            raise ImportError("使用OTLP导出需要安装opentelemetry-exporter-otlp-proto-http: "
+                              "pip install opentelemetry-exporter-otlp-proto-http")
+        return OTLPSpanExporter()
+
+    _provider = TracerProvider(
+        sampler=ParentBased(TraceIdRatioBased(SAMPLE_RATE)),
+        resource=Resource.create({"service.name": "sciagent"}),
+    )
+    _provider.add_span_processor(BatchSpanProcessor(_exporter()))
+    tracer = _provider.get_tracer("sciagent")
+
+
+def _recording() -> bool:
+    return trace.get_current_span().is_recording()
+
+
+def _set_agent(span, state: dict) -> None:
+    # 路由节点执行时还没有决定agent
+    if state.get("decision"):
+        span.set_attribute("sciagent.agent", state["decision"])
+
+
+def _set_result_attributes(span, result) -> None:
+    if not isinstance(result, dict):
+        return
+    if result.get("decision"):
+        span.set_attribute("sciagent.route", result["decision"])
+    if result.get("decisions"):
+        span.set_attribute("sciagent.routes", list(result["decisions"]))
+    usage = result.get("usage")
+    if usage:
+        span.set_attribute("gen_ai.usage.input_tokens", usage.get("input_tokens", 0))
+        span.set_attribute("gen_ai.usage.output_tokens", usage.get("output_tokens", 0))
+    if "output" in result:
+        # 语义缓存命中的回答没有调用LLM，也就没有用量
+        span.set_attribute("sciagent.cached", not usage)
+
+
+def traced(name: str, runnable: RunnableLambda) -> RunnableLambda:
+    """在已采样的请求中为节点或agent函数创建span，返回结果中的路由和token用量记为属性
+
+    与metrics.instrument一样直接包装RunnableLambda的函数，不增加调用层级
+    """
+    if not ENABLED:
+        return runnable
+    func, afunc = runnable.func, runnable.afunc
+
+    def run(state: dict, config=None):
+        if not _recording():
+            return func(state, config)
+        with tracer.start_as_current_span(name) as span:
+            _set_agent(span, state)
+            result = func(state, config)
+            _set_result_attributes(span, result)
+            return result
+
+    async def arun(state: dict, config=None):
+        if not _recording():
+            return await afunc(state, config)
+        with tracer.start_as_current_span(name) as span:
+            _set_agent(span, state)
+            result = await afunc(state, config)
+            _set_result_attributes(span, result)
+            return result
+
+    return RunnableLambda(run, afunc=arun, name=name)
+
+
+class LLMSpanHandler(BaseCallbackHandler):
+    """为每次LLM调用创建span，父span为发起调用的节点或agent函数"""
+
+    # 在发起调用的协程中直接执行，才能取到当前的span
+    run_inline = True
+
+    def __init__(self):
+        self._spans: Dict[UUID, object] = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, metadata=None, **kwargs) -> None:
+        params = kwargs.get("invocation_params") or {}
+        model = params.get("model") or params.get("model_name") or (metadata or {}).get("ls_model_name", "")
+        span = tracer.start_span(f"chat {model}", kind=SpanKind.CLIENT)
+        span.set_attribute("gen_ai.operation.name", "chat")
+        span.set_attribute("gen_ai.system", "openai")
+        span.set_attribute("gen_ai.request.model", model)
+        span.set_attribute("gen_ai.request.stream", bool(params.get("stream")))
+        self._spans[run_id] = span
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is None:
+            return
+        try:
+            message = response.generations[0][0].message
+        except (IndexError, AttributeError):
+            message = None
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            span.set_attribute("gen_ai.usage.input_tokens", usage.get("input_tokens", 0))
+            span.set_attribute("gen_ai.usage.output_tokens", usage.get("output_tokens", 0))
+        model = (getattr(message, "response_metadata", None) or {}).get("model_name")
+        if model:
+            span.set_attribute("gen_ai.response.model", model)
+        span.end()
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs) -> None:
+        span = self._spans.pop(run_id, None)
+        if span is not None:
+            span.record_exception(error)
+            span.set_status(Status(StatusCode.ERROR, type(error).__name__))
+            span.end()
+
+
+def callbacks() -> list:
+    """工作流配置中的回调：当前请求已采样时记录LLM调用"""
+    return [LLMSpanHandler()] if ENABLED and _recording() else []
+
+
+class TracingMiddleware:
+    """为查询接口创建请求的根span（纯ASGI中间件，不包装receive）"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in PATHS:
+            return await self.app(scope, receive, send)
+        carrier = {
+            key.decode("latin-1"): value.decode("latin-1")
+            for key, value in scope["headers"] if key in (b"traceparent", b"tracestate")
+        }
+        span = tracer.start_span(f"{scope['method']} {scope['path']}", context=propagate.extract(carrier),
+                                 kind=SpanKind.SERVER)
+        if not span.is_recording():
+            return await self.app(scope, receive, send)
+
+        span.set_attribute("http.request.method", scope["method"])
+        span.set_attribute("url.path", scope["path"])
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.response.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.set_status(Status(StatusCode.ERROR))
+            await send(message)
+
+        with trace.use_span(span, end_on_exit=True):
+            await self.app(scope, receive, send_with_status)
+
+
+def shutdown() -> None:
+    """导出尚未发送的span（服务关闭时调用）"""
+    if ENABLED:
+        _provider.shutdown()